@@ -0,0 +1,278 @@
+"""
+Output of app processes: captured through non-blocking pipes by a reader thread and kept per app in size-capped logs.
+
+A log is a folder of segment files named by the offset of their first byte in the app's output, so offsets stay valid
+across rotation and all daemon processes read and append to the same logs. Lines are stored as
+``<time> <worker> <stream> <text>``.
+"""
+
+import fcntl
+import logging as log
+import os
+import selectors
+import shutil
+import tempfile
+import threading
+import time
+from typing import IO, Dict, List, Optional, Tuple, Union
+
+LOG = log.getLogger()
+
+READ_SIZE = 65536
+MAX_LINE = 16384
+SEGMENT_SUFFIX = ".log"
+
+
+class AppLogs:
+    """Logs of all apps in ``root``, at most ``max_bytes`` per app in ``segments`` files."""
+
+    def __init__(self, root: str, max_bytes: int = 8 * 1024 * 1024, segments: int = 4):
+        self.root = root
+        self.segment_size = max(max_bytes // segments, READ_SIZE)
+        self.segments = segments
+        os.makedirs(root, exist_ok=True)
+
+    def _folder(self, app_name: str) -> str:
+        return os.path.join(self.root, app_name)
+
+    def _segments(self, app_name: str) -> List[Tuple[int, str]]:
+        folder = self._folder(app_name)
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            (int(i[: -len(SEGMENT_SUFFIX)]), os.path.join(folder, i)) for i in names if i.endswith(SEGMENT_SUFFIX)
+        )
+
+    def write(self, app_name: str, data: bytes) -> None:
+        """Appends complete lines, the segment is rotated once it reached its size."""
+        folder = self._folder(app_name)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "lock"), "a", encoding="utf8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            segments = self._segments(app_name)
+            start, segment_path = segments[-1] if segments else (0, os.path.join(folder, _segment_name(0)))
+            with open(segment_path, "ab") as segment:
+                segment.write(data)
+                size = segment.tell()
+            if size < self.segment_size:
+                return
+            with open(os.path.join(folder, _segment_name(start + size)), "ab"):
+                pass
+            for _, old_path in segments[: max(len(segments) + 1 - self.segments, 0)]:
+                os.unlink(old_path)
+
+    def end(self, app_name: str) -> int:
+        segments = self._segments(app_name)
+        if not segments:
+            return 0
+        start, segment_path = segments[-1]
+        try:
+            return start + os.path.getsize(segment_path)
+        except FileNotFoundError:
+            return start
+
+    def tail_offset(self, app_name: str, lines: int) -> int:
+        """Offset of the last ``lines`` lines."""
+        segments = self._segments(app_name)
+        found = 0
+        for start, segment_path in reversed(segments):
+            try:
+                with open(segment_path, "rb") as segment:
+                    position = segment.seek(0, os.SEEK_END)
+                    while position > 0:
+                        step = min(READ_SIZE, position)
+                        position -= step
+                        segment.seek(position)
+                        block = segment.read(step)
+                        end = len(block)
+                        while True:
+                            newline = block.rfind(b"\n", 0, end)
+                            if newline < 0:
+                                break
+                            found += 1
+                            if found > lines:
+                                return start + position + newline + 1
+                            end = newline
+            except FileNotFoundError:
+                continue
+        return segments[0][0] if segments else 0
+
+    def read(self, app_name: str, offset: Optional[int] = None, max_bytes: int = READ_SIZE) -> Tuple[int, int, list]:
+        """Reads complete lines from ``offset``, by default from the start of the kept output.
+
+        Returns the offset the lines start at, later than ``offset`` if the output there is rotated out already, the
+        offset of the next line and the lines as dicts with ``offset``, ``time``, ``worker``, ``stream`` and ``line``.
+        """
+        for _ in range(3):
+            segments = self._segments(app_name)
+            if not segments:
+                return 0, 0, []
+            if offset is None or offset < segments[0][0]:
+                offset = segments[0][0]
+            start, segment_path = next((k, v) for k, v in reversed(segments) if k <= offset)
+            try:
+                with open(segment_path, "rb") as segment:
+                    offset = min(offset, start + segment.seek(0, os.SEEK_END))
+                    segment.seek(offset - start)
+                    data = segment.read(max_bytes)
+            except FileNotFoundError:
+                continue  # rotated out meanwhile
+            data = data[: data.rfind(b"\n") + 1]
+            return offset, offset + len(data), _parse(data, offset)
+        return offset or 0, offset or 0, []
+
+    def remove(self, app_name: str) -> None:
+        shutil.rmtree(self._folder(app_name), ignore_errors=True)
+
+
+def _segment_name(offset: int) -> str:
+    return f"{offset:020d}{SEGMENT_SUFFIX}"
+
+
+def _parse(data: bytes, offset: int) -> list:
+    entries = []
+    for line in data.split(b"\n")[:-1]:
+        fields = line.decode("utf8", errors="replace").split(" ", 3)
+        if len(fields) == 4:
+            entries.append(
+                {
+                    "offset": offset,
+                    "time": float(fields[0]),
+                    "worker": fields[1],
+                    "stream": fields[2],
+                    "line": fields[3],
+                }
+            )
+        offset += len(line) + 1
+    return entries
+
+
+class _Output:
+    __slots__ = ("app_name", "prefix", "source", "pending")
+
+    def __init__(self, app_name: str, worker: int, stream: str, source: Union[int, IO[bytes]]):
+        self.app_name = app_name
+        self.prefix = f" {worker} {stream} ".encode()
+        self.source = source
+        self.pending = b""
+
+    def fileno(self) -> int:
+        return self.source if isinstance(self.source, int) else self.source.fileno()
+
+    def lines(self, data: bytes, stamp: bytes, final: bool = False) -> List[bytes]:
+        data = self.pending + data
+        lines = data.split(b"\n")
+        self.pending = lines.pop()
+        if final and self.pending:
+            lines.append(self.pending)
+            self.pending = b""
+        elif len(self.pending) >= MAX_LINE:
+            lines.append(self.pending)
+            self.pending = b""
+        result = []
+        for line in lines:
+            for i in range(0, max(len(line), 1), MAX_LINE):
+                result.append(stamp + self.prefix + line[i : i + MAX_LINE] + b"\n")
+        return result
+
+    def close(self) -> None:
+        if isinstance(self.source, int):
+            os.close(self.source)
+        else:
+            self.source.close()
+
+
+class OutputCapture:
+    """Reads stdout and stderr of app processes on one thread and appends them to :py:class:`AppLogs`.
+
+    Pipes are non-blocking, so the thread only waits in ``select``. An app writing faster than its log is written
+    blocks in its own ``write`` once its pipe is full, the daemon is never blocked by it.
+    """
+
+    def __init__(self, logs: AppLogs):
+        self.logs = logs
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._added: List[_Output] = []
+        self._thread: Optional[threading.Thread] = None
+        self._fifo_folder: Optional[str] = None
+
+    def add(self, app_name: str, worker: int, stream: str, source: Union[int, IO[bytes]]) -> None:
+        """Captures the pipe (a file object or a descriptor) until its end, then closes it."""
+        output = _Output(app_name, worker, stream, source)
+        os.set_blocking(output.fileno(), False)
+        with self._lock:
+            self._added.append(output)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="app-output", daemon=True)
+                self._thread.start()
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def fifos(self, count: int) -> Tuple[List[str], List[int]]:
+        """Named pipes for processes that are not started by the daemon itself, with their read ends opened.
+
+        The paths can be unlinked once the writer opened them.
+        """
+        with self._lock:
+            if self._fifo_folder is None:
+                self._fifo_folder = tempfile.mkdtemp(prefix="nc_sea_daemon-")
+        paths, fds = [], []
+        try:
+            for _ in range(count):
+                fifo_path = tempfile.mktemp(dir=self._fifo_folder)
+                os.mkfifo(fifo_path, 0o600)
+                paths.append(fifo_path)
+                fds.append(os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK))
+        except OSError:
+            for i in fds:
+                os.close(i)
+            for i in paths:
+                os.unlink(i)
+            raise
+        return paths, fds
+
+    def _loop(self) -> None:
+        while True:
+            events = self._selector.select()
+            stamp = f"{time.time():.3f}".encode()
+            chunks: Dict[str, List[bytes]] = {}
+            for key, _ in events:
+                if key.fileobj == self._wakeup_r:
+                    try:
+                        os.read(self._wakeup_r, 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                output: _Output = key.data
+                try:
+                    data = os.read(output.fileno(), READ_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b""
+                if data:
+                    chunks.setdefault(output.app_name, []).extend(output.lines(data, stamp))
+                    continue
+                chunks.setdefault(output.app_name, []).extend(output.lines(b"", stamp, final=True))
+                self._selector.unregister(key.fileobj)
+                output.close()
+            with self._lock:
+                added, self._added = self._added, []
+            for output in added:
+                self._selector.register(output.fileno(), selectors.EVENT_READ, output)
+            for app_name, lines in chunks.items():
+                if not lines:
+                    continue
+                try:
+                    self.logs.write(app_name, b"".join(lines))
+                except OSError as e:
+                    LOG.warning("can not write output of %s: %s", app_name, e)
@@ -3,28 +3,39 @@ Simplest example.
 """
 
 import sys
+from os import environ
 
 from uvicorn import run
 from fastapi.responses import Response
 from fastapi import FastAPI
 
-from nextcloud_sdk import Nextcloud
+from nextcloud_sdk import AsyncNextcloud, metrics
 
 
 APP = FastAPI()
-NC_CLIENT = Nextcloud()
+NC_CLIENT = AsyncNextcloud(coalesce=True)
 
 
 @APP.get("/iframe")
-def hello_world():
-    return Response(f"Hello world! \nHere is the list of Nextcloud users:\n {NC_CLIENT.users.list_users()}")
+async def hello_world():
+    return Response(f"Hello world! \nHere is the list of Nextcloud users:\n {await NC_CLIENT.users.list_users()}")
+
+
+@APP.get("/metrics")
+async def nc_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@APP.on_event("shutdown")
+async def shutdown():
+    await NC_CLIENT.close()
 
 
 if __name__ == "__main__":
     run(
         "hello_world:APP",
         host="127.0.0.1",
-        port=8777,
+        port=int(environ.get("app_port", 8777)),
         log_level=40,
     )
     sys.exit(0)
@@ -1 +1,4 @@
-from .nextcloud import Nextcloud
+from .cache import ResponseCache
+from .pool import AsyncConnectionPool, ConnectionPool
+from .resilience import CircuitBreaker, RetryPolicy
+from .nextcloud import AsyncNextcloud, Nextcloud
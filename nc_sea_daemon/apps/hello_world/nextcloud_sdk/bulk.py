@@ -0,0 +1,119 @@
+"""
+Helpers for running many independent API calls concurrently, with per-item results instead of exceptions.
+
+The bulk methods of the APIs retry calls failed with 429 or 503 only if the connection does not retry them itself with
+its ``RetryPolicy``, as the attempts of both would multiply.
+"""
+
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Iterable, List, Optional
+
+from . import exceptions
+
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+MAX_RETRY_AFTER = 30.0
+RETRY_ON = (exceptions.NextcloudTooManyRequests, exceptions.NextcloudServiceUnavailable)
+DEFAULT_RETRIES = 3
+
+
+@dataclass
+class BulkResult:
+    item: Any
+    result: Any = None
+    error: Optional[Exception] = None
+    attempts: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def retry_delay(attempt: int, error: Exception, max_retry_after: float = MAX_RETRY_AFTER) -> Optional[float]:
+    """Seconds to wait before the next attempt, ``None`` if the server asks to wait longer than ``max_retry_after``."""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return retry_after if retry_after <= max_retry_after else None
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt) * random.uniform(0.5, 1.0)
+
+
+def bulk_retries(connection: Any, retries: Optional[int]) -> int:
+    """``retries`` if set, otherwise ``DEFAULT_RETRIES`` or none if the connection already retries 429 and 503."""
+    if retries is not None:
+        return retries
+    policy = connection.retry
+    if policy.retries and all(i in policy.retry_statuses for i in (429, 503)):
+        return 0
+    return DEFAULT_RETRIES
+
+
+def _call(func: Callable[[Any], Any], item: Any, retries: int, max_retry_after: float) -> BulkResult:
+    bulk_result = BulkResult(item)
+    while True:
+        bulk_result.attempts += 1
+        try:
+            bulk_result.result = func(item)
+            return bulk_result
+        except RETRY_ON as e:
+            delay = retry_delay(bulk_result.attempts - 1, e, max_retry_after)
+            if bulk_result.attempts > retries or delay is None:
+                bulk_result.error = e
+                return bulk_result
+            time.sleep(delay)
+        except Exception as e:  # noqa # pylint: disable=broad-except
+            bulk_result.error = e
+            return bulk_result
+
+
+async def _acall(
+    func: Callable[[Any], Awaitable], item: Any, retries: int, max_retry_after: float, semaphore: asyncio.Semaphore
+) -> BulkResult:
+    bulk_result = BulkResult(item)
+    while True:
+        bulk_result.attempts += 1
+        try:
+            async with semaphore:
+                bulk_result.result = await func(item)
+            return bulk_result
+        except RETRY_ON as e:
+            delay = retry_delay(bulk_result.attempts - 1, e, max_retry_after)
+            if bulk_result.attempts > retries or delay is None:
+                bulk_result.error = e
+                return bulk_result
+            await asyncio.sleep(delay)
+        except Exception as e:  # noqa # pylint: disable=broad-except
+            bulk_result.error = e
+            return bulk_result
+
+
+def run_bulk(
+    func: Callable[[Any], Any],
+    items: Iterable,
+    concurrency: int = 8,
+    retries: int = DEFAULT_RETRIES,
+    max_retry_after: float = MAX_RETRY_AFTER,
+) -> List[BulkResult]:
+    """Calls ``func`` for each item from a pool of ``concurrency`` threads, results are in the order of items.
+
+    Calls failed with 429 or 503 are retried up to ``retries`` times with jittered exponential backoff,
+    honoring ``Retry-After`` up to ``max_retry_after`` seconds: the call is not retried when the server asks to wait
+    longer. Any other error is stored in the result of the item.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda item: _call(func, item, retries, max_retry_after), items))
+
+
+async def arun_bulk(
+    func: Callable[[Any], Awaitable],
+    items: Iterable,
+    concurrency: int = 8,
+    retries: int = DEFAULT_RETRIES,
+    max_retry_after: float = MAX_RETRY_AFTER,
+) -> List[BulkResult]:
+    """Async version of :py:func:`run_bulk`, at most ``concurrency`` calls are in flight at once."""
+    semaphore = asyncio.Semaphore(concurrency)
+    return list(await asyncio.gather(*[_acall(func, item, retries, max_retry_after, semaphore) for item in items]))
@@ -0,0 +1,115 @@
+"""
+Opt-in cache of decoded responses for read requests, invalidated by mutating requests to the same resources.
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Iterable, Optional
+
+
+class CacheEntry:
+    __slots__ = ("path", "value", "etag", "expires")
+
+    def __init__(self, path: str, value: Any, etag: Optional[str], expires: float):
+        self.path = path
+        self.value = value
+        self.etag = etag
+        self.expires = expires
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires
+
+
+class ResponseCache:
+    """LRU cache of decoded responses with per-endpoint TTLs and ETag revalidation.
+
+    Cached values are shared between callers and must not be modified. Entries are kept per user, so one cache can be
+    shared by the connections of different users.
+
+    :param ttl: seconds a response is served without asking the server.
+    :param max_entries: number of responses to keep, least recently used are evicted first.
+    :param ttl_by_path: TTL overrides for endpoints, the longest matching path prefix wins.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 1024, ttl_by_path: Optional[Dict[str, float]] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.ttl_by_path = sorted((ttl_by_path or {}).items(), key=lambda x: len(x[0]), reverse=True)
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[Any, CacheEntry]" = OrderedDict()
+        self._lock = Lock()
+
+    def ttl_for(self, path: str) -> float:
+        for prefix, ttl in self.ttl_by_path:
+            if path.startswith(prefix):
+                return ttl
+        return self.ttl
+
+    def lookup(self, key: Any) -> Optional[CacheEntry]:
+        """Returns the entry for the key, which may be stale. Counts a hit only for fresh entries."""
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry.fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def store(self, key: Any, path: str, value: Any, etag: Optional[str] = None) -> None:
+        ttl = self.ttl_for(path)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = CacheEntry(path, value, etag, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def refresh(self, entry: CacheEntry) -> None:
+        """Marks a stale entry as fresh again, after the server confirmed it did not change."""
+        with self._lock:
+            entry.expires = time.monotonic() + self.ttl_for(entry.path)
+            self.revalidated += 1
+
+    def invalidate(self, paths: Iterable[str]) -> None:
+        """Drops entries for the paths, their parents and their children."""
+        paths = [i.rstrip("/") for i in paths]
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if any(_related(v.path, i) for i in paths)]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def _related(cached_path: str, changed_path: str) -> bool:
+    cached_path = cached_path.rstrip("/")
+    return (
+        cached_path == changed_path
+        or cached_path.startswith(changed_path + "/")
+        or changed_path.startswith(cached_path + "/")
+    )
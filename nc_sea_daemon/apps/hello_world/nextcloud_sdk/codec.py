@@ -0,0 +1,118 @@
+"""
+JSON codecs: orjson or msgspec when installed, the standard library otherwise.
+
+Decoding works straight on the received bytes. With msgspec, OCS payloads can also be decoded into the typed structs
+defined here, which validates them while parsing.
+"""
+
+import json
+from typing import Any, Callable, Dict, Generic, List, Optional, TypeVar
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None  # type: ignore
+
+PREFERENCE = ("orjson", "msgspec", "json")
+
+
+class JsonCodec:
+    """``loads`` takes bytes or str, ``dumps`` returns bytes."""
+
+    def __init__(self, name: str, loads: Callable[[Any], Any], dumps: Callable[[Any], bytes]):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+
+def _codec(name: str) -> Optional[JsonCodec]:
+    if name == "orjson" and orjson is not None:
+        return JsonCodec(name, orjson.loads, orjson.dumps)  # pylint: disable=no-member
+    if name == "msgspec" and msgspec is not None:
+        return JsonCodec(name, msgspec.json.Decoder().decode, msgspec.json.Encoder().encode)
+    if name == "json":
+        return JsonCodec(name, json.loads, lambda obj: json.dumps(obj, separators=(",", ":")).encode("utf-8"))
+    return None
+
+
+def get_codec(name: Optional[str] = None) -> JsonCodec:
+    """Returns the codec with the name, by default the first installed one of :py:data:`PREFERENCE`.
+
+    Raises ValueError if the named codec is unknown or its package is not installed.
+    """
+    for i in [name] if name else PREFERENCE:
+        codec = _codec(i)
+        if codec is not None:
+            return codec
+    raise ValueError(f"JSON codec `{name}` is not available")
+
+
+T = TypeVar("T")
+
+if msgspec is not None:
+
+    class Quota(msgspec.Struct):
+        free: Optional[int] = None
+        used: Optional[int] = None
+        total: Optional[int] = None
+        relative: Optional[float] = None
+        quota: Any = None
+
+    class UserDetails(msgspec.Struct):
+        id: str
+        enabled: bool = True
+        displayname: Optional[str] = None
+        email: Optional[str] = None
+        groups: List[str] = []
+        subadmin: List[str] = []
+        quota: Optional[Quota] = None
+        language: Optional[str] = None
+        locale: Optional[str] = None
+        backend: Optional[str] = None
+        last_login: Optional[int] = msgspec.field(default=None, name="lastLogin")
+
+    class UserList(msgspec.Struct):
+        users: List[str]
+
+    class GroupList(msgspec.Struct):
+        groups: List[str]
+
+    class _Meta(msgspec.Struct):
+        status: str
+        statuscode: int
+        message: Optional[str] = None
+
+    class _Ocs(msgspec.Struct, Generic[T]):
+        meta: _Meta
+        data: T
+
+    class _Envelope(msgspec.Struct, Generic[T]):
+        ocs: _Ocs[T]
+
+    _decoders: Dict[Any, Any] = {}
+
+    def decode_ocs(content: bytes, data_type: Any) -> Any:
+        """Decodes an OCS response with ``data`` of ``data_type``, returns the ``(status, statuscode, message)`` of
+        its meta and the data. Raises msgspec.ValidationError if the payload does not match the type."""
+        decoder = _decoders.get(data_type, None)
+        if decoder is None:
+            decoder = _decoders[data_type] = msgspec.json.Decoder(_Envelope[data_type])  # type: ignore[valid-type]
+        ocs = decoder.decode(content).ocs
+        return (ocs.meta.status, ocs.meta.statuscode, ocs.meta.message), ocs.data
+
+else:  # pragma: no cover
+    # the names exist without msgspec too, requests with them as `data_type` raise ValueError
+
+    class UserDetails:  # type: ignore[no-redef]
+        pass
+
+    class UserList:  # type: ignore[no-redef]
+        pass
+
+    class GroupList:  # type: ignore[no-redef]
+        pass
@@ -1,13 +1,21 @@
+from contextlib import asynccontextmanager, contextmanager
 from dataclasses import dataclass
-from json import dumps, loads
 from os import environ
-from typing import Optional, Union
-from urllib.parse import urlencode
+from threading import Lock
+from time import perf_counter
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, Optional, Tuple, Union
+from urllib.parse import unquote, urlencode
 
 import xmltodict
-from httpx import Client, Limits, ReadTimeout
+from httpx import USE_CLIENT_DEFAULT, AsyncClient, Client, HTTPError, Limits, Response
 
-from . import exceptions
+from . import codec, exceptions, metrics, resilience
+from .cache import CacheEntry, ResponseCache
+from .pool import AsyncConnectionPool, ConnectionPool
+from .resilience import CircuitBreaker, RetryPolicy, retry_after
+from .singleflight import AsyncSingleFlight, SingleFlight
+
+CACHEABLE_METHODS = ("GET", "PROPFIND")
 
 
 @dataclass
@@ -26,28 +34,100 @@ class ConnectConfig:
         return value
 
 
-class Connection:
+class BasicConnection:
+    """Request building and response handling shared by the sync and async connections."""
+
     def __init__(self, **kwargs):
-        self.adapter: Union[Client, None] = None
         self.config = ConnectConfig(**kwargs)
+        self.cache: Optional[ResponseCache] = kwargs.get("cache", None)
+        self.codec = codec.get_codec(kwargs.get("json_codec", None))
+        self.limits: Optional[Limits] = kwargs.get("limits", None)
+        self.verify = kwargs.get("verify", False)
+        self.pool: Any = kwargs.get("pool", None)
+        self.adapter: Any = None
+        self.retry: RetryPolicy = kwargs.get("retry", None) or resilience.NO_RETRY
+        self.breaker: Optional[CircuitBreaker] = kwargs.get("breaker", None)
 
-    def __del__(self):
-        self.close()
+    @property
+    def connected(self) -> bool:
+        return self.adapter is not None or self.pool is not None
+
+    def invalidate(self, paths: Iterable[str]) -> None:
+        """Drops cached responses of the resources, for changes the server does not report by itself."""
+        if self.cache is not None:
+            self.cache.invalidate(paths)
+
+    def _cache_key(self, *request: Any) -> tuple:
+        """Key of a request in the cache, with the user, as connections of different users may share the cache."""
+        return (self.config.auth[0], *request)
+
+    def _cache_lookup(self, method: str, key: Any) -> Optional[CacheEntry]:
+        if self.cache is None or method not in CACHEABLE_METHODS:
+            return None
+        return self.cache.lookup(key)
 
-    def request(self, method: str, path: str, data: Optional[dict] = None):
-        if data is None:
-            data = {}
-        self.__request_prepare()
+    @staticmethod
+    def _cache_headers(entry: Optional[CacheEntry]) -> Optional[dict]:
+        return {"If-None-Match": entry.etag} if entry is not None and entry.etag else None
+
+    def _cached_response(
+        self,
+        method: str,
+        path: str,
+        key: Any,
+        entry: Optional[CacheEntry],
+        response: Response,
+        decode: Callable[[Response], Any],
+        invalidate: Iterable[str] = (),
+    ):
+        if self.cache is None:
+            return decode(response)
+        if method not in CACHEABLE_METHODS:
+            self.cache.invalidate([path, *invalidate])
+            return decode(response)
+        if entry is not None and response.status_code == 304:
+            self.cache.refresh(entry)
+            return entry.value
+        value = decode(response)
+        self.cache.store(key, path, value, response.headers.get("etag", None))
+        return value
+
+    def _invalidate_dav(self, method: str, path: str, headers: Optional[dict]) -> None:
+        if self.cache is None or method in CACHEABLE_METHODS or method == "HEAD":
+            return
+        paths = [path]
+        if headers and "Destination" in headers:
+            paths.append(unquote(headers["Destination"].removeprefix(self.config.endpoint)))
+        self.cache.invalidate(paths)
+
+    def _breaker_check(self) -> None:
+        if self.breaker is not None:
+            self.breaker.check(self.config.endpoint)
+
+    def _breaker_record(self, ok: Optional[bool]) -> None:
+        """Records the outcome of a request, ``None`` if it ended before it had one."""
+        if self.breaker is None:
+            return
+        if ok is None:
+            self.breaker.release(self.config.endpoint)
+        else:
+            self.breaker.record(self.config.endpoint, ok)
+
+    @staticmethod
+    def _observe(method: str, path: str, started: float, response: Optional[Response]) -> None:
+        status = "error" if response is None else str(response.status_code)
+        metrics.observe(perf_counter() - started, method, path, status)
+
+    def _ocs_request_args(self, method: str, path: str, data: Optional[dict]) -> Tuple[str, str, dict]:
+        data = {} if data is None else dict(data)
         method = method.upper()
         data.update({"format": "json"})
-        try:
-            if method == "GET":
-                response = self.adapter.get(f"{self.config.endpoint}{path}?{urlencode(data, True)}")
-            else:
-                response = self.adapter.request(method, f"{self.config.endpoint}{path}", data=data)
-        except ReadTimeout:
-            raise exceptions.NextcloudRequestTimeout() from None
+        if method == "GET":
+            return method, f"{self.config.endpoint}{path}?{urlencode(data, True)}", {}
+        return method, f"{self.config.endpoint}{path}", {"data": data}
 
+    @staticmethod
+    def _check_status(response: Response) -> None:
         if response.status_code == 400:
             raise exceptions.NextcloudBadRequest()
         if response.status_code == 401:
@@ -58,34 +138,347 @@ class Connection:
             raise exceptions.NextcloudNotFound()
         elif response.status_code == 405:
             raise exceptions.NextcloudMethodNotAllowed()
+        elif response.status_code == 429:
+            raise exceptions.NextcloudTooManyRequests(retry_after=retry_after(response))
+        elif response.status_code == 503:
+            raise exceptions.NextcloudServiceUnavailable(retry_after=retry_after(response))
+        elif response.status_code >= 500:
+            raise exceptions.NextcloudServerError(response.status_code, response.reason_phrase)
 
-        if not response.text:
+    def _ocs_response(self, response: Response, data_type: Any = None):
+        self._check_status(response)
+        if not response.content:
             return None
-        response_data = loads(response.text)
+        typed_error = None
+        if data_type is not None:
+            try:
+                meta, data = codec.decode_ocs(response.content, data_type)
+                if meta[0] == "ok":
+                    return data
+            except codec.msgspec.ValidationError as e:
+                typed_error = e  # failures have no data of the type, their meta is checked below
+        response_data = self.codec.loads(response.content)
         ocs_meta = response_data["ocs"]["meta"]
         if ocs_meta["status"] != "ok":
             raise exceptions.NextcloudException(status_code=ocs_meta["statuscode"], reason=ocs_meta["message"])
+        if typed_error is not None:
+            raise typed_error
         return response_data["ocs"]["data"]
 
-    def dav_request(self, method: str, path: str, data: Optional[str] = None):
-        self.__request_prepare()
-        response = self.adapter.request(method, f"{self.config.endpoint}{path}", data=data)
+    def _ocs_decoder(self, data_type: Any) -> Callable[[Response], Any]:
+        if data_type is None:
+            return self._ocs_response
+        if codec.msgspec is None:
+            raise ValueError("decoding into typed structs requires msgspec")
+        return lambda response: self._ocs_response(response, data_type)
+
+    @classmethod
+    def _dav_response(cls, response: Response):
+        if response.status_code >= 500:
+            cls._check_status(response)
         if not response.content:
             return None
-        response_data = loads(dumps(xmltodict.parse(response.content)))
+        response_data = xmltodict.parse(response.content, dict_constructor=dict)
         if "d:error" in response_data:
             # here need adjustments!
             err = response_data["d:error"]
             raise exceptions.NextcloudException(f'{err["s:exception"]}: {err["s:message"]}'.replace("\n", ""))
         return response_data["d:multistatus"]["d:response"]
 
+    @classmethod
+    def _dav_check(cls, response: Response) -> None:
+        cls._check_status(response)
+        if response.status_code >= 400:
+            raise exceptions.NextcloudException(status_code=response.status_code, reason=response.reason_phrase)
+
+
+class Connection(BasicConnection):
+    """OCS and DAV requests with the credentials of one user.
+
+    With ``pool``, a :py:class:`~nextcloud_sdk.pool.ConnectionPool`, requests go through the client of the pool shared
+    with other users' connections. Otherwise the connection opens its own client, with ``limits`` (``httpx.Limits``)
+    and ``verify`` from the arguments.
+
+    With ``coalesce=True``, identical GET and PROPFIND requests in flight at the same time are sent once, all callers
+    get the decoded result of that request, which they must not modify, and share its deadline.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pool: Optional[ConnectionPool]
+        self.adapter: Union[Client, None] = None
+        self._adapter_lock = Lock()
+        self.flights = SingleFlight() if kwargs.get("coalesce", False) else None
+
+    def __del__(self):
+        self.close()
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        data: Optional[dict] = None,
+        invalidate: Iterable[str] = (),
+        data_type: Any = None,
+        deadline: Optional[float] = None,
+    ):
+        """Sends OCS request. With a cache, ``invalidate`` lists other resources a mutating request changes.
+
+        With ``data_type``, one of the structs of :py:mod:`~nextcloud_sdk.codec`, the data is decoded into it (requires
+        msgspec). ``deadline`` overrides the one of the connection's retry policy, in seconds.
+        """
+        method, url, kwargs = self._ocs_request_args(method, path, data)
+        decode = self._ocs_decoder(data_type)
+        key = self._cache_key(url, data_type)
+        entry = self._cache_lookup(method, key)
+        if entry is not None and entry.fresh:
+            return entry.value
+        headers = self._cache_headers(entry)
+
+        def fetch():
+            response = self._send(
+                method,
+                path,
+                lambda client, timeout: client.request(
+                    method, url, auth=self.config.auth, headers=headers, timeout=timeout, **kwargs
+                ),
+                deadline,
+            )
+            return self._cached_response(method, path, key, entry, response, decode, invalidate)
+
+        return self._coalesce(method, key, fetch)
+
+    def dav_request(self, method: str, path: str, data: Optional[str] = None, deadline: Optional[float] = None):
+        key = self._cache_key(method, path, data)
+        entry = self._cache_lookup(method, key)
+        if entry is not None and entry.fresh:
+            return entry.value
+        url = f"{self.config.endpoint}{path}"
+
+        def fetch():
+            response = self._send(
+                method,
+                path,
+                lambda client, timeout: client.request(
+                    method, url, auth=self.config.auth, content=data, timeout=timeout
+                ),
+                deadline,
+            )
+            return self._cached_response(method, path, key, entry, response, self._dav_response)
+
+        return self._coalesce(method, key, fetch)
+
+    def _coalesce(self, method: str, key: Any, fetch: Callable[[], Any]):
+        if self.flights is None or method not in CACHEABLE_METHODS:
+            return fetch()
+        return self.flights.do(key, fetch)
+
+    def _send(self, method: str, path: str, send: Callable[[Client, Any], Any], deadline: Optional[float]) -> Response:
+        """Sends the request with the retry policy and circuit breaker of the connection."""
+
+        def attempt(timeout: Optional[float]) -> Response:
+            response = None
+            started = perf_counter()
+            try:
+                with self._client() as client:
+                    response = send(client, USE_CLIENT_DEFAULT if timeout is None else timeout)
+                return response
+            finally:
+                self._observe(method, path, started, response)
+
+        return resilience.call(self.retry, self.breaker, self.config.endpoint, method, attempt, deadline)
+
+    @contextmanager
+    def dav_open(
+        self, method: str, path: str, content: Any = None, headers: Optional[dict] = None
+    ) -> Iterator[Response]:
+        """Sends the request and provides the response with a not yet read body."""
+        self._invalidate_dav(method, path, headers)
+        self._breaker_check()
+        response = None
+        started = perf_counter()
+        try:
+            url = f"{self.config.endpoint}{path}"
+            with self._client() as client, client.stream(
+                method, url, auth=self.config.auth, content=content, headers=headers
+            ) as response:
+                self._observe(method, path, started, response)
+                self._breaker_record(response.status_code < 500)
+                if response.status_code >= 400:
+                    response.read()
+                    self._dav_check(response)
+                yield response
+        except HTTPError as e:
+            if response is None:
+                self._breaker_record(False)
+            raise resilience.transport_error(e) from None
+        finally:
+            if response is None:
+                self._observe(method, path, started, None)
+                self._breaker_record(None)
+
+    def dav_stream(
+        self, method: str, path: str, data: Optional[str] = None, headers: Optional[dict] = None
+    ) -> Iterator[bytes]:
+        """Yields chunks of the response body as they arrive."""
+        with self.dav_open(method, path, data, headers) as response:
+            yield from response.iter_bytes()
+
     def close(self):
         if self.adapter:
             self.adapter.close()
             self.adapter = None
 
-    def __request_prepare(self) -> None:
+    @contextmanager
+    def _client(self) -> Iterator[Client]:
+        if self.pool is not None:
+            with self.pool.lease(self.config.endpoint) as client:
+                yield client
+            return
+        adapter = self.adapter
+        if not adapter:
+            with self._adapter_lock:  # threads using the connection at once must share one client
+                if not self.adapter:
+                    limits = self.limits or Limits(
+                        max_keepalive_connections=20, max_connections=20, keepalive_expiry=15.0
+                    )
+                    client = Client(auth=self.config.auth, follow_redirects=True, limits=limits, verify=self.verify)
+                    client.headers.update({"OCS-APIRequest": "true"})
+                    self.adapter = client
+                adapter = self.adapter
+        yield adapter
+
+
+class AsyncConnection(BasicConnection):
+    """Same as :py:class:`Connection`, but on one pooled ``httpx.AsyncClient`` shared by all coroutines, or with
+    ``pool`` an :py:class:`~nextcloud_sdk.pool.AsyncConnectionPool`."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pool: Optional[AsyncConnectionPool]
+        self.adapter: Union[AsyncClient, None] = None
+        self.flights = AsyncSingleFlight() if kwargs.get("coalesce", False) else None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        data: Optional[dict] = None,
+        invalidate: Iterable[str] = (),
+        data_type: Any = None,
+        deadline: Optional[float] = None,
+    ):
+        method, url, kwargs = self._ocs_request_args(method, path, data)
+        decode = self._ocs_decoder(data_type)
+        key = self._cache_key(url, data_type)
+        entry = self._cache_lookup(method, key)
+        if entry is not None and entry.fresh:
+            return entry.value
+        headers = self._cache_headers(entry)
+
+        async def fetch():
+            response = await self._send(
+                method,
+                path,
+                lambda client, timeout: client.request(
+                    method, url, auth=self.config.auth, headers=headers, timeout=timeout, **kwargs
+                ),
+                deadline,
+            )
+            return self._cached_response(method, path, key, entry, response, decode, invalidate)
+
+        return await self._coalesce(method, key, fetch)
+
+    async def dav_request(self, method: str, path: str, data: Optional[str] = None, deadline: Optional[float] = None):
+        key = self._cache_key(method, path, data)
+        entry = self._cache_lookup(method, key)
+        if entry is not None and entry.fresh:
+            return entry.value
+        url = f"{self.config.endpoint}{path}"
+
+        async def fetch():
+            response = await self._send(
+                method,
+                path,
+                lambda client, timeout: client.request(
+                    method, url, auth=self.config.auth, content=data, timeout=timeout
+                ),
+                deadline,
+            )
+            return self._cached_response(method, path, key, entry, response, self._dav_response)
+
+        return await self._coalesce(method, key, fetch)
+
+    async def _coalesce(self, method: str, key: Any, fetch: Callable[[], Any]):
+        if self.flights is None or method not in CACHEABLE_METHODS:
+            return await fetch()
+        return await self.flights.do(key, fetch)
+
+    async def _send(
+        self, method: str, path: str, send: Callable[[AsyncClient, Any], Any], deadline: Optional[float]
+    ) -> Response:
+        """Sends the request with the retry policy and circuit breaker of the connection."""
+
+        async def attempt(timeout: Optional[float]) -> Response:
+            response = None
+            started = perf_counter()
+            try:
+                async with self._client() as client:
+                    response = await send(client, USE_CLIENT_DEFAULT if timeout is None else timeout)
+                return response
+            finally:
+                self._observe(method, path, started, response)
+
+        return await resilience.acall(self.retry, self.breaker, self.config.endpoint, method, attempt, deadline)
+
+    @asynccontextmanager
+    async def dav_open(
+        self, method: str, path: str, content: Any = None, headers: Optional[dict] = None
+    ) -> AsyncIterator[Response]:
+        self._invalidate_dav(method, path, headers)
+        self._breaker_check()
+        response = None
+        started = perf_counter()
+        try:
+            url = f"{self.config.endpoint}{path}"
+            async with self._client() as client, client.stream(
+                method, url, auth=self.config.auth, content=content, headers=headers
+            ) as response:
+                self._observe(method, path, started, response)
+                self._breaker_record(response.status_code < 500)
+                if response.status_code >= 400:
+                    await response.aread()
+                    self._dav_check(response)
+                yield response
+        except HTTPError as e:
+            if response is None:
+                self._breaker_record(False)
+            raise resilience.transport_error(e) from None
+        finally:
+            if response is None:
+                self._observe(method, path, started, None)
+                self._breaker_record(None)
+
+    async def dav_stream(
+        self, method: str, path: str, data: Optional[str] = None, headers: Optional[dict] = None
+    ) -> AsyncIterator[bytes]:
+        async with self.dav_open(method, path, data, headers) as response:
+            async for chunk in response.aiter_bytes():
+                yield chunk
+
+    async def close(self):
+        if self.adapter:
+            await self.adapter.aclose()
+            self.adapter = None
+
+    @asynccontextmanager
+    async def _client(self) -> AsyncIterator[AsyncClient]:
+        if self.pool is not None:
+            async with self.pool.lease(self.config.endpoint) as client:
+                yield client
+            return
         if not self.adapter:
-            limits = Limits(max_keepalive_connections=20, max_connections=20, keepalive_expiry=15.0)
-            self.adapter = Client(auth=self.config.auth, follow_redirects=True, limits=limits, verify=False)
+            limits = self.limits or Limits(max_keepalive_connections=100, max_connections=100, keepalive_expiry=15.0)
+            self.adapter = AsyncClient(auth=self.config.auth, follow_redirects=True, limits=limits, verify=self.verify)
             self.adapter.headers.update({"OCS-APIRequest": "true"})
+        yield self.adapter
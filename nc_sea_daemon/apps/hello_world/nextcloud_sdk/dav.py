@@ -0,0 +1,142 @@
+"""
+Incremental parser of WebDAV multistatus responses.
+"""
+
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+from . import exceptions
+
+NAMESPACES = {
+    "d": "DAV:",
+    "oc": "http://owncloud.org/ns",
+    "nc": "http://nextcloud.org/ns",
+    "s": "http://sabredav.org/ns",
+}
+_PREFIXES = {f"{{{v}}}": f"{k}:" for k, v in NAMESPACES.items()}
+
+_RESPONSE = "{DAV:}response"
+_INT_PROPS = ("d:getcontentlength", "oc:size", "oc:fileid", "nc:has-preview")
+
+
+def prefixed_name(tag: str) -> str:
+    """Converts ``{DAV:}getetag`` to ``d:getetag``."""
+    if tag.startswith("{"):
+        namespace, name = tag[1:].split("}", 1)
+        return _PREFIXES.get(f"{{{namespace}}}", f"{{{namespace}}}") + name
+    return tag
+
+
+class FsNode:
+    """Compact representation of one PROPFIND entry. Requested properties are in ``props`` by prefixed names."""
+
+    __slots__ = ("path", "href", "is_dir", "props")
+
+    def __init__(self, path: str, href: str, is_dir: bool, props: dict):
+        self.path = path
+        self.href = href
+        self.is_dir = is_dir
+        self.props = props
+
+    @property
+    def name(self) -> str:
+        return self.path.rstrip("/").rsplit("/", 1)[-1]
+
+    @property
+    def fileid(self) -> Optional[int]:
+        return self.props.get("oc:fileid", None)
+
+    @property
+    def etag(self) -> Optional[str]:
+        return self.props.get("d:getetag", None)
+
+    @property
+    def size(self) -> Optional[int]:
+        return self.props.get("oc:size", self.props.get("d:getcontentlength", None))
+
+    @property
+    def mtime(self) -> Optional[int]:
+        last_modified = self.props.get("d:getlastmodified", None)
+        return int(parsedate_to_datetime(last_modified).timestamp()) if last_modified else None
+
+    def info(self) -> dict:
+        """Returns available fields as a :py:class:`~nextcloud_sdk.files.NodeInfo` dictionary."""
+        info = {"is_dir": self.is_dir, "name": self.name, "internal_path": self.path}
+        for k, v in (("id", self.fileid), ("etag", self.etag), ("size", self.size), ("mtime", self.mtime)):
+            if v is not None:
+                info[k] = v
+        return info
+
+    def __repr__(self):
+        return f"FsNode({self.path!r}, is_dir={self.is_dir})"
+
+
+def _prop_value(element: ElementTree.Element, name: str):
+    if name == "d:resourcetype":
+        return [prefixed_name(i.tag) for i in element]
+    if len(element):
+        return {prefixed_name(i.tag): i.text for i in element}
+    if element.text is not None and name in _INT_PROPS:
+        try:
+            return int(element.text)
+        except ValueError:
+            pass
+    return element.text
+
+
+def _parse_response(element: ElementTree.Element, base_path: str) -> FsNode:
+    href = unquote(element.findtext("{DAV:}href", ""))
+    props: Dict[str, object] = {}
+    for propstat in element.iterfind("{DAV:}propstat"):
+        if " 200 " not in propstat.findtext("{DAV:}status", ""):
+            continue
+        prop = propstat.find("{DAV:}prop")
+        if prop is not None:
+            for i in prop:
+                name = prefixed_name(i.tag)
+                props[name] = _prop_value(i, name)
+    is_dir = "d:collection" in props.get("d:resourcetype", ()) or href.endswith("/")  # type: ignore[operator]
+    path = href[len(base_path) :] if href.startswith(base_path) else href
+    return FsNode(path.lstrip("/"), href, is_dir, props)
+
+
+class MultistatusParser:
+    """Turns chunks of a multistatus body into :py:class:`FsNode` objects as soon as each entry is complete."""
+
+    def __init__(self, base_path: str = ""):
+        self.base_path = unquote(base_path).rstrip("/")
+        self._parser = ElementTree.XMLPullParser(events=("start", "end"))
+        self._root: Optional[ElementTree.Element] = None
+
+    def feed(self, data: bytes) -> Iterator[FsNode]:
+        self._parser.feed(data)
+        return self._read_events()
+
+    def close(self) -> List[FsNode]:
+        self._parser.close()
+        nodes = list(self._read_events())
+        if self._root is not None and self._root.tag == "{DAV:}error":
+            exception = self._root.findtext("{http://sabredav.org/ns}exception", "")
+            message = self._root.findtext("{http://sabredav.org/ns}message", "")
+            raise exceptions.NextcloudException(reason=f"{exception}: {message}".replace("\n", ""))
+        return nodes
+
+    def _read_events(self) -> Iterator[FsNode]:
+        for event, element in self._parser.read_events():
+            if event == "start":
+                if self._root is None:
+                    self._root = element
+            elif element.tag == _RESPONSE:
+                yield _parse_response(element, self.base_path)
+                if self._root is not None:
+                    self._root.clear()
+
+
+def parse_multistatus(chunks, base_path: str = "") -> Iterator[FsNode]:
+    """Yields nodes from an iterable of response body chunks."""
+    parser = MultistatusParser(base_path)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
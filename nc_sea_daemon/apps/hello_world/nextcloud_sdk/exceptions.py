@@ -1,7 +1,7 @@
 """
 Exceptions for the Nextcloud API.
 """
-from typing import Union
+from typing import Optional, Union
 
 
 class NextcloudException(Exception):
@@ -63,3 +63,51 @@ class NextcloudMethodNotAllowed(NextcloudException):
 
     def __init__(self):
         super(NextcloudException, self).__init__()
+
+
+class NextcloudTooManyRequests(NextcloudException):
+    status_code = 429
+    reason = "Too many requests."
+
+    def __init__(self, retry_after: Optional[float] = None):
+        super(NextcloudException, self).__init__()
+        self.retry_after = retry_after
+
+
+class NextcloudServiceUnavailable(NextcloudException):
+    status_code = 503
+    reason = "Service unavailable."
+
+    def __init__(self, retry_after: Optional[float] = None):
+        super(NextcloudException, self).__init__()
+        self.retry_after = retry_after
+
+
+class NextcloudServerError(NextcloudException):
+    """5xx response other than 503."""
+
+    reason = "Server error."
+
+    def __init__(self, status_code: int = 500, reason: Optional[str] = None):
+        super().__init__(status_code, reason or self.reason)
+
+
+class NextcloudConnectionError(NextcloudException):
+    """The server could not be reached or the connection broke before the response was complete."""
+
+    reason = "Connection error."
+
+    def __init__(self, reason: Optional[str] = None):
+        super().__init__(None, reason or self.reason)
+
+
+class NextcloudDeadlineExceeded(NextcloudRequestTimeout):
+    """The deadline of a call ran out, attempts and backoff delays included."""
+
+    reason = "Deadline exceeded."
+
+
+class NextcloudCircuitOpen(NextcloudServiceUnavailable):
+    """Failed without a request, as the circuit breaker of the host is open after repeated failures."""
+
+    reason = "Circuit breaker is open."
@@ -1,13 +1,35 @@
+import asyncio
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from io import BytesIO
-from typing import Optional, TypedDict
+from threading import BoundedSemaphore, Lock
+from typing import IO, Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Set, Tuple, TypedDict
+from urllib.parse import quote
 from xml.etree import ElementTree
 
-from .connections import Connection
+from . import exceptions
+from .connections import AsyncConnection, Connection
+from .dav import FsNode, MultistatusParser, parse_multistatus
+from .transfers import (
+    DOWNLOAD_PART_SIZE,
+    READ_SIZE,
+    UPLOAD_CHUNK_SIZE,
+    check_partial,
+    chunk_path,
+    download_parts,
+    peek_single_chunk,
+    range_header,
+    ranged_size,
+    source_chunks,
+    source_size,
+    upload_path,
+)
 
 ENDPOINT = "/remote.php/dav"
+WALK_PROPERTIES = ["d:resourcetype", "d:getetag", "oc:fileid"]
 
 
-class NodeInfo(TypedDict):
+class NodeInfo(TypedDict, total=False):
     id: int
     is_dir: bool
     is_local: bool
@@ -29,6 +51,57 @@ class NodeInfo(TypedDict):
     direct_access: bool
 
 
+def propfind_body(properties: Optional[list[str]]) -> str:
+    root = ElementTree.Element(
+        "d:propfind",
+        attrib={"xmlns:d": "DAV:", "xmlns:oc": "http://owncloud.org/ns", "xmlns:nc": "http://nextcloud.org/ns"},
+    )
+    prop = ElementTree.SubElement(root, "d:prop")
+    for i in properties or []:
+        ElementTree.SubElement(prop, i)
+
+    with BytesIO() as buffer:
+        ElementTree.ElementTree(root).write(buffer, xml_declaration=True)
+        buffer.seek(0)
+        return buffer.read().decode("utf-8")
+
+
+def files_path(user: Optional[str], path: Optional[str]) -> str:
+    full_path = f"{ENDPOINT}/files"
+    if user:
+        full_path += "/" + user
+    if path:
+        full_path += "/" + path
+    return full_path
+
+
+class _Walker:
+    """Bookkeeping of a recursive walk: directories left to list, already seen nodes and etag pruning."""
+
+    def __init__(self, path: str, properties: Optional[list[str]], known_etags: Optional[Dict[str, str]]):
+        self.root = path.strip("/")
+        self.properties = list(dict.fromkeys(WALK_PROPERTIES + (properties or [])))
+        self.known_etags = known_etags or {}
+        self.pending: Deque[str] = deque([""])
+        self.seen: Set[object] = set()
+
+    def dir_path(self, relative_path: str) -> str:
+        return f"{self.root}/{relative_path}".strip("/")
+
+    def accept(self, relative_path: str, listing: List[FsNode]) -> List[FsNode]:
+        result = []
+        for node in listing:
+            node.path = relative_path + node.path
+            key = node.fileid if node.fileid is not None else node.path
+            if key in self.seen:
+                continue
+            self.seen.add(key)
+            result.append(node)
+            if node.is_dir and not (node.etag and self.known_etags.get(node.path, None) == node.etag):
+                self.pending.append(node.path)
+        return result
+
+
 class FilesAPI:
     def __init__(self, connection: Connection):
         self.connection = connection
@@ -36,34 +109,295 @@ class FilesAPI:
     def list_files(
         self, user: Optional[str] = None, path: Optional[str] = "", properties: Optional[list[str]] = None
     ) -> dict:
-        if properties is None:
-            properties = []
-        root = ElementTree.Element(
-            "d:propfind",
-            attrib={"xmlns:d": "DAV:", "xmlns:oc": "http://owncloud.org/ns", "xmlns:nc": "http://nextcloud.org/ns"},
-        )
-        prop = ElementTree.SubElement(root, "d:prop")
-        for i in properties:
-            ElementTree.SubElement(prop, i)
-
-        with BytesIO() as buffer:
-            ElementTree.ElementTree(root).write(buffer, xml_declaration=True)
-            buffer.seek(0)
-            data = buffer.read().decode("utf-8")
-
-        full_path = f"{ENDPOINT}/files"
-        if user:
-            full_path += "/" + user
-        if path:
-            full_path += "/" + path
-        response = self.connection.dav_request("PROPFIND", full_path, data=data)
-        result = {}
-        fileid = 1234
-        for i in response:
-            obj_name: str = i.pop("d:href")
-            obj_name = obj_name.replace(full_path, "").lstrip("/")
-            if not obj_name:
-                continue
-            fileid += 1
-            result[obj_name] = {"path": obj_name}
-        return result
+        return {i.path: {"path": i.path} for i in self.iter_files(user, path, properties)}
+
+    def iter_files(
+        self, user: Optional[str] = None, path: Optional[str] = "", properties: Optional[list[str]] = None
+    ) -> Iterator[FsNode]:
+        """Yields the content of the directory while the PROPFIND response is still being received."""
+        full_path = files_path(user, path)
+        chunks = self.connection.dav_stream("PROPFIND", full_path, propfind_body(properties), {"Depth": "1"})
+        return (i for i in parse_multistatus(chunks, full_path) if i.path)
+
+    def walk(
+        self,
+        user: Optional[str] = None,
+        path: str = "",
+        max_concurrency: int = 8,
+        properties: Optional[list[str]] = None,
+        known_etags: Optional[Dict[str, str]] = None,
+    ) -> Iterator[FsNode]:
+        """Yields all nodes below ``path``, listing up to ``max_concurrency`` directories in parallel.
+
+        Nodes are deduplicated by file id. Paths are relative to ``path``.
+        :param known_etags: path to etag of directories from a previous walk. Unchanged directories are yielded,
+            but not descended into.
+        """
+        walker = _Walker(path, properties, known_etags)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            running: dict = {}
+            while walker.pending or running:
+                while walker.pending and len(running) < max_concurrency:
+                    relative_path = walker.pending.popleft()
+                    future = executor.submit(
+                        lambda x: list(self.iter_files(user, walker.dir_path(x), walker.properties)), relative_path
+                    )
+                    running[future] = relative_path
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from walker.accept(running.pop(future), future.result())
+
+    def iter_download(self, path: str, user: Optional[str] = None, offset: int = 0) -> Iterator[bytes]:
+        """Yields file content in chunks, starting from ``offset``."""
+        full_path = files_path(user or self.connection.config.auth[0], path)
+        with self.connection.dav_open("GET", full_path, headers=range_header(offset) if offset else None) as response:
+            if offset:
+                check_partial(response, offset)
+            yield from response.iter_bytes(READ_SIZE)
+
+    def download(
+        self,
+        path: str,
+        fp: IO[bytes],
+        user: Optional[str] = None,
+        offset: int = 0,
+        max_concurrency: int = 1,
+        part_size: int = DOWNLOAD_PART_SIZE,
+    ) -> int:
+        """Writes file content to ``fp`` and returns the number of written bytes.
+
+        To resume an interrupted download pass the number of already received bytes as ``offset``.
+        With ``max_concurrency`` > 1 and a seekable ``fp``, parts of the file are fetched in parallel by Range requests.
+        """
+        full_path = files_path(user or self.connection.config.auth[0], path)
+        if max_concurrency > 1 and fp.seekable():
+            with self.connection.dav_open("HEAD", full_path) as response:
+                size = ranged_size(response)
+            if size is not None and size - offset > part_size:
+                return self._download_parts(full_path, fp, offset, size, max_concurrency, part_size)
+        written = 0
+        for chunk in self.iter_download(path, user, offset):
+            fp.write(chunk)
+            written += len(chunk)
+        return written
+
+    def _download_parts(
+        self, full_path: str, fp: IO[bytes], offset: int, size: int, max_concurrency: int, part_size: int
+    ) -> int:
+        start_position = fp.tell()
+        lock = Lock()
+
+        def fetch(part: Tuple[int, int]) -> None:
+            position = part[0]
+            with self.connection.dav_open("GET", full_path, headers=range_header(*part)) as response:
+                check_partial(response, part[0])
+                for chunk in response.iter_bytes(READ_SIZE):
+                    with lock:
+                        fp.seek(start_position + position - offset)
+                        fp.write(chunk)
+                    position += len(chunk)
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            for _ in executor.map(fetch, download_parts(offset, size, part_size)):
+                pass
+        fp.seek(start_position + size - offset)
+        return size - offset
+
+    def upload(
+        self,
+        path: str,
+        source: Any,
+        user: Optional[str] = None,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        max_concurrency: int = 4,
+    ) -> None:
+        """Uploads bytes, a file object or an iterable of bytes to ``path``.
+
+        Content larger than ``chunk_size`` is sent with the chunked upload v2 protocol, up to ``max_concurrency``
+        chunks in parallel, so no more than that many chunks are held in memory.
+        """
+        full_path = files_path(user or self.connection.config.auth[0], path)
+        size = source_size(source)
+        single, chunks = peek_single_chunk(source_chunks(source, chunk_size))
+        if single is not None:
+            self._dav("PUT", full_path, content=single)
+            return
+        temp_path = upload_path(self.connection.config.auth[0])
+        headers = {"Destination": self.connection.config.endpoint + quote(full_path)}
+        if size is not None:
+            headers["OC-Total-Length"] = str(size)
+        self._dav("MKCOL", temp_path, headers=headers)
+        try:
+            slots = BoundedSemaphore(max_concurrency)
+            errors: list = []
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                futures = []
+                for number, chunk in enumerate(chunks, 1):
+                    slots.acquire()
+                    if errors:
+                        break
+                    future = executor.submit(self._dav, "PUT", chunk_path(temp_path, number), headers, chunk)
+                    future.add_done_callback(lambda x: (errors.append(x) if x.exception() else None, slots.release()))
+                    futures.append(future)
+            for future in futures:
+                future.result()
+            self._dav("MOVE", f"{temp_path}/.file", headers=headers)
+        except BaseException:
+            try:
+                self._dav("DELETE", temp_path)
+            except exceptions.NextcloudException:
+                pass
+            raise
+
+    def _dav(self, method: str, path: str, headers: Optional[dict] = None, content: Any = None) -> None:
+        with self.connection.dav_open(method, path, content, headers) as response:
+            response.read()
+
+
+class AsyncFilesAPI:
+    def __init__(self, connection: AsyncConnection):
+        self.connection = connection
+
+    async def list_files(
+        self, user: Optional[str] = None, path: Optional[str] = "", properties: Optional[list[str]] = None
+    ) -> dict:
+        return {i.path: {"path": i.path} async for i in self.iter_files(user, path, properties)}
+
+    async def iter_files(
+        self, user: Optional[str] = None, path: Optional[str] = "", properties: Optional[list[str]] = None
+    ) -> AsyncIterator[FsNode]:
+        full_path = files_path(user, path)
+        parser = MultistatusParser(full_path)
+        async for chunk in self.connection.dav_stream("PROPFIND", full_path, propfind_body(properties), {"Depth": "1"}):
+            for i in parser.feed(chunk):
+                if i.path:
+                    yield i
+        for i in parser.close():
+            if i.path:
+                yield i
+
+    async def walk(
+        self,
+        user: Optional[str] = None,
+        path: str = "",
+        max_concurrency: int = 8,
+        properties: Optional[list[str]] = None,
+        known_etags: Optional[Dict[str, str]] = None,
+    ) -> AsyncIterator[FsNode]:
+        walker = _Walker(path, properties, known_etags)
+
+        async def list_dir(relative_path: str) -> List[FsNode]:
+            return [i async for i in self.iter_files(user, walker.dir_path(relative_path), walker.properties)]
+
+        running: Dict[asyncio.Task, str] = {}
+        try:
+            while walker.pending or running:
+                while walker.pending and len(running) < max_concurrency:
+                    relative_path = walker.pending.popleft()
+                    running[asyncio.ensure_future(list_dir(relative_path))] = relative_path
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for node in walker.accept(running.pop(task), task.result()):
+                        yield node
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def iter_download(self, path: str, user: Optional[str] = None, offset: int = 0) -> AsyncIterator[bytes]:
+        full_path = files_path(user or self.connection.config.auth[0], path)
+        headers = range_header(offset) if offset else None
+        async with self.connection.dav_open("GET", full_path, headers=headers) as response:
+            if offset:
+                check_partial(response, offset)
+            async for chunk in response.aiter_bytes(READ_SIZE):
+                yield chunk
+
+    async def download(
+        self,
+        path: str,
+        fp: IO[bytes],
+        user: Optional[str] = None,
+        offset: int = 0,
+        max_concurrency: int = 1,
+        part_size: int = DOWNLOAD_PART_SIZE,
+    ) -> int:
+        full_path = files_path(user or self.connection.config.auth[0], path)
+        if max_concurrency > 1 and fp.seekable():
+            async with self.connection.dav_open("HEAD", full_path) as response:
+                size = ranged_size(response)
+            if size is not None and size - offset > part_size:
+                return await self._download_parts(full_path, fp, offset, size, max_concurrency, part_size)
+        written = 0
+        async for chunk in self.iter_download(path, user, offset):
+            fp.write(chunk)
+            written += len(chunk)
+        return written
+
+    async def _download_parts(
+        self, full_path: str, fp: IO[bytes], offset: int, size: int, max_concurrency: int, part_size: int
+    ) -> int:
+        start_position = fp.tell()
+        slots = asyncio.Semaphore(max_concurrency)
+
+        async def fetch(part: Tuple[int, int]) -> None:
+            position = part[0]
+            async with slots:
+                async with self.connection.dav_open("GET", full_path, headers=range_header(*part)) as response:
+                    check_partial(response, part[0])
+                    async for chunk in response.aiter_bytes(READ_SIZE):
+                        fp.seek(start_position + position - offset)
+                        fp.write(chunk)
+                        position += len(chunk)
+
+        await asyncio.gather(*[fetch(i) for i in download_parts(offset, size, part_size)])
+        fp.seek(start_position + size - offset)
+        return size - offset
+
+    async def upload(
+        self,
+        path: str,
+        source: Any,
+        user: Optional[str] = None,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        max_concurrency: int = 4,
+    ) -> None:
+        full_path = files_path(user or self.connection.config.auth[0], path)
+        size = source_size(source)
+        single, chunks = peek_single_chunk(source_chunks(source, chunk_size))
+        if single is not None:
+            await self._dav("PUT", full_path, content=single)
+            return
+        temp_path = upload_path(self.connection.config.auth[0])
+        headers = {"Destination": self.connection.config.endpoint + quote(full_path)}
+        if size is not None:
+            headers["OC-Total-Length"] = str(size)
+        await self._dav("MKCOL", temp_path, headers=headers)
+        tasks: List[asyncio.Task] = []
+        try:
+            slots = asyncio.Semaphore(max_concurrency)
+
+            async def put_chunk(number: int, chunk: bytes) -> None:
+                try:
+                    await self._dav("PUT", chunk_path(temp_path, number), headers, chunk)
+                finally:
+                    slots.release()
+
+            for number, chunk in enumerate(chunks, 1):
+                await slots.acquire()
+                if any(i.done() and i.exception() for i in tasks[-max_concurrency:]):
+                    break
+                tasks.append(asyncio.ensure_future(put_chunk(number, chunk)))
+            await asyncio.gather(*tasks)
+            await self._dav("MOVE", f"{temp_path}/.file", headers=headers)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            try:
+                await self._dav("DELETE", temp_path)
+            except exceptions.NextcloudException:
+                pass
+            raise
+
+    async def _dav(self, method: str, path: str, headers: Optional[dict] = None, content: Any = None) -> None:
+        async with self.connection.dav_open(method, path, content, headers) as response:
+            await response.aread()
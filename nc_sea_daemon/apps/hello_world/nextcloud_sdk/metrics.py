@@ -0,0 +1,82 @@
+"""
+Request metrics of the SDK: a histogram of Nextcloud request durations by method, path and status code.
+
+Recording takes no locks, every thread updates its own shard. :py:func:`render` returns the Prometheus text format,
+for an app to serve on its own ``/metrics``.
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+NAME = "nextcloud_sdk_request_duration_seconds"
+LABELS = ("method", "path", "status")
+
+HOOKS: List[Callable[[float, Dict[str, str]], None]] = []
+"""Called with the duration and labels of every request, e.g. :py:func:`otel_hook`."""
+
+_shards: List[Dict[Tuple[str, str, str], List[float]]] = []
+_local = threading.local()
+
+
+def path_label(path: str) -> str:
+    """Cuts user ids and file paths off, so label values stay few: ``/ocs/v1.php/cloud/users/admin`` is counted as
+    ``/ocs/v1.php/cloud/users`` and WebDAV requests as ``/remote.php/dav/files``."""
+    return "/".join(path.split("?", 1)[0].split("/")[: 4 if path.startswith("/remote.php/") else 5])
+
+
+def observe(seconds: float, method: str, path: str, status: str) -> None:
+    try:
+        shard = _local.shard
+    except AttributeError:
+        shard = _local.shard = {}
+        _shards.append(shard)
+    labels = (method, path_label(path), status)
+    values = shard.get(labels, None)
+    if values is None:
+        values = shard[labels] = [0.0] * (len(BUCKETS) + 2)
+    values[bisect_left(BUCKETS, seconds)] += 1
+    values[-1] += seconds
+    for hook in HOOKS:
+        hook(seconds, dict(zip(LABELS, labels)))
+
+
+def collect() -> Dict[Tuple[str, str, str], List[float]]:
+    """Counts per bucket (not cumulative, the last one is +Inf) followed by the sum, by labels."""
+    totals: Dict[Tuple[str, str, str], List[float]] = {}
+    for shard in list(_shards):
+        for labels, values in list(shard.items()):
+            total = totals.setdefault(labels, [0.0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return totals
+
+
+def render() -> str:
+    lines = [f"# HELP {NAME} Duration of requests to Nextcloud.", f"# TYPE {NAME} histogram"]
+    for labels, values in sorted(collect().items()):
+        label_text = ",".join(f'{k}="{v}"' for k, v in zip(LABELS, labels))
+        count = 0
+        for bound, bucket_count in zip((*BUCKETS, "+Inf"), values):
+            count += int(bucket_count)
+            lines.append(f'{NAME}_bucket{{{label_text},le="{bound}"}} {count}')
+        lines.append(f"{NAME}_sum{{{label_text}}} {values[-1]}")
+        lines.append(f"{NAME}_count{{{label_text}}} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def otel_hook(meter_name: str = "nextcloud_sdk") -> Callable[[float, Dict[str, str]], None]:
+    """Hook recording durations into an OpenTelemetry histogram, add it to :py:data:`HOOKS`.
+
+    Raises ImportError if ``opentelemetry-api`` is not installed.
+    """
+    from opentelemetry import (  # pylint: disable=import-outside-toplevel,import-error
+        metrics as otel_metrics,
+    )
+
+    histogram = otel_metrics.get_meter(meter_name).create_histogram(
+        NAME, unit="s", description="Duration of requests to Nextcloud."
+    )
+    return lambda seconds, labels: histogram.record(seconds, labels)
@@ -1,7 +1,7 @@
-from .connections import Connection
-from .files import FilesAPI
-from .users import UserAPI
-from .users_groups import UsersGroupsAPI
+from .connections import AsyncConnection, Connection
+from .files import AsyncFilesAPI, FilesAPI
+from .users import AsyncUserAPI, UserAPI
+from .users_groups import AsyncUsersGroupsAPI, UsersGroupsAPI
 
 
 class Nextcloud:
@@ -13,4 +13,25 @@ class Nextcloud:
 
     @property
     def connected(self) -> bool:
-        return self.connection.adapter is not None
+        return self.connection.connected
+
+
+class AsyncNextcloud:
+    def __init__(self, **kwargs):
+        self.connection = AsyncConnection(**kwargs)
+        self.users = AsyncUserAPI(self.connection)
+        self.users_groups = AsyncUsersGroupsAPI(self.connection)
+        self.files = AsyncFilesAPI(self.connection)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    async def close(self) -> None:
+        await self.connection.close()
+
+    @property
+    def connected(self) -> bool:
+        return self.connection.connected
@@ -0,0 +1,44 @@
+"""
+Lazy walking of paginated OCS listings, with the next page fetched while the current one is consumed.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, List
+
+DEFAULT_PAGE_SIZE = 500
+
+
+def iter_pages(fetch: Callable[[int, int], List[Any]], page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[Any]:
+    """Yields items of pages returned by ``fetch(limit, offset)`` until a short page is received."""
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        offset = 0
+        future = executor.submit(fetch, page_size, offset)
+        while True:
+            page = future.result()
+            offset += page_size
+            if len(page) >= page_size:
+                future = executor.submit(fetch, page_size, offset)
+            yield from page
+            if len(page) < page_size:
+                return
+
+
+async def aiter_pages(
+    fetch: Callable[[int, int], Awaitable[List[Any]]], page_size: int = DEFAULT_PAGE_SIZE
+) -> AsyncIterator[Any]:
+    """Async version of :py:func:`iter_pages`."""
+    offset = 0
+    task = asyncio.ensure_future(fetch(page_size, offset))
+    try:
+        while True:
+            page = await task
+            offset += page_size
+            if len(page) >= page_size:
+                task = asyncio.ensure_future(fetch(page_size, offset))
+            for i in page:
+                yield i
+            if len(page) < page_size:
+                return
+    finally:
+        task.cancel()
@@ -0,0 +1,195 @@
+"""
+Transport pools shared by connections of many users: one keep-alive client per Nextcloud host, credentials are sent
+per request, so a new user costs no new client and no TLS handshake.
+
+    pool = ConnectionPool(max_connections=50)
+    nc = Nextcloud(pool=pool, nextcloud_url=url, nc_auth_user=user, nc_auth_pass=app_password)
+"""
+
+import time
+from contextlib import asynccontextmanager, contextmanager
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from threading import Lock
+from typing import Any, AsyncIterator, Dict, Generic, Iterator, List, Optional, TypeVar, Union
+
+from httpx import AsyncClient, Client, Limits
+
+C = TypeVar("C", Client, AsyncClient)
+
+
+class _Host(Generic[C]):
+    __slots__ = ("client", "active", "requests", "last_used")
+
+    def __init__(self, client: C):
+        self.client = client
+        self.active = 0
+        self.requests = 0
+        self.last_used = time.monotonic()
+
+
+class BasicPool(Generic[C]):
+    """Bookkeeping shared by the sync and async pools.
+
+    :param max_connections: connections per host, requests over the limit wait for a free one.
+    :param max_keepalive_connections: idle connections per host kept open.
+    :param keepalive_expiry: seconds an idle connection is kept open.
+    :param idle_timeout: seconds after which the client of a host without requests is closed.
+    :param verify: TLS verification, ``False`` or a CA bundle path for self-signed servers.
+    :param http2: multiplex requests over HTTP/2 connections, requires the ``h2`` package (``httpx[http2]``).
+    :param timeout: httpx timeout of requests.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 15.0,
+        idle_timeout: float = 300.0,
+        verify: Union[bool, str] = True,
+        http2: bool = False,
+        timeout: float = 5.0,
+    ):
+        self.limits = Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.idle_timeout = idle_timeout
+        self.verify = verify
+        self.http2 = http2
+        self.timeout = timeout
+        self.created = 0
+        self.evicted = 0
+        self._hosts: Dict[str, _Host[C]] = {}
+        self._lock = Lock()
+
+    def _new_client(self) -> C:
+        raise NotImplementedError()
+
+    def _client_args(self) -> dict:
+        return {
+            "follow_redirects": True,
+            "limits": self.limits,
+            "verify": self.verify,
+            "http2": self.http2,
+            "timeout": self.timeout,
+            "headers": {"OCS-APIRequest": "true"},
+            # the client is shared by users, a session cookie of one must never be sent with the requests of another
+            "cookies": CookieJar(DefaultCookiePolicy(allowed_domains=[])),
+        }
+
+    def _acquire(self, endpoint: str) -> C:
+        with self._lock:
+            host = self._hosts.get(endpoint, None)
+            if host is None:
+                host = self._hosts[endpoint] = _Host(self._new_client())
+                self.created += 1
+            host.active += 1
+            host.requests += 1
+            return host.client
+
+    def _release(self, endpoint: str) -> List[C]:
+        """Returns clients of other hosts that became idle for too long, to be closed by the caller."""
+        now = time.monotonic()
+        with self._lock:
+            host = self._hosts[endpoint]
+            host.active -= 1
+            host.last_used = now
+            expired = [k for k, v in self._hosts.items() if not v.active and now - v.last_used > self.idle_timeout]
+            self.evicted += len(expired)
+            return [self._hosts.pop(i).client for i in expired]
+
+    def _take_idle(self, max_idle: float) -> List[C]:
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, v in self._hosts.items() if not v.active and now - v.last_used >= max_idle]
+            self.evicted += len(expired)
+            return [self._hosts.pop(i).client for i in expired]
+
+    def _take_all(self) -> List[C]:
+        with self._lock:
+            clients = [i.client for i in self._hosts.values()]
+            self._hosts.clear()
+            return clients
+
+    def stats(self) -> dict:
+        """Utilization per host: requests in flight, requests served and open (idle) connections."""
+        now = time.monotonic()
+        with self._lock:
+            hosts = {
+                k: {
+                    "active": v.active,
+                    "requests": v.requests,
+                    "idle_seconds": 0.0 if v.active else now - v.last_used,
+                    **_connections(v.client),
+                }
+                for k, v in self._hosts.items()
+            }
+        return {
+            "hosts": hosts,
+            "clients_created": self.created,
+            "clients_evicted": self.evicted,
+            "max_connections": self.limits.max_connections,
+        }
+
+
+def _connections(client: Any) -> dict:
+    # httpx has no public API for the state of its connection pool
+    connections = getattr(getattr(getattr(client, "_transport", None), "_pool", None), "connections", None)
+    if connections is None:
+        return {}
+    return {"connections": len(connections), "idle_connections": len([i for i in connections if i.is_idle()])}
+
+
+class ConnectionPool(BasicPool[Client]):
+    """Pool of ``httpx.Client``, safe to share between threads."""
+
+    def _new_client(self) -> Client:
+        return Client(**self._client_args())
+
+    @contextmanager
+    def lease(self, endpoint: str) -> Iterator[Client]:
+        """Provides the client of the host, which is not closed while leased."""
+        client = self._acquire(endpoint)
+        try:
+            yield client
+        finally:
+            for i in self._release(endpoint):
+                i.close()
+
+    def evict_idle(self, max_idle: Optional[float] = None) -> int:
+        """Closes clients without requests for ``max_idle`` seconds (``idle_timeout`` by default)."""
+        clients = self._take_idle(self.idle_timeout if max_idle is None else max_idle)
+        for i in clients:
+            i.close()
+        return len(clients)
+
+    def close(self) -> None:
+        for i in self._take_all():
+            i.close()
+
+
+class AsyncConnectionPool(BasicPool[AsyncClient]):
+    """Pool of ``httpx.AsyncClient``, to be used from one event loop."""
+
+    def _new_client(self) -> AsyncClient:
+        return AsyncClient(**self._client_args())
+
+    @asynccontextmanager
+    async def lease(self, endpoint: str) -> AsyncIterator[AsyncClient]:
+        client = self._acquire(endpoint)
+        try:
+            yield client
+        finally:
+            for i in self._release(endpoint):
+                await i.aclose()
+
+    async def evict_idle(self, max_idle: Optional[float] = None) -> int:
+        clients = self._take_idle(self.idle_timeout if max_idle is None else max_idle)
+        for i in clients:
+            await i.aclose()
+        return len(clients)
+
+    async def close(self) -> None:
+        for i in self._take_all():
+            await i.aclose()
@@ -0,0 +1,380 @@
+"""
+Retries, deadlines, hedged reads and circuit breaking of requests, configured per connection:
+
+    breaker = CircuitBreaker()  # shared by the connections to the same hosts
+    nc = Nextcloud(retry=RetryPolicy(retries=3, deadline=10.0, hedge_after=0.5), breaker=breaker)
+"""
+
+import asyncio
+import random
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Lock, Timer
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import httpx
+from httpx import Response
+
+from . import exceptions
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE", "PROPFIND")
+HEDGE_METHODS = ("GET", "PROPFIND")
+
+Send = Callable[[Optional[float]], Response]
+"""Sends one attempt, with the timeout in seconds it has left, if the call has a deadline."""
+AsyncSend = Callable[[Optional[float]], Awaitable[Response]]
+
+
+class RetryPolicy:
+    """
+    :param retries: attempts after the first one. Requests that may have reached the server are retried only for
+        idempotent methods, refused connections and 429 responses for any method.
+    :param backoff_base: delay before the first retry, doubled with each further one, with jitter.
+    :param backoff_max: longest delay between attempts.
+    :param max_retry_after: longest ``Retry-After`` of a response to wait for, the response is returned when longer.
+    :param retry_statuses: response codes that are retried.
+    :param deadline: seconds a call may take, attempts and delays included. ``None`` for no deadline.
+    :param hedge_after: seconds after which a GET or PROPFIND without a response yet is sent a second time, the first
+        response of the two is used. ``None`` disables hedging. Sync calls send the first attempt from the calling
+        thread, so the copy answers them only when the first attempt fails, by a timeout for example.
+    :param hedge_workers: threads sending the copies of sync calls with this policy, at most one per call. Copies
+        over it wait for a free thread, set it to the connection limit of the connections using the policy.
+    """
+
+    def __init__(
+        self,
+        retries: int = 2,
+        backoff_base: float = 0.2,
+        backoff_max: float = 10.0,
+        max_retry_after: float = 30.0,
+        retry_statuses: tuple = (429, 502, 503, 504),
+        deadline: Optional[float] = None,
+        hedge_after: Optional[float] = None,
+        hedge_workers: int = 20,
+    ):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = retry_statuses
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.hedge_workers = hedge_workers
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._hedge_lock = Lock()
+
+    def hedge_executor(self) -> ThreadPoolExecutor:
+        with self._hedge_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(self.hedge_workers, thread_name_prefix="nextcloud-hedge")
+            return self._hedge_executor
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return retry_after
+        return min(self.backoff_max, self.backoff_base * 2**attempt) * random.uniform(0.5, 1.0)
+
+
+NO_RETRY = RetryPolicy(retries=0)
+
+
+class _HostState:
+    __slots__ = ("failures", "opened_at", "trial", "opened")
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial = False
+        self.opened = 0
+
+
+class CircuitBreaker:
+    """Fails requests to a host fast after ``failure_threshold`` failures in a row: connection errors, timeouts and
+    5xx responses. After ``reset_timeout`` seconds one request is let through, its success closes the circuit again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._hosts: Dict[str, _HostState] = {}
+        self._lock = Lock()
+
+    def check(self, host: str) -> None:
+        """Raises NextcloudCircuitOpen if the request must not be sent."""
+        with self._lock:
+            state = self._hosts.get(host, None)
+            if state is None or state.opened_at is None:
+                return
+            remaining = state.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or state.trial:
+                raise exceptions.NextcloudCircuitOpen(retry_after=max(remaining, 0.0))
+            state.trial = True
+
+    def record(self, host: str, ok: bool) -> None:
+        with self._lock:
+            state = self._hosts.get(host, None)
+            if state is None:
+                if ok:
+                    return
+                state = self._hosts[host] = _HostState()
+            if ok:
+                state.failures = 0
+                state.opened_at = None
+                state.trial = False
+                return
+            state.failures += 1
+            if state.trial or state.failures >= self.failure_threshold:
+                if state.opened_at is None or state.trial:
+                    state.opened += 1
+                state.opened_at = time.monotonic()
+                state.trial = False
+
+    def release(self, host: str) -> None:
+        """Ends the trial request of a half-open circuit that ended neither in success nor in failure."""
+        with self._lock:
+            state = self._hosts.get(host, None)
+            if state is not None:
+                state.trial = False
+
+    def state(self, host: str) -> str:
+        with self._lock:
+            state = self._hosts.get(host, None)
+            if state is None or state.opened_at is None:
+                return "closed"
+            if state.trial or time.monotonic() >= state.opened_at + self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def stats(self) -> dict:
+        """Circuit state, failures in a row and times opened, by host."""
+        with self._lock:
+            hosts = {k: (v.failures, v.opened) for k, v in self._hosts.items()}
+        return {k: {"state": self.state(k), "failures": v[0], "opened": v[1]} for k, v in hosts.items()}
+
+
+def transport_error(error: httpx.HTTPError) -> exceptions.NextcloudException:
+    if isinstance(error, httpx.TimeoutException):
+        return exceptions.NextcloudRequestTimeout()
+    return exceptions.NextcloudConnectionError(f"{type(error).__name__}: {error}")
+
+
+def _not_sent(error: Exception) -> bool:
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+
+def retry_after(response: Response) -> Optional[float]:
+    """Seconds to wait from the ``Retry-After`` header, which is given in seconds or as an HTTP date."""
+    value = response.headers.get("retry-after", None)
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max((moment - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class _Call:
+    """State of one call over its attempts, shared by :py:func:`call` and :py:func:`acall`."""
+
+    def __init__(
+        self, policy: RetryPolicy, breaker: Optional[CircuitBreaker], host: str, method: str, deadline: Optional[float]
+    ):
+        self.policy = policy
+        self.breaker = breaker
+        self.host = host
+        self.method = method
+        deadline = policy.deadline if deadline is None else deadline
+        self.expires = None if deadline is None else time.monotonic() + deadline
+        self.attempt = 0
+        self.hedge = policy.hedge_after is not None and method in HEDGE_METHODS
+
+    def timeout(self) -> Optional[float]:
+        if self.expires is None:
+            return None
+        remaining = self.expires - time.monotonic()
+        if remaining <= 0:
+            raise exceptions.NextcloudDeadlineExceeded()
+        return remaining
+
+    def before(self) -> Optional[float]:
+        timeout = self.timeout()
+        if self.breaker is not None:
+            self.breaker.check(self.host)
+        return timeout
+
+    def record(self, ok: bool) -> None:
+        if self.breaker is not None:
+            self.breaker.record(self.host, ok)
+
+    def release(self) -> None:
+        if self.breaker is not None:
+            self.breaker.release(self.host)
+
+    def response_delay(self, response: Response) -> Optional[float]:
+        """Records the response, returns the delay before the next attempt or None to return the response."""
+        self.record(response.status_code < 500)
+        if response.status_code not in self.policy.retry_statuses:
+            return None
+        if response.status_code != 429 and self.method not in IDEMPOTENT_METHODS:
+            return None
+        delay = retry_after(response)
+        if delay is not None and delay > self.policy.max_retry_after:
+            return None
+        return self._next_delay(delay)
+
+    def error_delay(self, error: httpx.HTTPError) -> float:
+        """Records the failed attempt, returns the delay before the next one or raises the mapped error."""
+        self.record(False)
+        mapped = transport_error(error)
+        if not _not_sent(error) and self.method not in IDEMPOTENT_METHODS:
+            raise mapped from None
+        delay = self._next_delay(None)
+        if delay is None:
+            if self.expires is not None and self.attempt < self.policy.retries:
+                raise exceptions.NextcloudDeadlineExceeded() from None
+            raise mapped from None
+        return delay
+
+    def _next_delay(self, retry_after: Optional[float]) -> Optional[float]:
+        if self.attempt >= self.policy.retries:
+            return None
+        delay = self.policy.delay(self.attempt, retry_after)
+        if self.expires is not None and time.monotonic() + delay >= self.expires:
+            return None
+        self.attempt += 1
+        return delay
+
+
+def _close_result(future: Future) -> None:
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _hedged(send: Send, timeout: Optional[float], hedge_after: float, executor: ThreadPoolExecutor) -> Response:
+    """Sends the request from the calling thread and, if it has no response after ``hedge_after``, a copy of it from
+    ``executor``. The copy answers the call if the request fails, else it is closed when it arrives."""
+    hedges: Optional[List[Future]] = []
+    lock = Lock()
+
+    def launch() -> None:
+        with lock:
+            if hedges is not None:
+                hedges.append(executor.submit(send, None if timeout is None else max(timeout - hedge_after, 0.001)))
+
+    def stop() -> Optional[Future]:
+        nonlocal hedges
+        timer.cancel()
+        with lock:
+            launched, hedges = hedges, None
+        return launched[0] if launched else None
+
+    timer = Timer(hedge_after, launch)
+    timer.daemon = True
+    timer.start()
+    try:
+        return send(timeout)
+    except httpx.HTTPError:
+        hedge = stop()
+        if hedge is None:
+            raise
+        return hedge.result()
+    finally:
+        hedge = stop()
+        if hedge is not None:  # answered by the request
+            hedge.add_done_callback(_close_result)
+
+
+def call(
+    policy: RetryPolicy, breaker: Optional[CircuitBreaker], host: str, method: str, send: Send, deadline=None
+) -> Response:
+    """Sends the request with retries. Returns the last response, even with an error status, as the caller decodes
+    it; raises NextcloudRequestTimeout, NextcloudConnectionError, NextcloudDeadlineExceeded or NextcloudCircuitOpen.
+    """
+    state = _Call(policy, breaker, host, method, deadline)
+    while True:
+        timeout = state.before()
+        try:
+            if state.hedge:
+                response = _hedged(send, timeout, policy.hedge_after, policy.hedge_executor())  # type: ignore[arg-type]
+            else:
+                response = send(timeout)
+        except httpx.HTTPError as e:
+            delay = state.error_delay(e)
+        except BaseException:
+            state.release()
+            raise
+        else:
+            delay = state.response_delay(response)
+            if delay is None:
+                return response
+            response.close()
+        time.sleep(delay)
+
+
+_closing: Set[asyncio.Future] = set()
+
+
+def _aclose_result(task: asyncio.Future) -> None:
+    if not task.cancelled() and task.exception() is None:
+        closing = asyncio.ensure_future(task.result().aclose())
+        _closing.add(closing)
+        closing.add_done_callback(_closing.discard)
+
+
+async def _ahedged(send: AsyncSend, timeout: Optional[float], hedge_after: float) -> Response:
+    pending = {asyncio.ensure_future(send(timeout))}
+    done: Set[asyncio.Future] = set()
+    winner = None
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_after)
+        if not done:
+            pending.add(asyncio.ensure_future(send(None if timeout is None else max(timeout - hedge_after, 0.001))))
+        error: Optional[BaseException] = None
+        while True:
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    winner = task
+                    return task.result()
+            if not pending:
+                raise error  # type: ignore[misc]
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+        for task in (done | pending) - {winner}:
+            task.add_done_callback(_aclose_result)  # a response that arrived anyway is closed
+
+
+async def acall(
+    policy: RetryPolicy, breaker: Optional[CircuitBreaker], host: str, method: str, send: AsyncSend, deadline=None
+) -> Response:
+    """Async version of :py:func:`call`, the slower request of a hedged pair is cancelled."""
+    state = _Call(policy, breaker, host, method, deadline)
+    while True:
+        timeout = state.before()
+        try:
+            if state.hedge:
+                response = await _ahedged(send, timeout, policy.hedge_after)  # type: ignore[arg-type]
+            else:
+                response = await send(timeout)
+        except httpx.HTTPError as e:
+            delay = state.error_delay(e)
+        except BaseException:
+            state.release()
+            raise
+        else:
+            delay = state.response_delay(response)
+            if delay is None:
+                return response
+            await response.aclose()
+        await asyncio.sleep(delay)
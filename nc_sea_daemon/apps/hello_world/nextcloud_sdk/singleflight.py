@@ -0,0 +1,68 @@
+"""
+Coalescing of identical concurrent calls: the first caller of a key runs the call, callers arriving while it runs wait
+for it and get the same result or exception.
+"""
+
+import asyncio
+from threading import Event, Lock
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """For threads. ``shared`` counts calls that were served by the call of another thread."""
+
+    def __init__(self):
+        self.shared = 0
+        self._flights: Dict[Any, _Flight] = {}
+        self._lock = Lock()
+
+    def do(self, key: Any, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._flights.get(key, None)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.shared += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = func()
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+class AsyncSingleFlight:
+    """For coroutines of one event loop. The call runs as a task of its own, so a cancelled caller does not cancel
+    it for the others."""
+
+    def __init__(self):
+        self.shared = 0
+        self._flights: Dict[Any, asyncio.Future] = {}
+
+    async def do(self, key: Any, func: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._flights.get(key, None)
+        if future is None:
+            future = self._flights[key] = asyncio.ensure_future(func())
+            future.add_done_callback(lambda _: self._flights.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(future)
@@ -0,0 +1,95 @@
+"""
+Helpers for streaming file content: splitting upload sources into chunks and download ranges into parts.
+"""
+
+from itertools import chain
+from os import fstat
+from typing import Any, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+from httpx import Response
+
+from . import exceptions
+
+READ_SIZE = 64 * 1024
+UPLOAD_CHUNK_SIZE = 10 * 1024 * 1024
+DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+
+
+def source_size(source: Any) -> Optional[int]:
+    """Returns the number of bytes left in the source, if it can be known without reading it."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    try:
+        return fstat(source.fileno()).st_size - source.tell()
+    except (AttributeError, OSError, ValueError):
+        pass
+    if getattr(source, "seekable", lambda: False)():
+        position = source.tell()
+        size = source.seek(0, 2) - position
+        source.seek(position)
+        return size
+    return None
+
+
+def _source_pieces(source: Any) -> Iterator[bytes]:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield bytes(source)
+    elif hasattr(source, "read"):
+        while True:
+            piece = source.read(READ_SIZE)
+            if not piece:
+                return
+            yield piece
+    else:
+        yield from source
+
+
+def source_chunks(source: Any, chunk_size: int) -> Iterator[bytes]:
+    """Reads bytes, a file object or an iterable of bytes as a sequence of ``chunk_size`` chunks."""
+    buffer = bytearray()
+    for piece in _source_pieces(source):
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def peek_single_chunk(chunks: Iterator[bytes]) -> Tuple[Optional[bytes], Iterator[bytes]]:
+    """Returns the only chunk if there is at most one, otherwise None and the untouched chunk stream."""
+    first = next(chunks, b"")
+    second = next(chunks, None)
+    if second is None:
+        return first, iter(())
+    return None, chain((first, second), chunks)
+
+
+def upload_path(user: str) -> str:
+    return f"/remote.php/dav/uploads/{user}/nc-sdk-{uuid4().hex}"
+
+
+def chunk_path(path: str, number: int) -> str:
+    return f"{path}/{number:05d}"
+
+
+def download_parts(offset: int, size: int, part_size: int) -> List[Tuple[int, int]]:
+    """Splits ``[offset, size)`` into inclusive byte ranges."""
+    return [(i, min(i + part_size, size) - 1) for i in range(offset, size, part_size)]
+
+
+def range_header(start: int, end: Optional[int] = None) -> dict:
+    return {"Range": f"bytes={start}-{'' if end is None else end}"}
+
+
+def ranged_size(response: Response) -> Optional[int]:
+    """Size of the whole file from a HEAD response, None if the server does not support ranges."""
+    if response.headers.get("accept-ranges", "") != "bytes" or "content-length" not in response.headers:
+        return None
+    return int(response.headers["content-length"])
+
+
+def check_partial(response: Response, start: int) -> None:
+    if response.status_code != 206 or not response.headers.get("content-range", "").startswith(f"bytes {start}-"):
+        raise exceptions.NextcloudException(status_code=response.status_code, reason="Range request was not honored.")
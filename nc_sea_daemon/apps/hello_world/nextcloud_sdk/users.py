@@ -1,9 +1,24 @@
-from typing import Optional
+from typing import AsyncIterator, Iterable, Iterator, List, Optional
 
-from .connections import Connection
+from . import codec
+from .bulk import BulkResult, arun_bulk, bulk_retries, run_bulk
+from .connections import AsyncConnection, Connection
+from .pagination import DEFAULT_PAGE_SIZE, aiter_pages, iter_pages
 
 ENDPOINT_BASE = "/ocs/v1.php/cloud"
 ENDPOINT = f"{ENDPOINT_BASE}/users"
+GROUPS = f"{ENDPOINT_BASE}/groups/"
+
+
+def list_params(mask: Optional[str], limit: Optional[int], offset: Optional[int]) -> dict:
+    data = {}
+    if mask is not None:
+        data["search"] = mask
+    if limit is not None:
+        data["limit"] = limit
+    if offset is not None:
+        data["offset"] = offset
+    return data
 
 
 class UserAPI:
@@ -11,18 +26,19 @@ class UserAPI:
         self.connection = connection
 
     def list_users(self, mask: Optional[str] = "", limit: Optional[int] = None, offset: Optional[int] = None) -> dict:
-        data = {}
-        if mask is not None:
-            data["search"] = mask
-        if limit is not None:
-            data["limit"] = limit
-        if offset is not None:
-            data["offset"] = offset
+        data = list_params(mask, limit, offset)
         response_data = self.connection.request(method="GET", path=ENDPOINT, data=data)
         return response_data["users"] if response_data else {}
 
-    def get_user(self, user_id: str) -> dict:
-        return self.connection.request(method="GET", path=f"{ENDPOINT}/{user_id}")
+    def iter_users(self, mask: Optional[str] = "", page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[str]:
+        """Yields all user ids, requesting them page by page."""
+        return iter_pages(lambda limit, offset: self.list_users(mask, limit, offset), page_size)
+
+    def get_user(self, user_id: str, typed: bool = False):
+        """Returns the details of the user as dict, or as :py:class:`~nextcloud_sdk.codec.UserDetails` with ``typed``
+        (requires msgspec)."""
+        data_type = codec.UserDetails if typed else None
+        return self.connection.request(method="GET", path=f"{ENDPOINT}/{user_id}", data_type=data_type)
 
     def create_user(self, user_id: str, **kwargs) -> dict:
         password = kwargs.get("password", None)
@@ -33,10 +49,10 @@ class UserAPI:
         for k in ("password", "displayname", "email", "groups", "subadmin", "quota", "language"):
             if k in kwargs:
                 data[k] = kwargs[k]
-        return self.connection.request(method="POST", path=ENDPOINT, data=data)
+        return self.connection.request(method="POST", path=ENDPOINT, data=data, invalidate=[GROUPS])
 
     def delete_user(self, user_id: str) -> dict:
-        return self.connection.request(method="DELETE", path=f"{ENDPOINT}/{user_id}")
+        return self.connection.request(method="DELETE", path=f"{ENDPOINT}/{user_id}", invalidate=[GROUPS])
 
     def enable_user(self, user_id: str) -> dict:
         return self.connection.request(method="PUT", path=f"{ENDPOINT}/{user_id}/enable")
@@ -54,17 +70,166 @@ class UserAPI:
         return self.connection.request(method="PUT", path=f"{ENDPOINT}/{user_id}", data={**kwargs})
 
     def add_user_to_group(self, user_id: str, group_id: str) -> dict:
-        return self.connection.request(method="POST", path=f"{ENDPOINT}/{user_id}/groups", data={"groupid": group_id})
+        return self.connection.request(
+            method="POST",
+            path=f"{ENDPOINT}/{user_id}/groups",
+            data={"groupid": group_id},
+            invalidate=[GROUPS + group_id],
+        )
 
     def remove_user_from_group(self, user_id: str, group_id: str) -> dict:
-        return self.connection.request(method="DELETE", path=f"{ENDPOINT}/{user_id}/groups", data={"groupid": group_id})
+        return self.connection.request(
+            method="DELETE",
+            path=f"{ENDPOINT}/{user_id}/groups",
+            data={"groupid": group_id},
+            invalidate=[GROUPS + group_id],
+        )
 
     def promote_user_to_subadmin(self, user_id: str, group_id: str) -> dict:
         return self.connection.request(
-            method="POST", path=f"{ENDPOINT}/{user_id}/subadmins", data={"groupid": group_id}
+            method="POST",
+            path=f"{ENDPOINT}/{user_id}/subadmins",
+            data={"groupid": group_id},
+            invalidate=[GROUPS + group_id],
         )
 
     def demote_user_from_subadmin(self, user_id: str, group_id: str) -> dict:
         return self.connection.request(
-            method="DELETE", path=f"{ENDPOINT}/{user_id}/subadmins", data={"groupid": group_id}
+            method="DELETE",
+            path=f"{ENDPOINT}/{user_id}/subadmins",
+            data={"groupid": group_id},
+            invalidate=[GROUPS + group_id],
+        )
+
+    def get_users(
+        self, user_ids: Iterable[str], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return run_bulk(
+            self.get_user,
+            user_ids,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+    def create_users(
+        self, users: Iterable[dict], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        """Creates users described by dicts with ``user_id`` and the keyword arguments of ``create_user``."""
+        return run_bulk(
+            lambda x: self.create_user(**x),
+            users,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+    def edit_users(
+        self, changes: Iterable[dict], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        """Applies dicts with ``user_id`` and the keyword arguments of ``edit_user``."""
+        return run_bulk(
+            lambda x: self.edit_user(**x),
+            changes,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+    def delete_users(
+        self, user_ids: Iterable[str], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return run_bulk(
+            self.delete_user,
+            user_ids,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+    def add_users_to_group(
+        self, user_ids: Iterable[str], group_id: str, concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return run_bulk(
+            lambda x: self.add_user_to_group(x, group_id),
+            user_ids,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+
+class AsyncUserAPI(UserAPI):
+    """Async twin of :py:class:`UserAPI`. Methods without post-processing are inherited and return awaitables."""
+
+    connection: AsyncConnection
+
+    def __init__(self, connection: AsyncConnection):  # pylint: disable=super-init-not-called
+        self.connection = connection
+
+    async def list_users(  # type: ignore[override]
+        self, mask: Optional[str] = "", limit: Optional[int] = None, offset: Optional[int] = None
+    ) -> dict:
+        data = list_params(mask, limit, offset)
+        response_data = await self.connection.request(method="GET", path=ENDPOINT, data=data)
+        return response_data["users"] if response_data else {}
+
+    def iter_users(  # type: ignore[override]
+        self, mask: Optional[str] = "", page_size: int = DEFAULT_PAGE_SIZE
+    ) -> AsyncIterator[str]:
+        return aiter_pages(lambda limit, offset: self.list_users(mask, limit, offset), page_size)
+
+    async def get_users(  # type: ignore[override]
+        self, user_ids: Iterable[str], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return await arun_bulk(
+            self.get_user,
+            user_ids,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+    async def create_users(  # type: ignore[override]
+        self, users: Iterable[dict], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return await arun_bulk(
+            lambda x: self.create_user(**x),
+            users,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+    async def edit_users(  # type: ignore[override]
+        self, changes: Iterable[dict], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return await arun_bulk(
+            lambda x: self.edit_user(**x),
+            changes,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+    async def delete_users(  # type: ignore[override]
+        self, user_ids: Iterable[str], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return await arun_bulk(
+            self.delete_user,
+            user_ids,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+    async def add_users_to_group(  # type: ignore[override]
+        self, user_ids: Iterable[str], group_id: str, concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return await arun_bulk(
+            lambda x: self.add_user_to_group(x, group_id),
+            user_ids,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
         )
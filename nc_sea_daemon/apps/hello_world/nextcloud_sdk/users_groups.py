@@ -1,6 +1,9 @@
-from typing import Optional
+from typing import AsyncIterator, Iterable, Iterator, List, Optional
 
-from .connections import Connection
+from .bulk import BulkResult, arun_bulk, bulk_retries, run_bulk
+from .connections import AsyncConnection, Connection
+from .pagination import DEFAULT_PAGE_SIZE, aiter_pages, iter_pages
+from .users import list_params
 
 ENDPOINT_BASE = "/ocs/v1.php/cloud"
 ENDPOINT = f"{ENDPOINT_BASE}/groups"
@@ -11,16 +14,14 @@ class UsersGroupsAPI:
         self.connection = connection
 
     def list_groups(self, mask: Optional[str] = "", limit: Optional[int] = None, offset: Optional[int] = None) -> dict:
-        data = {}
-        if mask is not None:
-            data["search"] = mask
-        if limit is not None:
-            data["limit"] = limit
-        if offset is not None:
-            data["offset"] = offset
+        data = list_params(mask, limit, offset)
         response_data = self.connection.request(method="GET", path=ENDPOINT, data=data)
         return response_data["groups"] if response_data else {}
 
+    def iter_groups(self, mask: Optional[str] = "", page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[str]:
+        """Yields all group ids, requesting them page by page."""
+        return iter_pages(lambda limit, offset: self.list_groups(mask, limit, offset), page_size)
+
     def create_group(self, group_id: str) -> dict:
         return self.connection.request(method="POST", path=f"{ENDPOINT}", data={"groupid": group_id})
 
@@ -28,6 +29,19 @@ class UsersGroupsAPI:
         response_data = self.connection.request(method="GET", path=f"{ENDPOINT}/{group_id}")
         return response_data["users"] if response_data else {}
 
+    def list_members_of_group(
+        self, group_id: str, mask: Optional[str] = "", limit: Optional[int] = None, offset: Optional[int] = None
+    ) -> list:
+        data = list_params(mask, limit, offset)
+        response_data = self.connection.request(method="GET", path=f"{ENDPOINT}/{group_id}/users/details", data=data)
+        return list(response_data["users"]) if response_data else []
+
+    def iter_members_of_group(
+        self, group_id: str, mask: Optional[str] = "", page_size: int = DEFAULT_PAGE_SIZE
+    ) -> Iterator[str]:
+        """Yields ids of all group members, requesting them page by page."""
+        return iter_pages(lambda limit, offset: self.list_members_of_group(group_id, mask, limit, offset), page_size)
+
     def get_subadmins_of_group(self, group_id: str) -> dict:
         return self.connection.request(method="GET", path=f"{ENDPOINT}/{group_id}/subadmins")
 
@@ -35,4 +49,89 @@ class UsersGroupsAPI:
         return self.connection.request(method="PUT", path=f"{ENDPOINT}/{group_id}", data={**kwargs})
 
     def delete_group(self, group_id: str) -> dict:
-        return self.connection.request(method="DELETE", path=f"{ENDPOINT}/{group_id}")
+        return self.connection.request(
+            method="DELETE", path=f"{ENDPOINT}/{group_id}", invalidate=[f"{ENDPOINT_BASE}/users"]
+        )
+
+    def create_groups(
+        self, group_ids: Iterable[str], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return run_bulk(
+            self.create_group,
+            group_ids,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+    def delete_groups(
+        self, group_ids: Iterable[str], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return run_bulk(
+            self.delete_group,
+            group_ids,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+
+class AsyncUsersGroupsAPI(UsersGroupsAPI):
+    """Async twin of :py:class:`UsersGroupsAPI`. Methods without post-processing are inherited and return awaitables."""
+
+    connection: AsyncConnection
+
+    def __init__(self, connection: AsyncConnection):  # pylint: disable=super-init-not-called
+        self.connection = connection
+
+    async def list_groups(  # type: ignore[override]
+        self, mask: Optional[str] = "", limit: Optional[int] = None, offset: Optional[int] = None
+    ) -> dict:
+        data = list_params(mask, limit, offset)
+        response_data = await self.connection.request(method="GET", path=ENDPOINT, data=data)
+        return response_data["groups"] if response_data else {}
+
+    def iter_groups(  # type: ignore[override]
+        self, mask: Optional[str] = "", page_size: int = DEFAULT_PAGE_SIZE
+    ) -> AsyncIterator[str]:
+        return aiter_pages(lambda limit, offset: self.list_groups(mask, limit, offset), page_size)
+
+    async def get_members_of_group(self, group_id: str) -> dict:  # type: ignore[override]
+        response_data = await self.connection.request(method="GET", path=f"{ENDPOINT}/{group_id}")
+        return response_data["users"] if response_data else {}
+
+    async def list_members_of_group(  # type: ignore[override]
+        self, group_id: str, mask: Optional[str] = "", limit: Optional[int] = None, offset: Optional[int] = None
+    ) -> list:
+        data = list_params(mask, limit, offset)
+        response_data = await self.connection.request(
+            method="GET", path=f"{ENDPOINT}/{group_id}/users/details", data=data
+        )
+        return list(response_data["users"]) if response_data else []
+
+    def iter_members_of_group(  # type: ignore[override]
+        self, group_id: str, mask: Optional[str] = "", page_size: int = DEFAULT_PAGE_SIZE
+    ) -> AsyncIterator[str]:
+        return aiter_pages(lambda limit, offset: self.list_members_of_group(group_id, mask, limit, offset), page_size)
+
+    async def create_groups(  # type: ignore[override]
+        self, group_ids: Iterable[str], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return await arun_bulk(
+            self.create_group,
+            group_ids,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
+
+    async def delete_groups(  # type: ignore[override]
+        self, group_ids: Iterable[str], concurrency: int = 8, retries: Optional[int] = None
+    ) -> List[BulkResult]:
+        return await arun_bulk(
+            self.delete_group,
+            group_ids,
+            concurrency,
+            bulk_retries(self.connection, retries),
+            self.connection.retry.max_retry_after,
+        )
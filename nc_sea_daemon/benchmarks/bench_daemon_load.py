@@ -0,0 +1,175 @@
+"""
+Throughput of the daemon's `/status`, `/app-run` and `/app-install` endpoints with different numbers of uvicorn workers.
+
+Every configuration runs a fresh daemon in a temporary folder. `/app-run` is measured as run + stop cycles, each
+client runs and stops its own app. Runs refused because the exit of the previous one was not recorded yet are counted
+as failed. `/app-install` is measured from the request until the job finished, every install is a new app with a
+package the daemon did not download before, served by ``mock_nextcloud.py``.
+
+    python3 benchmarks/bench_daemon_load.py [--workers 1 2 4] [--clients 32] [--duration 5] [--endpoints status ...]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from subprocess import Popen
+
+import httpx
+from mock_nextcloud import MockNextcloud
+
+DAEMON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUTH = ("bench", "secret")
+ENDPOINTS = ("status", "app_run", "app_install")
+
+
+def _prepare(folder: str, port: int, apps: int) -> None:
+    for i in range(apps):
+        os.makedirs(os.path.join(folder, "apps", f"bench{i}"))
+        with open(os.path.join(folder, "apps", f"bench{i}", "appinfo.json"), "w", encoding="utf8") as f:
+            json.dump({"entry_point": "sleep", "args": ["60"]}, f)
+    with open(os.path.join(folder, "daemon_cfg.json"), "w", encoding="utf8") as f:
+        options = {"log_level": "ERROR", "host": "127.0.0.1", "port": port, "xauth": ":".join(AUTH)}
+        json.dump({"apps": {f"bench{i}": {} for i in range(apps)}, "options": options}, f)
+
+
+async def _install(client: httpx.AsyncClient, app_name: str, package_url: str) -> bool:
+    params = {"nc_url": "http://localhost", "user_token": "user:pass", "app_name": app_name, "package_url": package_url}
+    job_id = (await client.post("/app-install", params=params)).json()["job_id"]
+    while True:
+        job = (await client.get("/app-install", params={"job_id": job_id})).json().get("job", None)
+        if job is not None and job["state"] in ("finished", "failed"):
+            return job["state"] == "finished"
+        await asyncio.sleep(0.01)
+
+
+async def _client_loop(client: httpx.AsyncClient, endpoint: str, index: int, deadline: float, mock_url: str) -> tuple:
+    timings, failed = [], 0
+    run = {"nc_url": "http://localhost", "user_token": "user:pass", "app_name": f"bench{index}"}
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        if endpoint == "status":
+            response = await client.get("/status", params={"limit": 10})
+            response.raise_for_status()
+        elif endpoint == "app_install":
+            app_name = f"install{index}x{len(timings) + failed}"
+            if not await _install(client, app_name, f"{mock_url}/packages/{app_name}.tar.gz"):
+                failed += 1
+                continue
+        else:
+            response = (await client.post("/app-run", json=run)).json()
+            if response["status"] != "ok":
+                # the exit of the previous run, stopped by another daemon worker, is not recorded yet
+                failed += 1
+                continue
+            await client.post("/app-stop", params={"app_pid": response["pid"]})
+        timings.append(time.perf_counter() - started)
+    return timings, failed
+
+
+def _client_process(base_url: str, endpoint: str, indexes: list, duration: float, mock_url: str, results) -> None:
+    async def main():
+        limits = httpx.Limits(max_connections=len(indexes))
+        async with httpx.AsyncClient(base_url=base_url, auth=AUTH, limits=limits, timeout=60.0) as client:
+            deadline = time.perf_counter() + duration
+            loops = await asyncio.gather(*[_client_loop(client, endpoint, i, deadline, mock_url) for i in indexes])
+        results.put(([j for i in loops for j in i[0]], sum(i[1] for i in loops)))
+
+    asyncio.run(main())
+
+
+def _measure(base_url: str, endpoint: str, clients: int, processes: int, duration: float, mock_url: str) -> dict:
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=_client_process,
+            args=(base_url, endpoint, list(range(i, clients, processes)), duration, mock_url, results),
+        )
+        for i in range(processes)
+    ]
+    for i in workers:
+        i.start()
+    timings, failed = [], 0
+    for _ in workers:
+        process_timings, process_failed = results.get()
+        timings.extend(process_timings)
+        failed += process_failed
+    for i in workers:
+        i.join()
+    timings.sort()
+    if not timings:
+        return {"requests_per_second": 0.0, "failed": failed, "p50_ms": None, "p99_ms": None}
+    return {
+        "requests_per_second": len(timings) / duration,
+        "failed": failed,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p99_ms": timings[int(len(timings) * 0.99)] * 1000,
+    }
+
+
+def _wait_ready(base_url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{base_url}/status", auth=AUTH).raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError("daemon did not start")
+
+
+def run(workers: int, clients: int, processes: int, duration: float, port: int, endpoints=ENDPOINTS) -> dict:
+    with tempfile.TemporaryDirectory() as folder, MockNextcloud() as mock:
+        _prepare(folder, port, clients)
+        args = ["--app-dir", DAEMON_DIR, "--port", str(port), "--workers", str(workers), "--log-level", "error"]
+        with Popen([sys.executable, "-m", "uvicorn", "daemon:APP", *args], cwd=folder) as daemon:
+            try:
+                base_url = f"http://127.0.0.1:{port}"
+                _wait_ready(base_url)
+                result: dict = {"workers": workers}
+                for endpoint in endpoints:
+                    result[endpoint] = _measure(base_url, endpoint, clients, processes, duration, mock.url)
+                return result
+            finally:
+                daemon.terminate()
+                daemon.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--client-processes", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per endpoint")
+    parser.add_argument("--port", type=int, default=8070)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    options = parser.parse_args()
+    results = []
+    for workers in options.workers:
+        results.append(
+            run(workers, options.clients, options.client_processes, options.duration, options.port, options.endpoints)
+        )
+        if not options.json:
+            result = results[-1]
+            for endpoint in options.endpoints:
+                measured = result[endpoint]
+                if measured["p50_ms"] is None:
+                    print(f"workers={workers:<3} {endpoint:<12} no successful requests, failed {measured['failed']}")
+                    continue
+                print(
+                    f"workers={workers:<3} {endpoint:<12} {measured['requests_per_second']:9.1f} req/s"
+                    f"   p50 {measured['p50_ms']:7.1f} ms   p99 {measured['p99_ms']:7.1f} ms"
+                    f"   failed {measured['failed']}"
+                )
+    if options.json:
+        print(json.dumps({"cpus": os.cpu_count(), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
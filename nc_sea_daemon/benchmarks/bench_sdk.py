@@ -0,0 +1,99 @@
+"""
+SDK micro-benchmarks against a local mock Nextcloud (see ``mock_nextcloud.py``), started in a separate process.
+
+Every case is measured end to end and, with ``decode`` in its name, as decoding of an already received response only,
+which separates JSON and XML parsing from the network.
+
+    python3 benchmarks/bench_sdk.py [-n RUNS] [--users 1000 100000] [--entries 10000] [--json]
+"""
+
+import argparse
+import json
+import sys
+import time
+from os import path
+from subprocess import PIPE, Popen
+from typing import Callable, Dict, List
+
+import httpx
+
+BENCHMARKS_DIR = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.join(path.dirname(BENCHMARKS_DIR), "apps", "hello_world"))
+
+# pylint: disable=wrong-import-position
+from nextcloud_sdk import Nextcloud, codec  # noqa: E402
+from nextcloud_sdk.connections import BasicConnection  # noqa: E402
+from nextcloud_sdk.files import propfind_body  # noqa: E402
+
+from stats import report, summarize  # noqa: E402
+
+# pylint: enable=wrong-import-position
+
+
+def _measure(case: Callable[[], object], runs: int) -> dict:
+    case()  # warm up connections and caches
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        case()
+        timings.append(time.perf_counter() - started)
+    return summarize(timings)
+
+
+def _cases(nc: Nextcloud, base_url: str, users: List[int], entries: int) -> Dict[str, Callable[[], object]]:
+    cases: Dict[str, Callable[[], object]] = {}
+    for count in users:
+        cases[f"list_users_{count}"] = lambda count=count: nc.users.list_users(limit=count)
+        response = httpx.get(f"{base_url}/ocs/v1.php/cloud/users", params={"limit": count, "format": "json"})
+        for name in codec.PREFERENCE:
+            try:
+                connection = BasicConnection(
+                    nextcloud_url=base_url, nc_auth_user="admin", nc_auth_pass="secret", json_codec=name
+                )
+            except ValueError:
+                continue
+            cases[f"decode_users_{count}_{name}"] = lambda c=connection, r=response: c._ocs_response(r)
+        if codec.msgspec is not None:
+            cases[f"decode_users_{count}_typed"] = lambda c=connection, r=response: c._ocs_response(r, codec.UserList)
+    folder = f"entries-{entries}"
+    cases[f"propfind_stream_{entries}"] = lambda: nc.files.list_files("admin", folder)
+    dav_path = f"/remote.php/dav/files/admin/{folder}"
+    cases[f"propfind_xmltodict_{entries}"] = lambda: nc.files.connection.dav_request(
+        "PROPFIND", dav_path, propfind_body(None)
+    )
+    response = httpx.request("PROPFIND", f"{base_url}{dav_path}", content=propfind_body(None))
+    cases[f"decode_propfind_xmltodict_{entries}"] = lambda: BasicConnection._dav_response(response)
+    return cases
+
+
+def run(runs: int, users: List[int], entries: int, port: int) -> dict:
+    server_args = ["--port", str(port), "--users", str(max(users)), "--entries", str(entries)]
+    with Popen(
+        [sys.executable, path.join(BENCHMARKS_DIR, "mock_nextcloud.py"), *server_args], stdout=PIPE, text=True
+    ) as server:
+        try:
+            base_url = server.stdout.readline().split()[0]  # type: ignore[union-attr]
+            nc = Nextcloud(nextcloud_url=base_url, nc_auth_user="admin", nc_auth_pass="secret")
+            return {name: _measure(case, runs) for name, case in _cases(nc, base_url, users, entries).items()}
+        finally:
+            server.terminate()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--runs", type=int, default=10)
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 100000], help="users per list_users call")
+    parser.add_argument("--entries", type=int, default=10000, help="entries of the listed folder")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    options = parser.parse_args()
+    results = run(options.runs, options.users, options.entries, options.port)
+    if options.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, summary in results.items():
+        report(name, summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Startup time of an app run: a fresh ``Popen`` of the interpreter against a fork of a pre-imported fork server.
+
+The app imports the given modules and exits, so the time to exit is its cold start latency.
+
+    python3 benchmarks/bench_startup.py [-n RUNS] [--json] [modules...]
+"""
+
+import argparse
+import importlib.util
+import json
+import sys
+import tempfile
+import time
+from os import environ, path
+from subprocess import Popen
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from forkserver import ForkServer  # noqa: E402 # pylint: disable=wrong-import-position
+from stats import report, summarize  # noqa: E402 # pylint: disable=wrong-import-position
+
+DEFAULT_MODULES = ["fastapi", "httpx", "xmltodict"]
+
+
+def run(runs: int, modules: list) -> dict:
+    modules = [i for i in modules if importlib.util.find_spec(i) is not None]
+    results: dict = {"modules": modules}
+    with tempfile.TemporaryDirectory() as app_dir:
+        script = path.join(app_dir, "app.py")
+        with open(script, "w", encoding="utf8") as f:
+            f.write("".join(f"import {i}\n" for i in modules))
+        env = dict(environ, nextcloud_url="http://localhost", nc_auth_user="admin", nc_auth_pass="secret")
+
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            with Popen([sys.executable, script], env=env, cwd=app_dir) as process:
+                process.wait()
+            timings.append(time.perf_counter() - started)
+        results["popen"] = summarize(timings)
+
+        server = ForkServer(sys.executable, app_dir, dict(environ), modules)
+        server.spawn([script], env, app_dir).wait()  # starts the server and imports the modules
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            server.spawn([script], env, app_dir).wait()
+            timings.append(time.perf_counter() - started)
+        server.stop()
+        results["fork_server"] = summarize(timings)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--runs", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    options = parser.parse_args()
+    results = run(options.runs, options.modules)
+    if options.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"app imports: {', '.join(results['modules']) or '-'}, {options.runs} runs")
+    report("popen", results["popen"])
+    report("fork server", results["fork_server"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Local stand-in for a Nextcloud server, serving synthetic data of configurable size for benchmarks.
+
+* ``GET /ocs/v1.php/cloud/users`` and ``/ocs/v1.php/cloud/groups``: OCS lists, ``limit`` and ``offset`` select the
+  slice of ``--users`` users (``--groups`` groups).
+* ``PROPFIND /remote.php/dav/files/<user>/entries-<n>``: multistatus listing of ``n`` entries, any other folder
+  lists ``--entries`` entries.
+* ``GET /packages/<app>.tar.gz``: app package for the daemon's ``/app-install`` with ``--package-files`` files of
+  ``--file-size`` bytes. The ETag depends on the query string, so ``?v=<n>`` makes a package the cache has not seen.
+
+Response bodies are built once per size and kept, so the server spends its time on sending them.
+
+    python3 benchmarks/mock_nextcloud.py [--port 8090] [--users 100000] [--entries 1000]
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import re
+import tarfile
+import threading
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+USERS_PATH = "/ocs/v1.php/cloud/users"
+GROUPS_PATH = "/ocs/v1.php/cloud/groups"
+DAV_PREFIX = "/remote.php/dav/files/"
+PACKAGE_PATH = re.compile(r"/packages/([\w.-]+)\.tar\.gz")
+ENTRIES_FOLDER = re.compile(r"/entries-(\d+)/?$")
+
+
+class Settings:
+    def __init__(
+        self,
+        users: int = 100000,
+        groups: int = 100,
+        entries: int = 1000,
+        package_files: int = 20,
+        file_size: int = 16384,
+    ):
+        self.users = users
+        self.groups = groups
+        self.entries = entries
+        self.package_files = package_files
+        self.file_size = file_size
+
+
+def _ocs(data) -> bytes:
+    return json.dumps({"ocs": {"meta": {"status": "ok", "statuscode": 100, "message": "OK"}, "data": data}}).encode()
+
+
+@lru_cache(maxsize=32)
+def ocs_list(key: str, prefix: str, total: int, offset: int, limit: int) -> bytes:
+    return _ocs({key: [f"{prefix}{i}" for i in range(offset, min(total, offset + limit))]})
+
+
+@lru_cache(maxsize=32)
+def multistatus(href: str, entries: int) -> bytes:
+    def response(name: str, is_dir: bool, index: int) -> str:
+        resource_type = "<d:collection/>" if is_dir else ""
+        length = "" if is_dir else f"<d:getcontentlength>{index * 100}</d:getcontentlength>"
+        return (
+            f"<d:response><d:href>{href}{name}</d:href><d:propstat><d:prop>"
+            f"<d:getlastmodified>Mon, 02 Jan 2023 10:00:00 GMT</d:getlastmodified>"
+            f'<d:getetag>"{index:08x}"</d:getetag><d:resourcetype>{resource_type}</d:resourcetype>'
+            f"<oc:fileid>{index + 1}</oc:fileid>{length}"
+            f"</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>"
+        )
+
+    parts = [
+        '<?xml version="1.0"?>'
+        '<d:multistatus xmlns:d="DAV:" xmlns:s="http://sabredav.org/ns" xmlns:oc="http://owncloud.org/ns">',
+        response("", True, 0),
+    ]
+    parts.extend(response(f"dir{i}/" if i % 10 == 0 else f"file{i}.txt", i % 10 == 0, i + 1) for i in range(entries))
+    parts.append("</d:multistatus>")
+    return "".join(parts).encode()
+
+
+@lru_cache(maxsize=8)
+def package(app_name: str, files: int, file_size: int) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+
+        def add(name: str, data: bytes) -> None:
+            info = tarfile.TarInfo(f"{app_name}/{name}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+        add("appinfo.json", json.dumps({"entry_point": "sleep", "args": ["60"]}).encode())
+        for i in range(files):
+            add(f"lib/module{i}.py", (f"# {app_name} module {i}\n".encode() * file_size)[:file_size])
+    return buffer.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body are sent separately, do not wait for the ACK of the headers
+    settings = Settings()
+
+    def log_message(self, *args) -> None:  # pylint: disable=arguments-differ
+        pass
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers=None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _read_body(self) -> None:
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        if length:
+            self.rfile.read(length)
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        offset = int(query.get("offset", ["0"])[0])
+        if url.path == USERS_PATH:
+            limit = int(query.get("limit", [str(self.settings.users)])[0])
+            self._send(200, ocs_list("users", "user", self.settings.users, offset, limit))
+        elif url.path == GROUPS_PATH:
+            limit = int(query.get("limit", [str(self.settings.groups)])[0])
+            self._send(200, ocs_list("groups", "group", self.settings.groups, offset, limit))
+        elif PACKAGE_PATH.fullmatch(url.path):
+            etag = f'"{hashlib.sha256(self.path.encode()).hexdigest()[:16]}"'
+            if self.headers.get("If-None-Match", None) == etag:
+                self._send(304, headers={"ETag": etag})
+                return
+            app_name = PACKAGE_PATH.fullmatch(url.path).group(1)  # type: ignore[union-attr]
+            body = package(app_name, self.settings.package_files, self.settings.file_size)
+            self._send(200, body, "application/gzip", {"ETag": etag})
+        else:
+            self._send(404)
+
+    do_HEAD = do_GET
+
+    def do_PROPFIND(self) -> None:  # pylint: disable=invalid-name
+        self._read_body()
+        path = urlparse(self.path).path
+        if not path.startswith(DAV_PREFIX):
+            self._send(404)
+            return
+        match = ENTRIES_FOLDER.search(path)
+        entries = int(match.group(1)) if match else self.settings.entries
+        href = path if path.endswith("/") else path + "/"
+        self._send(207, multistatus(href, entries), "application/xml; charset=utf-8")
+
+
+class MockNextcloud:
+    """The server on a background thread: ``with MockNextcloud(port=0) as nc: ... nc.url``."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, settings: Optional[Settings] = None):
+        handler = type("MockHandler", (Handler,), {"settings": settings or Settings()})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-nextcloud", daemon=True)
+
+    def __enter__(self) -> "MockNextcloud":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--entries", type=int, default=1000, help="entries of a folder listing")
+    parser.add_argument("--package-files", type=int, default=20)
+    parser.add_argument("--file-size", type=int, default=16384, help="bytes per package file")
+    options = parser.parse_args()
+    settings = Settings(options.users, options.groups, options.entries, options.package_files, options.file_size)
+    with MockNextcloud(options.host, options.port, settings) as server:
+        print(f"{server.url} ready", flush=True)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Runs all benchmarks and writes their results, with details of the machine, to a JSON file.
+
+With ``--compare`` the results are compared with the ones of an earlier run, metric by metric.
+
+    python3 benchmarks/run_all.py [--output results.json] [--compare baseline.json] [--quick]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict
+
+import bench_daemon_load
+import bench_sdk
+import bench_startup
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _flatten(results, prefix: str = "") -> Dict[str, float]:
+    """Numeric values by their dotted path, lists of per-configuration results are keyed by `workers`."""
+    values: Dict[str, float] = {}
+    if isinstance(results, dict):
+        items = iter(results.items())
+    elif isinstance(results, list):
+        items = ((f"workers={i.get('workers', n)}", i) for n, i in enumerate(results) if isinstance(i, dict))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        return {prefix: results}
+    else:
+        return values
+    for key, value in items:
+        values.update(_flatten(value, f"{prefix}.{key}" if prefix else key))
+    return values
+
+
+def compare(baseline: dict, current: dict) -> None:
+    old, new = _flatten(baseline["results"]), _flatten(current["results"])
+    print(f"compared with {baseline['commit'] or '?'} of {time.ctime(baseline['started'])}")
+    for key in sorted(old.keys() & new.keys()):
+        if key.endswith(".runs") or key.endswith(".failed") or key.endswith("workers"):
+            continue
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        print(f"{key:<64} {old[key]:12.2f} {new[key]:12.2f} {change:+8.1f}%")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="results of an earlier run")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and shorter runs")
+    options = parser.parse_args()
+    runs = 3 if options.quick else 10
+    report = {
+        "commit": _git_commit(),
+        "started": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "quick": options.quick,
+        "results": {},
+    }
+    print("startup...", file=sys.stderr)
+    report["results"]["startup"] = bench_startup.run(runs, bench_startup.DEFAULT_MODULES)
+    print("sdk...", file=sys.stderr)
+    report["results"]["sdk"] = bench_sdk.run(
+        runs, [1000, 10000] if options.quick else [1000, 100000], 1000 if options.quick else 10000, 8090
+    )
+    print("daemon load...", file=sys.stderr)
+    report["results"]["daemon_load"] = [
+        bench_daemon_load.run(workers, 8 if options.quick else 32, 2, 2.0 if options.quick else 5.0, 8070)
+        for workers in ([1, 2] if options.quick else [1, 2, 4])
+    ]
+    with open(options.output, "w", encoding="utf8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {options.output}", file=sys.stderr)
+    if options.compare:
+        with open(options.compare, "r", encoding="utf8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
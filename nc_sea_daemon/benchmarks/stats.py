@@ -0,0 +1,24 @@
+"""
+Summaries of benchmark timings, shared by the benchmark scripts.
+"""
+
+import statistics
+from typing import List
+
+
+def summarize(timings: List[float]) -> dict:
+    """Milliseconds statistics of timings given in seconds."""
+    timings = sorted(i * 1000 for i in timings)
+    return {
+        "runs": len(timings),
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "min_ms": timings[0],
+    }
+
+
+def report(name: str, summary: dict) -> None:
+    print(
+        f"{name:<32} median {summary['median_ms']:9.2f} ms   p95 {summary['p95_ms']:9.2f} ms"
+        f"   min {summary['min_ms']:9.2f} ms"
+    )
@@ -0,0 +1,43 @@
+"""
+JSON serialization of daemon replies: orjson or msgspec when installed, the standard library otherwise.
+
+Values the serializer does not know natively go through FastAPI's ``jsonable_encoder``, only those and not the whole
+reply.
+"""
+
+import json
+from typing import Any, Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None  # type: ignore
+
+
+def _dumps() -> Callable[[Any], bytes]:
+    if orjson is not None:
+        options = orjson.OPT_NON_STR_KEYS  # pylint: disable=no-member
+        return lambda obj: orjson.dumps(obj, default=jsonable_encoder, option=options)  # pylint: disable=no-member
+    if msgspec is not None:
+        return msgspec.json.Encoder(enc_hook=jsonable_encoder).encode
+    return lambda obj: json.dumps(
+        obj, default=jsonable_encoder, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+dumps = _dumps()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse serialized in one pass by :py:func:`dumps`, without ``jsonable_encoder`` over the content."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
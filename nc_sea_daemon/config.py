@@ -2,17 +2,33 @@
 Configuration related stuff lives here
 """
 
-from json import dump, load
-from os import mkdir, path, scandir
+import fcntl
+import threading
+import time
+from json import dumps, load
+from os import fsync, getpid, mkdir, path, replace, scandir, stat
+from typing import List, Optional, Tuple
 
 
 class Config:
     config_name = "daemon_cfg.json"
     apps_folder = "apps"
+    cache_folder = "package_cache"
+    logs_folder = "app_logs"
+    layers_folder = "layers"
+    state_name = "daemon_state.db"
+    save_delay = 0.2
+    refresh_interval = 1.0
 
     def __init__(self):
         self.apps = {}
         self.options = {}
+        self.lock = threading.RLock()
+        # changes not written yet: (app_name, key, value), key None adds (value {}) or removes (value None) the app
+        self._changes: List[Tuple[str, Optional[str], object]] = []
+        self._save_timer: Optional[threading.Timer] = None
+        self._mtime = 0
+        self._checked = time.monotonic()
         # if there is no `apps` folder, create it
         if not path.isdir(self.apps_folder):
             mkdir(self.apps_folder)
@@ -20,36 +36,119 @@ class Config:
         if not path.isfile(self.config_name):
             self.load_default_values()
         # load config
-        with open(self.config_name, "r", encoding="utf8") as fp:
-            cfg = load(fp)
-            self.apps = cfg["apps"]
-            self.options = cfg["options"]
+        self._mtime = stat(self.config_name).st_mtime_ns
+        cfg = self._read()
+        self.apps = cfg["apps"]
+        self.options = cfg["options"]
         self.check_config()
         # rescan apps folder, some of them can be installed manually by admin
         for obj in scandir(self.apps_folder):
-            if obj.is_dir():
+            if obj.is_dir() and obj.name not in self.apps:
                 self.app_to_config(obj.name)
 
     def app_to_config(self, app_name) -> bool:
         appinfo_path = path.join(self.apps_folder, app_name, "appinfo.json")
         if path.isfile(appinfo_path):
-            self.apps[app_name] = {}
+            self._change(app_name, None, {})
             return True
         return False
 
+    def remove_app(self, app_name: str) -> None:
+        self._change(app_name, None, None)
+
+    def set_option(self, key: str, value, app_name: str = "") -> None:
+        self._change(app_name, key, value)
+
     def load_default_values(self):
         self.options["log_level"] = "WARN"
         self.options["host"] = "127.0.0.1"
         self.options["port"] = 8063
         self.options["xauth"] = "nextcloud:"
-        self.save()
+        for k, v in self.options.items():
+            self._changes.append(("", k, v))
+        self.flush()
 
     def check_config(self):
         for k in ("log_level", "host", "port", "xauth"):
             if k not in self.options:
                 raise ValueError(f"Can not find `{k}` key in {self.config_name}")
 
+    def refresh(self):
+        """Picks up changes written by other daemon processes. The file is checked at most every
+        ``refresh_interval`` seconds."""
+        now = time.monotonic()
+        if now - self._checked < self.refresh_interval:
+            return
+        self._checked = now
+        try:
+            mtime = stat(self.config_name).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        with self.lock:
+            self._mtime = mtime
+            self._reload(self._read())
+
     def save(self):
-        with open(self.config_name, "w", encoding="utf8") as fp:
-            cfg = {"apps": self.apps, "options": self.options}
-            dump(cfg, fp, indent=4)
+        """Schedules writing of the changes, saves within ``save_delay`` seconds are written once."""
+        with self.lock:
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_delay, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush(self):
+        """Writes pending changes now. Under a lock shared with other daemon processes, the file is re-read, the
+        changes are applied to it and it is replaced through a temporary file, so concurrent changes are merged."""
+        with self.lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._changes:
+                return
+            with open(f"{self.config_name}.lock", "a", encoding="utf8") as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                cfg = self._read() if path.isfile(self.config_name) else {"apps": {}, "options": {}}
+                for change in self._changes:
+                    self._apply(cfg, change)
+                tmp_name = f"{self.config_name}.{getpid()}.tmp"
+                with open(tmp_name, "w", encoding="utf8") as fp:
+                    fp.write(dumps(cfg, indent=4))
+                    fp.flush()
+                    fsync(fp.fileno())
+                replace(tmp_name, self.config_name)
+                self._mtime = stat(self.config_name).st_mtime_ns
+            self._changes.clear()
+            self._reload(cfg)
+
+    def _change(self, app_name: str, key: Optional[str], value) -> None:
+        with self.lock:
+            change = (app_name, key, value)
+            self._apply({"apps": self.apps, "options": self.options}, change)
+            self._changes.append(change)
+            self.save()
+
+    @staticmethod
+    def _apply(cfg: dict, change: Tuple[str, Optional[str], object]) -> None:
+        app_name, key, value = change
+        if key is None:
+            if value is None:
+                cfg["apps"].pop(app_name, None)
+            else:
+                cfg["apps"][app_name] = dict(value)  # type: ignore[call-overload]
+        elif app_name:
+            if app_name in cfg["apps"]:
+                cfg["apps"][app_name][key] = value
+        else:
+            cfg["options"][key] = value
+
+    def _read(self) -> dict:
+        with open(self.config_name, "r", encoding="utf8") as fp:
+            return load(fp)
+
+    def _reload(self, cfg: dict) -> None:
+        for change in self._changes:
+            self._apply(cfg, change)
+        self.apps = cfg["apps"]
+        self.options = cfg["options"]
@@ -2,23 +2,33 @@
 EntryPoint of the daemon.
 """
 
+import asyncio
 import logging as log
-import tarfile
-from json import load, loads
-from os import environ, makedirs, path, remove
-from pathlib import Path
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from json import dumps, loads
+from os import environ, path
 from secrets import compare_digest
 from shutil import rmtree
-from subprocess import Popen, run
-from typing import Dict, List, Optional, Union
-
-import requests
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
 
+from applogs import AppLogs, OutputCapture
+from codec import FastJSONResponse
 from config import Config
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from installer import Installer
+from jobqueue import Cron, JobQueue
+from layers import LayerCache, activate
+from manifests import ManifestError, ManifestIndex
+from metrics import CONTENT_TYPE, REGISTRY, RequestMetrics, otel_hook
+from package_cache import PackageCache
+from proxy import AppProxy
+from state import SharedState
+from supervisor import Supervisor
 from typing_extensions import Annotated
 from pydantic import BaseModel
 
@@ -27,7 +37,71 @@ SECURITY = HTTPBasic()
 
 CFG = Config()
 LOG = log.getLogger()
-APPS_STATUS: Dict[str, List[Popen]] = {}
+PACKAGE_CACHE = PackageCache(CFG.cache_folder, max_size=int(CFG.options.get("package_cache_size", 1024)) * 1024 * 1024)
+STATE = SharedState(CFG.state_name, history_size=int(CFG.options.get("runs_history_size", 1000)))
+LAYERS = LayerCache(CFG.layers_folder, CFG.apps_folder, PACKAGE_CACHE)
+JOB_UPDATES = ThreadPoolExecutor(max_workers=1, thread_name_prefix="install-jobs")
+
+
+def _job_saved(future: Future) -> None:
+    if future.exception() is not None:
+        LOG.warning("can not save install job: %s", future.exception())
+
+
+def _save_job(job: dict) -> None:
+    """Publishes the install job to the other daemon processes from one thread: updates keep their order and the
+    event loop does not wait for the database."""
+    JOB_UPDATES.submit(STATE.save_job, job).add_done_callback(_job_saved)
+
+
+INSTALLER = Installer(
+    CFG.apps_folder,
+    PACKAGE_CACHE,
+    max_concurrency=int(CFG.options.get("install_concurrency", 2)),
+    layers=LAYERS,
+    timeout=float(CFG.options.get("install_timeout", 1800)) or None,
+    download_timeout=float(CFG.options.get("install_download_timeout", 30)),
+    on_update=_save_job,
+)
+APP_LOGS = AppLogs(CFG.logs_folder, max_bytes=int(CFG.options.get("app_logs_size", 8)) * 1024 * 1024)
+SUPERVISOR = Supervisor(
+    tuple(int(i) for i in str(CFG.options.get("workers_ports", "9000-9999")).split("-", 1)),
+    STATE,
+    capture=OutputCapture(APP_LOGS) if int(CFG.options.get("app_logs", 1)) else None,
+)
+PROXY = AppProxy(SUPERVISOR)
+MANIFESTS = ManifestIndex(CFG.apps_folder)
+MANIFESTS.reload()
+
+APP.add_middleware(
+    RequestMetrics,
+    histogram=REGISTRY.histogram(
+        "nc_sea_daemon_request_duration_seconds", "Duration of daemon requests.", ["method", "route", "status"]
+    ),
+)
+
+
+def _worker_counts() -> dict:
+    return {(app_name, state): count for app_name, state, count, _ in STATE.worker_stats()}
+
+
+def _app_restarts() -> dict:
+    restarts: dict = {}
+    for app_name, _, _, count in STATE.worker_stats():
+        restarts[(app_name,)] = restarts.get((app_name,), 0) + count
+    return restarts
+
+
+REGISTRY.gauge("nc_sea_daemon_app_workers", "App workers by state.", ["app", "state"], _worker_counts)
+REGISTRY.gauge("nc_sea_daemon_app_restarts", "Restarts of the current app workers.", ["app"], _app_restarts)
+REGISTRY.gauge(
+    "nc_sea_daemon_queue_jobs", "Queued and running jobs by app and state.", ["app", "state"], STATE.queue_counts
+)
+if int(CFG.options.get("otel_metrics", 0)):
+    try:
+        REGISTRY.hooks.append(otel_hook())
+    except ImportError:
+        LOG.warning("`otel_metrics` is set, but opentelemetry-api is not installed")
 
 
 class AppRun(BaseModel):
@@ -37,6 +111,17 @@ class AppRun(BaseModel):
     args: str = "[]"
 
 
+class JobSubmit(BaseModel):
+    nc_url: str
+    user_token: str
+    app_name: str
+    args: str = "[]"
+    priority: int = 0
+    delay: float = 0.0
+    timeout: Optional[float] = None
+    cron: Optional[str] = None
+
+
 class Option(BaseModel):
     key: str
     value: Union[int, float, str]
@@ -46,7 +131,7 @@ class Option(BaseModel):
         smart_union = True
 
 
-def current_username(credentials: Annotated[HTTPBasicCredentials, Depends(SECURITY)]):
+async def current_username(credentials: Annotated[HTTPBasicCredentials, Depends(SECURITY)]):
     xauth = CFG.options["xauth"].split(":", 1)
     username_ok = compare_digest(credentials.username.encode("utf8"), xauth[0].encode("utf8"))
     if len(xauth) == 2:
@@ -62,34 +147,39 @@ def current_username(credentials: Annotated[HTTPBasicCredentials, Depends(SECURI
     return credentials.username
 
 
-def _load_app_config(app_name: str) -> Optional[dict]:
-    app_root_path = path.join("apps", app_name)
-    try:
-        with open(path.join(app_root_path, "appinfo.json"), "r", encoding="utf8") as fp:
-            app_config = load(fp)
-    except OSError:
-        return None
-    return app_config
-
-
 @APP.get("/status")
-def daemon_status(_username: Annotated[str, Depends(current_username)]):
-    app_status: Dict[str, list] = {}
-    for app_name, app_stats in APPS_STATUS.items():
-        app_status[app_name] = []
-        for popen in app_stats:
-            app_run_info = {
-                "pid": popen.pid,
-                "alive": bool(popen.poll() is None),
-                "args": popen.args,
-            }
-            app_status[app_name].append(app_run_info)
-    json_data = jsonable_encoder({"apps": CFG.apps, "apps_status": app_status, "options": CFG.options})
-    return JSONResponse(json_data)
+async def daemon_status(
+    _username: Annotated[str, Depends(current_username)],
+    app_name: str = "",
+    state: str = "",
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=0, le=1000)] = 100,
+):
+    apps = {k: v for k, v in CFG.apps.items() if not app_name or k == app_name}
+    apps_status = await run_in_threadpool(SUPERVISOR.status, app_name, state)
+    total, runs = await run_in_threadpool(SUPERVISOR.runs, app_name, offset, limit)
+    return FastJSONResponse(
+        {
+            "apps": apps,
+            "apps_status": apps_status,
+            "runs": {"total": total, "offset": offset, "limit": limit, "items": runs},
+            "options": CFG.options,
+        }
+    )
+
+
+def _render_metrics() -> str:
+    return REGISTRY.render(STATE.other_metrics())
+
+
+@APP.get("/metrics")
+async def daemon_metrics(_username: Annotated[str, Depends(current_username)]):
+    """Prometheus metrics of all daemon processes."""
+    return Response(await run_in_threadpool(_render_metrics), media_type=CONTENT_TYPE)
 
 
 @APP.post("/update")
-def daemon_update(_username: Annotated[str, Depends(current_username)], version_tag: str):
+async def daemon_update(_username: Annotated[str, Depends(current_username)], version_tag: str):
     _ = version_tag
     # download
     # run updater
@@ -97,109 +187,284 @@ def daemon_update(_username: Annotated[str, Depends(current_username)], version_
     return JSONResponse({"status": "ok", "error": ""})
 
 
+def _on_app_installed(app_name: str) -> dict:
+    try:
+        app_config = MANIFESTS.load(app_name)
+    except (OSError, ManifestError) as e:
+        raise RuntimeError(f"Can not load app config file: {e}") from None
+    if not CFG.app_to_config(app_name):
+        raise RuntimeError("Error during installing app.")
+    return app_config
+
+
 @APP.post("/app-install")
-def app_install(_username: Annotated[str, Depends(current_username)], nc_url: str, user_token: str, app_name: str, package_url: str):
-    # REWORK: this should be in a separate thread with notification to NC part when app install finished
+async def app_install(
+    _username: Annotated[str, Depends(current_username)], nc_url: str, user_token: str, app_name: str, package_url: str
+):
+    # REWORK: notification to NC part when app install finished
     # Status: waiting: endpoint to send notify to, to be implemented by Andrey.
     _ = user_token
     _ = nc_url
-    destination_path = path.join("apps", app_name)
-    try:
-        file_request = requests.get(package_url, allow_redirects=True)
-        data = file_request.content
-        with open(app_name + "_install_tmp.tar.gz", "wb") as fp:
-            fp.write(data)
-        archive_name = app_name + "_install_tmp.tar.gz"
-        makedirs(destination_path, exist_ok=True)
-
-        def members(tf):
-            for member in tf.getmembers():
-                stripped_path = Path(*Path(member.path).parts[1:])
-                if stripped_path.name:
-                    member.path = stripped_path
-                    yield member
-
-        with tarfile.open(archive_name, "r") as tar:
-            tar.extractall(members=members(tar), path=destination_path)
-
-        remove(archive_name)
-        result = CFG.app_to_config(app_name)
-        if not result:
-            raise RuntimeError("Error during installing app.")
-        app_config = _load_app_config(app_name)
-        if app_config is None:
-            return JSONResponse({"status": "fail", "error": "Can not load app config file."})
-        setup_script = app_config.get("after_install", None)
-        if setup_script:
-            run(setup_script, cwd=path.abspath(f"apps/{app_name}"))
-    except Exception as e:  # noqa
-        rmtree(destination_path, ignore_errors=True)
-        return JSONResponse({"status": "fail", "error": str(e)})
-    return JSONResponse({"status": "ok", "error": ""})
+    job = INSTALLER.submit(app_name, package_url, _on_app_installed)
+    return JSONResponse({"status": "ok", "error": "", "job_id": job.job_id})
+
+
+@APP.get("/app-install")
+async def app_install_status(_username: Annotated[str, Depends(current_username)], job_id: str):
+    local_job = INSTALLER.get(job_id)  # jobs of this process may not be saved yet
+    job = local_job.to_dict() if local_job is not None else await run_in_threadpool(STATE.get_job, job_id)
+    if job is None:
+        return JSONResponse({"status": "fail", "error": "install job with provided id was not found"})
+    return JSONResponse({"status": "ok", "error": "", "job": job})
+
+
+def _remove_app(app_name: str) -> None:
+    SUPERVISOR.remove(app_name)
+    MANIFESTS.remove(app_name)
+    CFG.remove_app(app_name)
+    APP_LOGS.remove(app_name)
+    STATE.queue_remove_app(app_name)
+    JOBS.wakeup()
+    rmtree(f"apps/{app_name}")
+    LAYERS.prune()
 
 
 @APP.post("/app-remove")
-def app_remove(_username: Annotated[str, Depends(current_username)], app_name: str):
-    app_runs_info = APPS_STATUS.pop(app_name, [])
-    for app_run_info in app_runs_info:
-        if app_run_info.poll() is None:
-            app_run_info.kill()
-    CFG.apps.pop("app_name", None)
-    rmtree(f"apps/{app_name}")
+async def app_remove(_username: Annotated[str, Depends(current_username)], app_name: str):
+    await run_in_threadpool(_remove_app, app_name)
     return JSONResponse({"status": "ok", "error": ""})
 
 
-@APP.post("/app-run")
-def app_run(_username: Annotated[str, Depends(current_username)], params: AppRun):
-    app_cfg_daemon = CFG.apps.get(params.app_name, None)
+def _app_process(app_name: str, nc_url: str, user_token: str) -> Tuple[List[str], Dict[str, str], str, dict]:
+    """Command without the run's arguments, environment, folder and manifest of an app process.
+
+    Raises ValueError with the error to reply.
+    """
+    app_cfg_daemon = CFG.apps.get(app_name, None)
     if app_cfg_daemon is None:
-        return JSONResponse({"status": "fail", "error": "App with specified name does not found."})
-    app_config = _load_app_config(params.app_name)
+        raise ValueError("App with specified name does not found.")
+    app_config = MANIFESTS.get(app_name)
     if app_config is None:
-        return JSONResponse({"status": "fail", "error": "Can not load app config file."})
-    entry_point = app_config.get("entry_point", None)
-    if entry_point is None:
-        return JSONResponse({"status": "fail", "error": "`entrypoint` value missing from app config."})
-    nc_auth = params.user_token.split(":", 1)
+        raise ValueError(f"Can not load app config file: {MANIFESTS.errors.get(app_name, '')}")
+    nc_auth = user_token.split(":", 1)
     if len(nc_auth) != 2:
-        return JSONResponse({"status": "fail", "error": "`user_token` does not contain all required information."})
-    app_config_args: List = app_config.get("args", [])
-    modified_env = environ.copy()
-    modified_env["nextcloud_url"] = params.nc_url
+        raise ValueError("`user_token` does not contain all required information.")
+    app_path = path.abspath(f"apps/{app_name}")
+    modified_env = activate(environ.copy(), app_path)
+    modified_env["nextcloud_url"] = nc_url
     modified_env["nc_auth_user"] = nc_auth[0]
     modified_env["nc_auth_pass"] = nc_auth[1]
     modified_env.update(**app_cfg_daemon)
+    return [app_config["entry_point"], *app_config.get("args", [])], modified_env, app_path, app_config
+
+
+@APP.post("/app-run")
+async def app_run(_username: Annotated[str, Depends(current_username)], params: AppRun):
+    try:
+        app_cmd, modified_env, app_path, app_config = _app_process(params.app_name, params.nc_url, params.user_token)
+    except ValueError as e:
+        return JSONResponse({"status": "fail", "error": str(e)})
     try:
         app_args = loads(params.args)
     except Exception as e:  # noqa # pylint: disable=broad-except
         json_data = jsonable_encoder({"status": "fail", "error": "Arg parse error: " + str(e)})
         return JSONResponse(json_data)
     try:
-        cmd = [str(i) for i in [entry_point, *app_config_args, *app_args]]
-        # pylint: disable=consider-using-with
-        process = Popen(cmd, env=modified_env, cwd=path.abspath(f"apps/{params.app_name}"))
-        # pylint: enable=consider-using-with
+        cmd = [str(i) for i in [*app_cmd, *app_args]]
+        workers = await run_in_threadpool(
+            SUPERVISOR.start,
+            params.app_name,
+            cmd,
+            modified_env,
+            app_path,
+            size=int(app_config.get("workers", 1)),
+            restart=app_config.get("restart", "never"),
+            limits=app_config.get("limits", {}),
+            health_path=app_config.get("health_check", None),
+            preload=app_config.get("preload", []) if app_config.get("fork_server", False) else None,
+            server_env=activate(environ.copy(), app_path),  # without the credentials and options of the run
+        )
+    except ValueError as e:
+        return JSONResponse({"status": "fail", "error": str(e)})
     except (OSError, TypeError) as e:
         json_data = jsonable_encoder({"status": "fail", "error": "Popen error: " + str(e)})
         return JSONResponse(json_data)
-    if params.app_name not in APPS_STATUS:
-        APPS_STATUS[params.app_name] = []
-    APPS_STATUS[params.app_name].append(process)
-    return JSONResponse({"status": "ok", "error": "", "pid": str(process.pid)})
+    pids = [str(i.pid) for i in workers]
+    return JSONResponse({"status": "ok", "error": "", "pid": pids[0], "pids": pids})
+
+
+def _prepare_job(job: dict) -> Tuple[List[str], Dict[str, str], str, dict]:
+    app_cmd, modified_env, app_path, app_config = _app_process(job["app_name"], job["nc_url"], job["user_token"])
+    return [str(i) for i in [*app_cmd, *job["args"]]], modified_env, app_path, app_config
+
+
+def _job_workers(app_name: str) -> int:
+    app_config = MANIFESTS.get(app_name) or {}
+    return int(app_config.get("job_workers", CFG.options.get("job_workers", 4)))
+
+
+JOBS = JobQueue(
+    STATE,
+    _prepare_job,
+    _job_workers,
+    max_running=int(CFG.options.get("jobs_concurrency", 8)),
+    poll_interval=float(CFG.options.get("jobs_poll", 1.0)),
+    retention=float(CFG.options.get("jobs_retention", 7 * 24 * 3600)),
+    history_size=int(CFG.options.get("jobs_history_size", 10000)),
+)
+
+
+@APP.post("/jobs")
+async def jobs_submit(_username: Annotated[str, Depends(current_username)], params: JobSubmit):
+    """Queues a run of the app, started once a job worker of the app is free, or with ``cron`` a schedule that queues
+    one whenever it is due."""
+    try:
+        _app_process(params.app_name, params.nc_url, params.user_token)
+    except ValueError as e:
+        return JSONResponse({"status": "fail", "error": str(e)})
+    try:
+        app_args = loads(params.args)
+        if not isinstance(app_args, list):
+            raise ValueError("arguments must be a list")
+    except Exception as e:  # noqa # pylint: disable=broad-except
+        return JSONResponse({"status": "fail", "error": "Arg parse error: " + str(e)})
+    job = {
+        "app_name": params.app_name,
+        "args": [str(i) for i in app_args],
+        "nc_url": params.nc_url,
+        "user_token": params.user_token,
+        "priority": params.priority,
+        "timeout": params.timeout or None,
+    }
+    if params.cron:
+        try:
+            next_run = Cron(params.cron).next_after(time.time())
+        except ValueError as e:
+            return JSONResponse({"status": "fail", "error": str(e)})
+        schedule_id = await run_in_threadpool(STATE.schedule_add, job, params.cron, next_run)
+        return JSONResponse({"status": "ok", "error": "", "schedule_id": schedule_id, "next_run": next_run})
+    job_id = await run_in_threadpool(STATE.queue_submit, job, time.time() + max(params.delay, 0.0))
+    JOBS.wakeup()
+    return JSONResponse({"status": "ok", "error": "", "job_id": job_id})
+
+
+@APP.get("/jobs")
+async def jobs_status(
+    _username: Annotated[str, Depends(current_username)],
+    job_id: Optional[int] = None,
+    app_name: str = "",
+    state: str = "",
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=0, le=1000)] = 100,
+):
+    """One job with its exit code and output, or a page of jobs without output, latest first."""
+    if job_id is not None:
+        job = await run_in_threadpool(STATE.queue_job, job_id)
+        if job is None:
+            return JSONResponse({"status": "fail", "error": "job with provided id was not found"})
+        return FastJSONResponse({"status": "ok", "error": "", "job": job})
+    total, jobs = await run_in_threadpool(STATE.queue_jobs, app_name, state, offset, limit)
+    return FastJSONResponse(
+        {"status": "ok", "error": "", "jobs": {"total": total, "offset": offset, "limit": limit, "items": jobs}}
+    )
+
+
+@APP.post("/jobs/cancel")
+async def jobs_cancel(_username: Annotated[str, Depends(current_username)], job_id: int):
+    """Cancels a queued job, a running one is terminated by the daemon process running it."""
+    state = await run_in_threadpool(STATE.queue_cancel, job_id)
+    if state is None:
+        return JSONResponse({"status": "fail", "error": "job with provided id was not found"})
+    if state not in ("queued", "running"):
+        return JSONResponse({"status": "fail", "error": f"job is already {state}"})
+    JOBS.wakeup()
+    return JSONResponse({"status": "ok", "error": ""})
+
+
+@APP.get("/jobs/schedules")
+async def jobs_schedules(_username: Annotated[str, Depends(current_username)], app_name: str = ""):
+    schedules = await run_in_threadpool(STATE.schedules, app_name)
+    return FastJSONResponse({"status": "ok", "error": "", "schedules": schedules})
+
+
+@APP.post("/jobs/schedules/remove")
+async def jobs_schedule_remove(_username: Annotated[str, Depends(current_username)], schedule_id: int):
+    """Removes the schedule, jobs it already queued are kept."""
+    if not await run_in_threadpool(STATE.schedule_remove, schedule_id):
+        return JSONResponse({"status": "fail", "error": "schedule with provided id was not found"})
+    return JSONResponse({"status": "ok", "error": ""})
 
 
 @APP.post("/app-stop")
-def app_stop(_username: Annotated[str, Depends(current_username)], app_pid: int):
-    for app_run_infos in APPS_STATUS.values():
-        for app_run_info in app_run_infos:
-            if app_run_info.pid == app_pid:
-                app_run_info.kill()
-                return JSONResponse({"status": "ok", "error": ""})
+async def app_stop(_username: Annotated[str, Depends(current_username)], app_pid: int):
+    if await run_in_threadpool(SUPERVISOR.stop_pid, app_pid):
+        return JSONResponse({"status": "ok", "error": ""})
     return JSONResponse({"status": "fail", "error": "app with provided pid was not found"})
 
 
+async def _log_events(request: Request, app_name: str, offset: int) -> AsyncIterator[str]:
+    interval = float(CFG.options.get("app_logs_poll", 0.5))
+    while not await request.is_disconnected():
+        start, next_offset, entries = await run_in_threadpool(APP_LOGS.read, app_name, offset)
+        events = []
+        if start > offset:
+            events.append(f"event: skipped\ndata: {dumps({'from': offset, 'to': start})}\n\n")
+        # the id of an event is the offset after its line, where a client reconnecting with it continues
+        ids = [i["offset"] for i in entries[1:]] + [next_offset]
+        events.extend(f"id: {i}\nevent: log\ndata: {dumps(entry)}\n\n" for i, entry in zip(ids, entries))
+        offset = next_offset
+        if events:
+            yield "".join(events)
+        else:
+            await asyncio.sleep(interval)
+
+
+@APP.get("/app-logs")
+async def app_logs(
+    _username: Annotated[str, Depends(current_username)],
+    request: Request,
+    app_name: str,
+    offset: Annotated[Optional[int], Query(ge=0)] = None,
+    lines: Annotated[int, Query(ge=0)] = 100,
+    follow: bool = False,
+):
+    """Output of the app's workers from ``offset`` or its last ``lines`` lines, a page of at most 64 KiB.
+
+    With ``follow``, the output is streamed as server-sent events, continuing from ``Last-Event-ID`` on reconnects.
+    The stream is produced only as fast as the client reads it.
+    """
+    if app_name not in CFG.apps:
+        return JSONResponse({"status": "fail", "error": "App with specified name does not found."})
+    last_event_id = request.headers.get("last-event-id", "")
+    if follow and last_event_id.isdigit():
+        offset = int(last_event_id)
+    if offset is None:
+        offset = await run_in_threadpool(APP_LOGS.tail_offset, app_name, lines)
+    if follow:
+        return StreamingResponse(
+            _log_events(request, app_name, offset),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    start, next_offset, entries = await run_in_threadpool(APP_LOGS.read, app_name, offset)
+    return FastJSONResponse({"status": "ok", "error": "", "start": start, "offset": next_offset, "entries": entries})
+
+
+@APP.post("/apps/reload")
+async def apps_reload(_username: Annotated[str, Depends(current_username)]):
+    errors = await run_in_threadpool(MANIFESTS.reload)
+    return JSONResponse({"status": "ok" if not errors else "fail", "error": "", "errors": errors})
+
+
+@APP.api_route("/apps/{app_name}/{app_path:path}", methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+async def app_proxy(
+    _username: Annotated[str, Depends(current_username)], request: Request, app_name: str, app_path: str
+):
+    return await PROXY.forward(request, app_name, app_path)
+
+
 @APP.get("/option")
-def option_get(_username: Annotated[str, Depends(current_username)], key: str, app_name: str = ""):
+async def option_get(_username: Annotated[str, Depends(current_username)], key: str, app_name: str = ""):
     value = ""
     if app_name:
         app_config = CFG.apps.get(app_name, "")
@@ -207,22 +472,68 @@ def option_get(_username: Annotated[str, Depends(current_username)], key: str, a
             value = app_config.get(key, "")
     else:
         value = CFG.options.get(key, "")
-    return JSONResponse(jsonable_encoder(value))
+    return FastJSONResponse(value)
 
 
-@APP.post("/option")
-def option_set(_username: Annotated[str, Depends(current_username)], option: Option):
-    if option.app_name:
-        app_config = CFG.apps.get(option.app_name, None)
-        if app_config is None:
-            return JSONResponse({"status": "fail", "error": f"app with name='{option.app_name}' not found"})
-        app_config[option.key] = option.value
-    else:
-        CFG.options[option.key] = option.value
-    CFG.save()
+def _set_options(options: List[Option]) -> JSONResponse:
+    with CFG.lock:
+        for option in options:
+            if option.app_name and option.app_name not in CFG.apps:
+                return JSONResponse({"status": "fail", "error": f"app with name='{option.app_name}' not found"})
+        for option in options:
+            CFG.set_option(option.key, option.value, option.app_name or "")
     return JSONResponse({"status": "ok", "error": ""})
 
 
+@APP.post("/option")
+async def option_set(_username: Annotated[str, Depends(current_username)], option: Option):
+    return _set_options([option])
+
+
+@APP.post("/options")
+async def options_set(_username: Annotated[str, Depends(current_username)], options: List[Option]):
+    """Sets all options or none of them, if one of the apps is not found."""
+    return _set_options(options)
+
+
+async def _publish_metrics(interval: float) -> None:
+    """Saves metrics of this process for the `/metrics` of the other daemon processes."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(STATE.save_metrics, REGISTRY.snapshot())
+        except Exception as e:  # noqa # pylint: disable=broad-except
+            LOG.warning("can not save metrics: %s", e)
+
+
+async def _refresh_config() -> None:
+    """Picks up config changes of the other daemon processes, the file is not read on the event loop."""
+    while True:
+        await asyncio.sleep(CFG.refresh_interval)
+        try:
+            await run_in_threadpool(CFG.refresh)
+        except Exception as e:  # noqa # pylint: disable=broad-except
+            LOG.warning("can not read config: %s", e)
+
+
 @APP.on_event("startup")
-def startup():
+async def startup():
     print(f"http://{CFG.options['host']}:{CFG.options['port']}/status")  # For development
+    JOBS.start()
+    APP.state.refresh_config = asyncio.create_task(_refresh_config())
+    if int(CFG.options.get("workers", 1)) > 1:
+        APP.state.publish_metrics = asyncio.create_task(
+            _publish_metrics(float(CFG.options.get("metrics_interval", 5.0)))
+        )
+
+
+@APP.on_event("shutdown")
+async def shutdown():
+    APP.state.refresh_config.cancel()
+    if hasattr(APP.state, "publish_metrics"):
+        APP.state.publish_metrics.cancel()
+    await PROXY.close()
+    SUPERVISOR.shutdown()
+    await run_in_threadpool(JOBS.shutdown)
+    await run_in_threadpool(JOB_UPDATES.shutdown)
+    CFG.flush()
@@ -0,0 +1,280 @@
+"""
+Fork server: a pre-imported interpreter per app that forks a new process for each run instead of starting from scratch.
+
+The server side runs under the app's own interpreter (``python3 forkserver.py <request fd> <response fd> [modules]``)
+and must only use the standard library.
+"""
+
+import importlib
+import json
+import os
+import resource
+import runpy
+import select
+import signal
+import sys
+import threading
+import time
+import traceback
+from queue import Empty, Queue
+from subprocess import Popen, TimeoutExpired
+from typing import Callable, Dict, List, Optional, Tuple
+
+SPAWN_TIMEOUT = 10.0
+STOP_TIMEOUT = 5.0
+
+
+class ForkedProcess:
+    """``Popen``-like handle of a process forked by a :py:class:`ForkServer`. ``on_exit`` is called from the thread
+    reading the server's reports."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.args: List[str] = []
+        self.returncode: Optional[int] = None
+        self.on_exit: Optional[Callable[[], None]] = None
+        self._exited = threading.Event()
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        if not self._exited.wait(timeout):
+            raise TimeoutExpired(self.args, timeout)  # type: ignore[arg-type]
+        return self.returncode
+
+    def send_signal(self, sig: int) -> None:
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def set_exited(self, returncode: int) -> None:
+        self.returncode = returncode
+        self._exited.set()
+        if self.on_exit is not None:
+            self.on_exit()
+
+
+class ForkServer:
+    """Starts the app's interpreter once with ``preload`` modules imported, then forks it for every run.
+
+    :param executable: interpreter of the app, the ``entry_point`` from appinfo.json.
+    :param cwd: app folder, also the first entry of ``sys.path`` for preloaded modules.
+    :param env: environment of the server process, runs get their own environment.
+    :param preload: modules to import before forking.
+    """
+
+    def __init__(self, executable: str, cwd: str, env: Dict[str, str], preload: List[str]):
+        self.executable = executable
+        self.cwd = cwd
+        self.env = env
+        self.preload = preload
+        self.process: Optional[Popen] = None
+        self._request_fd = -1
+        self._replies: Queue = Queue()
+        self._children: Dict[int, ForkedProcess] = {}
+        self._lock = threading.Lock()
+        self._request_id = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self) -> None:
+        request_r, request_w = os.pipe()
+        response_r, response_w = os.pipe()
+        try:
+            self.process = Popen(  # pylint: disable=consider-using-with
+                [self.executable, os.path.abspath(__file__), str(request_r), str(response_w), *self.preload],
+                env=self.env,
+                cwd=self.cwd,
+                pass_fds=(request_r, response_w),
+            )
+        except BaseException:
+            os.close(request_w)
+            os.close(response_r)
+            raise
+        finally:
+            os.close(request_r)
+            os.close(response_w)
+        self._request_fd = request_w
+        self._replies = Queue()
+        threading.Thread(
+            target=self._read_loop, args=(response_r, self._replies), name="forkserver", daemon=True
+        ).start()
+
+    def spawn(
+        self,
+        args: List[str],
+        env: Dict[str, str],
+        cwd: str,
+        output: Optional[List[str]] = None,
+        limits: Optional[List[Tuple[int, int]]] = None,
+    ) -> ForkedProcess:
+        """Forks a run of ``args`` (a script path or ``-m module`` followed by its arguments).
+
+        ``output`` are paths of named pipes for stdout and stderr of the run, opened for writing before the reply.
+        ``limits`` are resource limits and values the run sets before it starts.
+
+        Raises OSError if the server can not start or fork.
+        """
+        with self._lock:
+            if not self.alive:
+                self.start()
+            self._request_id += 1
+            request = {
+                "id": self._request_id,
+                "args": args,
+                "env": env,
+                "cwd": cwd,
+                "output": output or [],
+                "limits": limits or [],
+            }
+            deadline = time.monotonic() + SPAWN_TIMEOUT
+            try:
+                os.write(self._request_fd, json.dumps(request).encode("utf8") + b"\n")
+                while True:
+                    request_id, reply = self._replies.get(timeout=max(deadline - time.monotonic(), 0.0))
+                    if request_id == self._request_id:
+                        break
+                    if isinstance(reply, ForkedProcess):  # late reply to a request that timed out
+                        reply.kill()
+            except (BrokenPipeError, Empty) as e:
+                raise OSError(f"fork server of {self.cwd} is not responding") from e
+            if isinstance(reply, str):
+                raise OSError(reply)
+            reply.args = args
+            return reply
+
+    def stop(self) -> None:
+        with self._lock:
+            if self.process is None:
+                return
+            os.close(self._request_fd)
+            try:
+                self.process.wait(STOP_TIMEOUT)
+            except TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def _read_loop(self, response_fd: int, replies: Queue) -> None:
+        with os.fdopen(response_fd, "rb") as responses:
+            for line in responses:
+                message = json.loads(line)
+                if "exit" in message:
+                    child = self._children.pop(message["exit"], None)
+                    if child is not None:
+                        child.set_exited(message["code"])
+                elif "pid" in message:
+                    child = self._children[message["pid"]] = ForkedProcess(message["pid"])
+                    replies.put((message.get("id", None), child))
+                else:
+                    replies.put((message.get("id", None), message.get("error", "unknown fork server error")))
+        # Exit codes of runs left without their server can not be collected anymore.
+        for pid in [k for k, v in self._children.items() if v.returncode is None]:
+            child = self._children.pop(pid)
+            child.kill()
+            child.set_exited(-signal.SIGKILL)
+
+
+def _run_child(request: dict) -> None:
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    args = request["args"]
+    code = 0
+    try:
+        for rlimit, value in request.get("limits", []):
+            resource.setrlimit(rlimit, (value, value))
+        if args[0] == "-m":
+            sys.argv = args[1:]
+            runpy.run_module(args[1], run_name="__main__", alter_sys=True)
+        else:
+            sys.argv = list(args)
+            sys.path[0] = os.path.dirname(os.path.abspath(args[0]))
+            runpy.run_path(args[0], run_name="__main__")
+    except SystemExit as e:
+        if isinstance(e.code, int) or e.code is None:
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:  # pylint: disable=broad-except
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    os._exit(code)  # pylint: disable=protected-access
+
+
+def serve(request_fd: int, response_fd: int, preload: List[str]) -> None:
+    sys.path[0] = os.getcwd()
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except Exception as e:  # noqa # pylint: disable=broad-except
+            print(f"fork server: can not preload {module}: {e}", file=sys.stderr)
+
+    def reply(message: dict) -> None:
+        os.write(response_fd, json.dumps(message).encode("utf8") + b"\n")
+
+    # SIGCHLD wakes up the select below through the pipe, so exits are reported without polling.
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+    buffer = b""
+    children = set()
+    while True:
+        ready = select.select([request_fd, wakeup_r], [], [])[0]
+        if wakeup_r in ready:
+            os.read(wakeup_r, 4096)
+        if request_fd in ready:
+            data = os.read(request_fd, 65536)
+            if not data:
+                return
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                request = json.loads(line)
+                output: List[int] = []
+                try:
+                    output.extend(os.open(i, os.O_WRONLY) for i in request.get("output", []))
+                    pid = os.fork()
+                except OSError as e:
+                    for fd in output:
+                        os.close(fd)
+                    reply({"id": request.get("id", None), "error": f"fork failed: {e}"})
+                    continue
+                if pid == 0:
+                    signal.set_wakeup_fd(-1)
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    for fd in (request_fd, response_fd, wakeup_r, wakeup_w):
+                        os.close(fd)
+                    for target, fd in zip((1, 2), output):
+                        os.dup2(fd, target)
+                        os.close(fd)
+                    _run_child(request)
+                for fd in output:
+                    os.close(fd)
+                children.add(pid)
+                reply({"id": request.get("id", None), "pid": pid})
+        for pid in list(children):
+            waited_pid, status = os.waitpid(pid, os.WNOHANG)
+            if waited_pid:
+                children.discard(pid)
+                reply({"exit": pid, "code": os.waitstatus_to_exitcode(status)})
+
+
+if __name__ == "__main__":
+    serve(int(sys.argv[1]), int(sys.argv[2]), sys.argv[3:])
@@ -0,0 +1,346 @@
+"""
+Background installation of apps: streaming download, extraction, dependency layers and `after_install` scripts.
+"""
+
+import asyncio
+import hashlib
+import logging as log
+import tarfile
+import time
+from collections import OrderedDict
+from os import environ, makedirs, path, unlink
+from pathlib import Path
+from queue import Full, Queue
+from shutil import rmtree
+from typing import Callable, Dict, List, Optional
+from uuid import uuid4
+
+import httpx
+
+from layers import LayerCache, activate, run_process
+from metrics import REGISTRY
+from package_cache import PackageCache, PackageManifest, check_symlink, make_symlink, safe_destination
+
+LOG = log.getLogger()
+
+CHUNK_SIZE = 256 * 1024
+QUEUE_CHUNKS = 16
+PROGRESS_INTERVAL = 0.5
+
+INSTALL_SECONDS = REGISTRY.histogram(
+    "nc_sea_daemon_install_stage_duration_seconds",
+    "Duration of install stages: download, extract (after the download), materialize (from cache), layer,"
+    " after_install.",
+    ["stage"],
+)
+INSTALLS = REGISTRY.counter("nc_sea_daemon_installs_total", "Finished installs by result.", ["result"])
+
+
+class InstallJob:
+    def __init__(self, app_name: str, package_url: str):
+        self.job_id = uuid4().hex
+        self.app_name = app_name
+        self.package_url = package_url
+        self.state = "queued"
+        self.error = ""
+        self.downloaded = 0
+        self.total: Optional[int] = None
+        self.cached = False
+        self.layer = ""
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.published = 0.0
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("finished", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "app_name": self.app_name,
+            "package_url": self.package_url,
+            "state": self.state,
+            "error": self.error,
+            "downloaded": self.downloaded,
+            "total": self.total,
+            "cached": self.cached,
+            "layer": self.layer,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class _ChunkReader:
+    """File-like object for `tarfile` stream mode, fed with chunks from the event loop."""
+
+    def __init__(self):
+        self._queue: Queue = Queue(maxsize=QUEUE_CHUNKS)
+        self._buffer = bytearray()
+        self._eof = False
+
+    def feed(self, chunk: bytes) -> None:
+        self._queue.put(chunk)
+
+    def feed_nowait(self, chunk: bytes) -> bool:
+        try:
+            self._queue.put_nowait(chunk)
+        except Full:
+            return False
+        return True
+
+    def feed_eof(self) -> None:
+        self._queue.put(b"")
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._queue.get()
+            if not chunk:
+                self._eof = True
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def drain(self) -> None:
+        """Consumes all remaining chunks, so the producer never blocks on a dead reader."""
+        while not self._eof:
+            if not self._queue.get():
+                self._eof = True
+
+
+def _strip_path(member_path: str) -> str:
+    return str(Path(*Path(member_path).parts[1:]))
+
+
+def _stripped_members(tar: tarfile.TarFile):
+    for member in tar:
+        stripped_path = Path(_strip_path(member.path))
+        if stripped_path.name:
+            member.path = str(stripped_path)
+            yield member
+
+
+def _extract_stream(reader: _ChunkReader, destination_path: str, cache: PackageCache) -> PackageManifest:
+    """Unpacks archive into the cache, linking its files into `destination_path`."""
+    manifest = PackageManifest()
+    try:
+        with tarfile.open(fileobj=reader, mode="r|*") as tar:
+            for member in _stripped_members(tar):
+                destination = safe_destination(destination_path, member.path)
+                if member.isfile():
+                    object_hash = cache.store(tar.extractfile(member), member.mode)  # type: ignore
+                    cache.link(object_hash, member.mode, destination)
+                    manifest.files[member.path] = (object_hash, member.mode)
+                elif member.islnk() and _strip_path(member.linkname) in manifest.files:
+                    object_hash, mode = manifest.files[_strip_path(member.linkname)]
+                    cache.link(object_hash, mode, destination)
+                    manifest.files[member.path] = (object_hash, mode)
+                elif member.isdir():
+                    if path.islink(destination):
+                        unlink(destination)
+                    makedirs(destination, exist_ok=True)
+                    manifest.dirs.append(member.path)
+                elif member.issym():
+                    check_symlink(destination_path, destination, member.linkname)
+                    make_symlink(member.linkname, destination)
+                    manifest.symlinks[member.path] = member.linkname
+    finally:
+        reader.drain()
+    return manifest
+
+
+async def _wait_thread(future: asyncio.Future):
+    """Awaits an executor job. On cancellation the thread still runs, so it is awaited before the cancellation goes
+    on: a failed install removes the app folder only once nothing writes to it anymore."""
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.gather(future, return_exceptions=True)
+        raise
+
+
+class Installer:
+    """Queue of install jobs, executed on the event loop with bounded concurrency. Installs of different apps run in
+    parallel, installs of the same app one after another.
+
+    :param layers: shared dependency layers for apps declaring ``requirements``, none are built without.
+    :param timeout: seconds an install may take once started, its processes are killed after. ``None`` for no limit.
+    :param download_timeout: seconds the download of a package may wait to connect or for the next data.
+    :param on_update: called with the job on every state change and with download progress, at most every
+        ``PROGRESS_INTERVAL`` seconds, to publish jobs to other daemon processes.
+    """
+
+    def __init__(
+        self,
+        apps_folder: str,
+        cache: PackageCache,
+        max_concurrency: int = 2,
+        history_size: int = 100,
+        layers: Optional[LayerCache] = None,
+        timeout: Optional[float] = None,
+        download_timeout: float = 30.0,
+        on_update: Optional[Callable[[dict], None]] = None,
+    ):
+        self.apps_folder = apps_folder
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.history_size = history_size
+        self.layers = layers
+        self.timeout = timeout
+        self.download_timeout = download_timeout
+        self.on_update = on_update
+        self.jobs: Dict[str, InstallJob] = OrderedDict()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._app_locks: Dict[str, asyncio.Lock] = {}
+        self._app_jobs: Dict[str, int] = {}  # jobs of the app running or waiting for its lock
+        self._tasks: List[asyncio.Task] = []
+
+    def submit(self, app_name: str, package_url: str, on_installed: Callable[[str], dict]) -> InstallJob:
+        """Queues install of the app and returns immediately.
+
+        :param on_installed: called after extraction, returns the app config or raises an exception.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        job = InstallJob(app_name, package_url)
+        self.jobs[job.job_id] = job
+        self._trim_history()
+        self._publish(job)
+        task = asyncio.get_running_loop().create_task(self._run(job, on_installed))
+        self._tasks.append(task)
+        task.add_done_callback(self._tasks.remove)
+        return job
+
+    def get(self, job_id: str) -> Optional[InstallJob]:
+        return self.jobs.get(job_id, None)
+
+    def _publish(self, job: InstallJob, state: Optional[str] = None) -> None:
+        if state is not None:
+            job.state = state
+        if self.on_update is not None:
+            job.published = time.monotonic()
+            self.on_update(job.to_dict())
+
+    def _trim_history(self) -> None:
+        finished = [k for k, v in self.jobs.items() if v.done]
+        for job_id in finished[: max(0, len(self.jobs) - self.history_size)]:
+            del self.jobs[job_id]
+
+    async def _run(self, job: InstallJob, on_installed: Callable[[str], dict]) -> None:
+        destination_path = path.join(self.apps_folder, job.app_name)
+        self._app_jobs[job.app_name] = self._app_jobs.get(job.app_name, 0) + 1
+        try:
+            await self._run_locked(job, on_installed, destination_path)
+        finally:
+            self._app_jobs[job.app_name] -= 1
+            if not self._app_jobs[job.app_name]:
+                del self._app_jobs[job.app_name]
+                self._app_locks.pop(job.app_name, None)
+
+    async def _run_locked(self, job: InstallJob, on_installed: Callable[[str], dict], destination_path: str) -> None:
+        async with self._app_locks.setdefault(job.app_name, asyncio.Lock()), self._semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                await asyncio.wait_for(self._install(job, on_installed, destination_path), self.timeout)
+                job.state = "finished"
+            except Exception as e:  # noqa # pylint: disable=broad-except
+                if isinstance(e, asyncio.TimeoutError):
+                    e = RuntimeError(f"install did not finish in {self.timeout:g} seconds")
+                LOG.warning("install of %s failed: %s", job.app_name, e)
+                await loop.run_in_executor(None, lambda: rmtree(destination_path, ignore_errors=True))
+                job.error = str(e)
+                job.state = "failed"
+            job.finished = time.time()
+            INSTALLS.inc(job.state)
+            self._publish(job)
+
+    async def _install(self, job: InstallJob, on_installed: Callable[[str], dict], destination_path: str) -> None:
+        loop = asyncio.get_running_loop()
+        self._publish(job, "downloading")
+        await self._download_and_extract(job, destination_path)
+        app_config = await _wait_thread(loop.run_in_executor(None, on_installed, job.app_name))
+        if self.layers is not None:
+            if app_config.get("requirements", []):
+                self._publish(job, "layer")
+                with INSTALL_SECONDS.time("layer"):
+                    job.layer = await self.layers.attach(
+                        path.abspath(destination_path), app_config["requirements"], app_config.get("python", "python3")
+                    )
+            else:
+                await _wait_thread(loop.run_in_executor(None, self.layers.detach, destination_path))
+        self._publish(job, "after_install")
+        with INSTALL_SECONDS.time("after_install"):
+            await self._after_install(job.app_name, app_config.get("after_install", None), destination_path)
+
+    async def _download_and_extract(self, job: InstallJob, destination_path: str) -> None:
+        makedirs(destination_path, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        manifest = self.cache.cached_manifest(job.package_url)
+        headers = self.cache.conditional_headers(job.package_url) if manifest else {}
+        async with httpx.AsyncClient(follow_redirects=True, timeout=self.download_timeout) as client:
+            async with client.stream("GET", job.package_url, headers=headers) as response:
+                if response.status_code == 304 and manifest is not None:
+                    job.cached = True
+                    self._publish(job, "extracting")
+                    with INSTALL_SECONDS.time("materialize"):
+                        await _wait_thread(
+                            loop.run_in_executor(None, self.cache.materialize, manifest, destination_path)
+                        )
+                    return
+                response.raise_for_status()
+                if "content-length" in response.headers:
+                    job.total = int(response.headers["content-length"])
+                reader = _ChunkReader()
+                extract = loop.run_in_executor(None, _extract_stream, reader, destination_path, self.cache)
+                archive_hash = ""
+                download_error = None
+                try:
+                    with INSTALL_SECONDS.time("download"):
+                        archive_hash = await self._download(job, response, reader)
+                except asyncio.CancelledError:
+                    await _wait_thread(loop.run_in_executor(None, reader.feed_eof))  # lets the extraction finish
+                    await asyncio.gather(extract, return_exceptions=True)
+                    raise
+                except Exception as e:  # noqa # pylint: disable=broad-except
+                    download_error = e
+                await _wait_thread(loop.run_in_executor(None, reader.feed_eof))
+                self._publish(job, "extracting")
+                try:
+                    with INSTALL_SECONDS.time("extract"):
+                        manifest = await _wait_thread(extract)
+                except Exception:  # noqa # pylint: disable=broad-except
+                    if download_error is None:
+                        raise
+                if download_error is not None:
+                    raise download_error
+                await loop.run_in_executor(
+                    None, self.cache.add_package, job.package_url, response.headers, archive_hash, manifest
+                )
+
+    async def _download(self, job: InstallJob, response: httpx.Response, reader: _ChunkReader) -> str:
+        """Feeds the whole response to the extraction, which consumes data after the end of the archive too, and
+        returns the hash of all of it."""
+        loop = asyncio.get_running_loop()
+        sha = hashlib.sha256()
+        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+            sha.update(chunk)
+            job.downloaded += len(chunk)
+            if time.monotonic() - job.published > PROGRESS_INTERVAL:
+                self._publish(job)
+            if not reader.feed_nowait(chunk):
+                await loop.run_in_executor(None, reader.feed, chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    async def _after_install(app_name: str, setup_script, destination_path: str) -> None:
+        if not setup_script:
+            return
+        if isinstance(setup_script, str):
+            setup_script = [setup_script]
+        app_path = path.abspath(destination_path)
+        exit_code, _ = await run_process(setup_script, cwd=app_path, env=activate(dict(environ), app_path))
+        if exit_code:
+            raise RuntimeError(f"after_install of {app_name} exited with {exit_code}")
@@ -0,0 +1,344 @@
+"""
+Queued and scheduled runs of apps: jobs submitted to the queue in the shared state are run as one-shot app processes.
+
+Every daemon process runs a dispatcher that claims due jobs, highest priority first, for at most ``max_running``
+processes of its own and at most the app's ``job_workers`` processes over all daemon processes. Schedules queue a job
+whenever their cron expression is due.
+"""
+
+import logging as log
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+from subprocess import DEVNULL, PIPE, STDOUT, Popen
+from typing import IO, Callable, Dict, List, Optional, Set, Tuple
+
+from metrics import REGISTRY
+from state import SharedState
+from supervisor import limits_preexec
+
+LOG = log.getLogger()
+
+OUTPUT_TAIL = 64 * 1024
+OUTPUT_CHUNK = 16 * 1024
+OUTPUT_WAIT = 1.0
+KILL_GRACE = 5.0
+MAINTENANCE_INTERVAL = 60.0
+CRON_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+_CRON_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31), ("month", 1, 12), ("day of week", 0, 7))
+
+QUEUE_JOBS = REGISTRY.counter(
+    "nc_sea_daemon_queue_jobs_total", "Finished queued jobs by app and result.", ["app", "state"]
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "nc_sea_daemon_queue_wait_seconds", "Time jobs waited in the queue after they became due.", ["app"]
+)
+
+Prepare = Callable[[dict], Tuple[List[str], Dict[str, str], str, dict]]
+"""Returns command, environment, folder and manifest of the app process for a claimed job, raises ValueError."""
+
+
+def _parse_field(field: str, name: str, low: int, high: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in field.split(","):
+        value_range, _, step_text = part.partition("/")
+        try:
+            step = int(step_text) if step_text else 1
+            if value_range == "*":
+                start, end = low, high
+            elif "-" in value_range:
+                start, end = (int(i) for i in value_range.split("-", 1))
+            else:
+                start = int(value_range)
+                end = high if step_text else start
+        except ValueError:
+            raise ValueError(f"invalid {name} field: {field}") from None
+        if step < 1 or start < low or end > high or start > end:
+            raise ValueError(f"invalid {name} field: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    """Five-field cron expression (minute, hour, day of month, month, day of week) in local time, with ``*``, lists,
+    ranges, steps and the ``@hourly`` style shortcuts. As in cron, a restricted day of month and day of week match
+    either."""
+
+    def __init__(self, expression: str):
+        expression = CRON_ALIASES.get(expression.strip(), expression)
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("cron expression must have five fields: minute hour day-of-month month day-of-week")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(i, *field) for i, field in zip(fields, _CRON_FIELDS)
+        )
+        self.weekdays = {i % 7 for i in weekdays}  # 0 and 7 are Sunday
+        self.any_day = fields[2].startswith("*")
+        self.any_weekday = fields[4].startswith("*")
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, timestamp: float) -> float:
+        """The first matching minute after ``timestamp``."""
+        moment = datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        end = moment + timedelta(days=5 * 366)
+        while moment < end:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError("cron expression never matches")
+
+
+def next_run(cron: str, timestamp: float) -> float:
+    return Cron(cron).next_after(timestamp)
+
+
+class _OutputTail:
+    """Reads the output of a job from its pipe in a thread, keeping only the last ``OUTPUT_TAIL`` bytes."""
+
+    def __init__(self, pipe: IO[bytes]):
+        self._pipe = pipe
+        self._tail = bytearray()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._done: Optional[Callable[[str], None]] = None
+        self._timer: Optional[threading.Timer] = None
+        self.delivered = threading.Event()
+        self._thread = threading.Thread(target=self._read, name="job-output", daemon=True)
+        self._thread.start()
+
+    def _read(self) -> None:
+        with self._pipe:
+            for chunk in iter(lambda: self._pipe.read1(OUTPUT_CHUNK), b""):  # type: ignore[attr-defined]
+                with self._lock:
+                    self._tail += chunk
+                    del self._tail[:-OUTPUT_TAIL]
+        with self._lock:
+            self._closed = True
+        self._deliver()
+
+    def then(self, done: Callable[[str], None]) -> None:
+        """Calls ``done`` with the output once the pipe is closed, or after ``OUTPUT_WAIT`` seconds if processes started
+        by the job still hold it open, from the reader or a timer thread."""
+        with self._lock:
+            self._done = done
+            closed = self._closed
+            if not closed:
+                self._timer = threading.Timer(OUTPUT_WAIT, self._deliver)
+                self._timer.daemon = True
+                self._timer.start()
+        if closed:
+            self._deliver()
+
+    def _deliver(self) -> None:
+        with self._lock:
+            done, self._done = self._done, None
+            if self._timer is not None:
+                self._timer.cancel()
+            output = self._tail.decode("utf8", errors="replace")
+        if done is not None:
+            try:
+                done(output)
+            finally:
+                self.delivered.set()
+
+
+class _Running:
+    __slots__ = ("job", "process", "output", "deadline", "stop", "killed_at")
+
+    def __init__(self, job: dict, process: Popen, deadline: Optional[float]):
+        self.job = job
+        self.process = process
+        self.output = _OutputTail(process.stdout)  # type: ignore[arg-type]
+        self.deadline = deadline
+        self.stop = ""  # why the job is being stopped: "cancelled", "timeout" or "shutdown"
+        self.killed_at: Optional[float] = None
+
+
+class JobQueue:
+    """Dispatcher of queued jobs in one daemon process.
+
+    :param prepare: builds the app process of a claimed job.
+    :param app_limit: jobs of the app allowed to run at once over all daemon processes.
+    :param max_running: jobs this process runs at once.
+    :param poll_interval: seconds between checks of the queue for jobs submitted in other processes.
+    :param retention: seconds finished jobs are kept, with their exit code and output.
+    :param history_size: finished jobs kept at most.
+    """
+
+    def __init__(
+        self,
+        state: SharedState,
+        prepare: Prepare,
+        app_limit: Callable[[str], int],
+        max_running: int = 8,
+        poll_interval: float = 1.0,
+        retention: float = 7 * 24 * 3600.0,
+        history_size: int = 10000,
+    ):
+        self.state = state
+        self.prepare = prepare
+        self.app_limit = app_limit
+        self.max_running = max_running
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.history_size = history_size
+        self.running: Dict[int, _Running] = {}
+        self.recording: Dict[int, _Running] = {}  # exited jobs, until their output is read and the result recorded
+        self._wakeup = threading.Event()
+        self._shutdown = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._maintained = 0.0
+
+    def start(self) -> None:
+        self.state.queue_reap_lost(own=True)
+        self._thread = threading.Thread(target=self._loop, name="job-queue", daemon=True)
+        self._thread.start()
+
+    def wakeup(self) -> None:
+        """Makes the dispatcher check the queue now, after a submit or a cancel in this process."""
+        self._wakeup.set()
+
+    def shutdown(self) -> None:
+        """Stops the dispatcher, jobs still running in this process fail."""
+        self._shutdown.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        for running in list(self.running.values()):
+            running.stop = "shutdown"
+            _signal(running.process, signal.SIGKILL)
+            running.process.wait()
+            self._finish(running)
+        for running in list(self.recording.values()):
+            running.output.delivered.wait()
+
+    def _loop(self) -> None:
+        while not self._shutdown.is_set():
+            self._wakeup.clear()
+            try:
+                self._step()
+            except Exception as e:  # noqa # pylint: disable=broad-except
+                LOG.exception("job queue: %s", e)
+            self._wakeup.wait(self._next_timeout())
+
+    def _step(self) -> None:
+        now = time.time()
+        if now - self._maintained >= MAINTENANCE_INTERVAL:
+            self._maintained = now
+            self.state.queue_reap_lost(own=False)
+            self.state.queue_trim(self.retention, self.history_size)
+        self.state.schedules_due(next_run)
+        for job_id in self.state.queue_cancel_requests():
+            if job_id in self.running and not self.running[job_id].stop:
+                self._stop(self.running[job_id], "cancelled")
+        for running in list(self.running.values()):
+            self._check(running, now)
+        free = self.max_running - len(self.running)
+        if free > 0 and not self._shutdown.is_set():
+            for job in self.state.queue_claim(self.app_limit, free):
+                self._launch(job)
+
+    def _next_timeout(self) -> float:
+        timeout = self.poll_interval
+        now = time.time()
+        for running in self.running.values():
+            if running.killed_at is not None:
+                timeout = min(timeout, max(running.killed_at + KILL_GRACE - now, 0.0))
+            elif running.deadline is not None:
+                timeout = min(timeout, max(running.deadline - now, 0.0))
+        return timeout
+
+    def _launch(self, job: dict) -> None:
+        QUEUE_WAIT.observe(max(job["started"] - job["not_before"], 0.0), job["app_name"])
+        try:
+            cmd, env, cwd, manifest = self.prepare(job)
+            env["app_job_id"] = str(job["job_id"])
+            process = Popen(  # pylint: disable=consider-using-with
+                cmd,
+                env=env,
+                cwd=cwd,
+                stdin=DEVNULL,
+                stdout=PIPE,
+                stderr=STDOUT,
+                preexec_fn=limits_preexec(manifest.get("limits", {})),
+            )
+        except (ValueError, OSError, TypeError) as e:
+            self.state.queue_finished(job["job_id"], "failed", None, str(e), "")
+            QUEUE_JOBS.inc(job["app_name"], "failed")
+            return
+        deadline = None if job["timeout"] is None else time.time() + job["timeout"]
+        running = self.running[job["job_id"]] = _Running(job, process, deadline)
+        self.state.queue_started(job["job_id"], process.pid)
+        threading.Thread(target=self._wait, args=(running,), name="job-wait", daemon=True).start()
+
+    def _wait(self, running: _Running) -> None:
+        running.process.wait()
+        self._wakeup.set()
+
+    def _check(self, running: _Running, now: float) -> None:
+        if running.process.poll() is not None:
+            del self.running[running.job["job_id"]]
+            self._finish(running)
+        elif running.killed_at is not None:
+            if now - running.killed_at >= KILL_GRACE:
+                _signal(running.process, signal.SIGKILL)
+        elif running.deadline is not None and now >= running.deadline:
+            self._stop(running, "timeout")
+
+    @staticmethod
+    def _stop(running: _Running, reason: str) -> None:
+        running.stop = reason
+        running.killed_at = time.time()
+        _signal(running.process, signal.SIGTERM)
+
+    def _finish(self, running: _Running) -> None:
+        job = running.job
+        exit_code = running.process.returncode
+        if running.stop == "cancelled":
+            state, error = "cancelled", ""
+        elif running.stop == "timeout":
+            state, error = "failed", f"timed out after {job['timeout']:g} seconds"
+        elif running.stop == "shutdown":
+            state, error = "failed", "daemon process stopped"
+        else:
+            state, error = ("finished", "") if exit_code == 0 else ("failed", f"exited with {exit_code}")
+        self.recording[job["job_id"]] = running
+        running.output.then(lambda output: self._record(job, state, exit_code, error, output))
+
+    def _record(self, job: dict, state: str, exit_code: Optional[int], error: str, output: str) -> None:
+        try:
+            self.state.queue_finished(job["job_id"], state, exit_code, error, output)
+            QUEUE_JOBS.inc(job["app_name"], state)
+        except Exception as e:  # noqa # pylint: disable=broad-except
+            LOG.exception("job queue: %s", e)
+        finally:
+            self.recording.pop(job["job_id"], None)
+
+
+def _signal(process: Popen, signum: int) -> None:
+    try:
+        process.send_signal(signum)
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,187 @@
+"""
+Shared dependency layers of Python apps, declared in appinfo.json:
+
+    "requirements": ["fastapi==0.110.0", "httpx"], "python": "python3"
+
+A layer is a virtualenv with the requirements installed, keyed by the hash of the requirements and the interpreter, so
+it is built once and used by every app declaring the same set. Apps get a small virtualenv of their own in ``.venv``,
+whose ``.pth`` file puts the layer's site-packages after its own: packages an app installs later land in its own
+virtualenv, the layer is never changed. Wheels are kept in one pip cache, so layers with overlapping requirements build
+without downloading or compiling them again, and layer files are read-only hard links to the objects of the
+PackageCache, so identical files of different layers share disk space and page cache.
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import logging as log
+from os import defpath, environ, listdir, makedirs, path, pathsep
+from shutil import rmtree, which
+from typing import IO, Dict, List, Optional, Tuple
+
+from package_cache import PackageCache
+
+LOG = log.getLogger()
+
+VENV = ".venv"
+LAYER_FILE = "layer"
+COMPLETE_FILE = ".complete"
+LOCK_POLL = 0.2
+_PROBE = "import platform, sys; print(sys.version, sys.base_prefix, platform.machine())"
+_PURELIB = "import sysconfig; print(sysconfig.get_path('purelib'))"
+
+
+async def run_process(
+    cmd: List[str], cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None, capture: bool = False
+) -> Tuple[int, bytes]:
+    """Runs the command, returns its exit code and, with ``capture``, its output. The process is killed when the
+    waiting task is cancelled, by a timeout for example."""
+    pipe = asyncio.subprocess.PIPE if capture else None
+    process = await asyncio.create_subprocess_exec(
+        *cmd, cwd=cwd, env=env, stdout=pipe, stderr=asyncio.subprocess.STDOUT if capture else None
+    )
+    try:
+        output, _ = await process.communicate()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    return process.returncode, output or b""
+
+
+async def _check_output(cmd: List[str], env: Optional[Dict[str, str]] = None) -> str:
+    exit_code, output = await run_process(cmd, env=env, capture=True)
+    if exit_code:
+        tail = output.decode("utf8", errors="replace").strip()[-2000:]
+        raise RuntimeError(f"`{' '.join(cmd[:4])}` exited with {exit_code}: {tail}")
+    return output.decode("utf8").strip()
+
+
+def activate(env: Dict[str, str], app_path: str) -> Dict[str, str]:
+    """Puts the app's virtualenv, if it has one, first on the ``PATH`` of ``env``."""
+    venv_path = path.join(app_path, VENV)
+    bin_path = path.join(venv_path, "bin")
+    if path.isdir(bin_path):
+        env["VIRTUAL_ENV"] = venv_path
+        env["PATH"] = bin_path + pathsep + env.get("PATH", defpath)
+        env.pop("PYTHONHOME", None)
+    return env
+
+
+def normalize_requirements(requirements: List[str]) -> List[str]:
+    return sorted({i.strip() for i in requirements if i.strip() and not i.strip().startswith("#")})
+
+
+class LayerCache:
+    """Layers in ``root``, shared by all daemon processes: a layer is built under an exclusive lock of its file."""
+
+    def __init__(self, root: str, apps_folder: str, cache: PackageCache):
+        self.root = path.abspath(root)
+        self.apps_folder = apps_folder
+        self.cache = cache
+        self.wheels_path = path.join(self.root, "wheels")
+        makedirs(self.wheels_path, exist_ok=True)
+
+    def layer_path(self, key: str) -> str:
+        return path.join(self.root, key)
+
+    async def key(self, requirements: List[str], python: str) -> str:
+        interpreter = await _check_output([python, "-c", _PROBE])
+        data = "\n".join([interpreter, *normalize_requirements(requirements)])
+        return hashlib.sha256(data.encode("utf8")).hexdigest()[:32]
+
+    async def attach(self, app_path: str, requirements: List[str], python: str = "python3") -> str:
+        """Creates the app's virtualenv on the layer of ``requirements``, building the layer when it does not exist.
+        Returns the layer key."""
+        key = await self.key(requirements, python)
+        lock = await self._lock(key)
+        try:
+            layer_path = self.layer_path(key)
+            if not path.isfile(path.join(layer_path, COMPLETE_FILE)):
+                await self._build(layer_path, requirements, python)
+            await self._app_venv(app_path, layer_path, key, python)
+        finally:
+            lock.close()
+        return key
+
+    def detach(self, app_path: str) -> None:
+        rmtree(path.join(app_path, VENV), ignore_errors=True)
+
+    async def _lock(self, key: str) -> IO:
+        lock = open(path.join(self.root, f"{key}.lock"), "a", encoding="utf8")  # pylint: disable=consider-using-with
+        try:
+            while True:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return lock
+                except BlockingIOError:
+                    await asyncio.sleep(LOCK_POLL)  # built by another install
+        except BaseException:
+            lock.close()
+            raise
+
+    async def _build(self, layer_path: str, requirements: List[str], python: str) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, lambda: rmtree(layer_path, ignore_errors=True))
+        layer_python = path.join(layer_path, "bin", "python")
+        python = which(python) or python
+        if (await run_process([python, "-m", "pip", "--python", python, "--version"], capture=True))[0] == 0:
+            # pip of the interpreter installs into the layer, several times faster than ensurepip
+            await _check_output([python, "-m", "venv", "--without-pip", layer_path])
+            pip = [python, "-m", "pip", "--python", layer_python]
+        else:
+            await _check_output([python, "-m", "venv", layer_path])
+            pip = [layer_python, "-m", "pip"]
+        requirements_path = path.join(layer_path, "requirements.txt")
+        with open(requirements_path, "w", encoding="utf8") as fp:
+            fp.write("\n".join(normalize_requirements(requirements)) + "\n")
+        env = dict(environ, PIP_CACHE_DIR=self.wheels_path, PIP_DISABLE_PIP_VERSION_CHECK="1")
+        # pip in the layer lets `after_install` scripts install packages into the app's own virtualenv
+        await _check_output([*pip, "install", "pip", "-r", requirements_path], env)
+        shared = await loop.run_in_executor(None, self.cache.adopt, layer_path)
+        with open(path.join(layer_path, COMPLETE_FILE), "w", encoding="utf8"):
+            pass
+        LOG.info("built layer %s, %s files shared with other layers", path.basename(layer_path), shared)
+
+    async def _app_venv(self, app_path: str, layer_path: str, key: str, python: str) -> None:
+        venv_path = path.join(app_path, VENV)
+        await asyncio.get_running_loop().run_in_executor(None, lambda: rmtree(venv_path, ignore_errors=True))
+        await _check_output([python, "-m", "venv", "--without-pip", venv_path])
+        venv_purelib = await _check_output([path.join(venv_path, "bin", "python"), "-c", _PURELIB])
+        layer_purelib = await _check_output([path.join(layer_path, "bin", "python"), "-c", _PURELIB])
+        with open(path.join(venv_purelib, "_nc_layer.pth"), "w", encoding="utf8") as fp:
+            fp.write(layer_purelib + "\n")
+        with open(path.join(venv_path, LAYER_FILE), "w", encoding="utf8") as fp:
+            fp.write(key)
+
+    def used(self) -> set:
+        """Keys of the layers apps are attached to."""
+        keys = set()
+        if path.isdir(self.apps_folder):
+            for app_name in listdir(self.apps_folder):
+                try:
+                    with open(path.join(self.apps_folder, app_name, VENV, LAYER_FILE), "r", encoding="utf8") as fp:
+                        keys.add(fp.read().strip())
+                except OSError:
+                    continue
+        return keys
+
+    def prune(self) -> List[str]:
+        """Removes layers no app is attached to and that are not being built, returns their keys."""
+        used = self.used()
+        removed = []
+        for name in listdir(self.root):
+            if not name.endswith(".lock") or name[:-5] in used:
+                continue
+            key = name[:-5]
+            with open(path.join(self.root, name), "a", encoding="utf8") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                if key in self.used() or not path.isdir(self.layer_path(key)):
+                    continue  # attached meanwhile or removed already
+                rmtree(self.layer_path(key), ignore_errors=True)
+            removed.append(key)
+        return removed
@@ -28,4 +28,5 @@ if __name__ == "__main__":
         host=cfg.options["host"],
         port=cfg.options["port"],
         log_level=log_level,
+        workers=int(cfg.options.get("workers", 1)),
     )
@@ -0,0 +1,131 @@
+"""
+In-memory index of validated appinfo.json manifests of installed apps.
+"""
+
+import threading
+import time
+from json import load
+from os import path, scandir, stat
+from typing import Dict, Optional, Tuple
+
+from supervisor import RESTART_POLICIES
+
+APPINFO = "appinfo.json"
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def _check_str_list(manifest: dict, key: str) -> None:
+    value = manifest.get(key, [])
+    if not isinstance(value, list) or not all(isinstance(i, str) for i in value):
+        raise ManifestError(f"`{key}` must be a list of strings")
+
+
+def validate_manifest(manifest) -> dict:
+    """Checks the fields the daemon uses, raises ManifestError describing the first invalid one."""
+    if not isinstance(manifest, dict):
+        raise ManifestError("manifest must be a JSON object")
+    if not isinstance(manifest.get("entry_point", None), str) or not manifest["entry_point"]:
+        raise ManifestError("`entry_point` value missing from app config")
+    if not isinstance(manifest.get("args", []), list):
+        raise ManifestError("`args` must be a list")
+    after_install = manifest.get("after_install", [])
+    if not isinstance(after_install, str) and not (
+        isinstance(after_install, list) and all(isinstance(i, str) for i in after_install)
+    ):
+        raise ManifestError("`after_install` must be a command or a list of strings")
+    for key in ("preload", "requirements"):
+        _check_str_list(manifest, key)
+    workers = manifest.get("workers", 1)
+    if not isinstance(workers, int) or isinstance(workers, bool) or workers < 1:
+        raise ManifestError("`workers` must be a positive integer")
+    job_workers = manifest.get("job_workers", 1)
+    if not isinstance(job_workers, int) or isinstance(job_workers, bool) or job_workers < 1:
+        raise ManifestError("`job_workers` must be a positive integer")
+    if manifest.get("restart", "never") not in RESTART_POLICIES:
+        raise ManifestError(f"`restart` must be one of {RESTART_POLICIES}")
+    limits = manifest.get("limits", {})
+    if not isinstance(limits, dict) or not all(isinstance(i, int) and i > 0 for i in limits.values()):
+        raise ManifestError("`limits` must map limit names to positive integers")
+    if not isinstance(manifest.get("health_check", ""), (str, type(None))):
+        raise ManifestError("`health_check` must be a path")
+    if not isinstance(manifest.get("python", ""), str):
+        raise ManifestError("`python` must be the interpreter to build the requirements layer with")
+    if not isinstance(manifest.get("fork_server", False), bool):
+        raise ManifestError("`fork_server` must be a boolean")
+    return manifest
+
+
+class ManifestIndex:
+    """Validated manifests by app name, parsed once and re-read only when the file's mtime changes.
+
+    The mtime is checked at most every ``check_interval`` seconds per app, so launches normally do no file I/O.
+    """
+
+    def __init__(self, apps_folder: str, check_interval: float = 2.0):
+        self.apps_folder = apps_folder
+        self.check_interval = check_interval
+        self.errors: Dict[str, str] = {}
+        self._entries: Dict[str, Tuple[dict, float, float]] = {}  # manifest, mtime, checked at
+        self._lock = threading.Lock()
+
+    def manifest_path(self, app_name: str) -> str:
+        return path.join(self.apps_folder, app_name, APPINFO)
+
+    def get(self, app_name: str) -> Optional[dict]:
+        """Returns the manifest of the app, None if it is missing or invalid (see ``errors``)."""
+        now = time.monotonic()
+        entry = self._entries.get(app_name, None)
+        if entry is not None and now - entry[2] < self.check_interval:
+            return entry[0]
+        try:
+            return self.load(app_name)
+        except (OSError, ManifestError):
+            return None
+
+    def load(self, app_name: str) -> dict:
+        """Reads the manifest if it changed since the last read, raises OSError or ManifestError."""
+        manifest_path = self.manifest_path(app_name)
+        try:
+            mtime = stat(manifest_path).st_mtime
+            with self._lock:
+                entry = self._entries.get(app_name, None)
+                if entry is not None and entry[1] == mtime:
+                    self._entries[app_name] = (entry[0], mtime, time.monotonic())
+                    return entry[0]
+            with open(manifest_path, "r", encoding="utf8") as fp:
+                try:
+                    manifest = validate_manifest(load(fp))
+                except ValueError as e:
+                    raise ManifestError(f"{APPINFO} of {app_name} is invalid: {e}") from None
+        except (OSError, ManifestError) as e:
+            with self._lock:
+                self._entries.pop(app_name, None)
+                self.errors[app_name] = str(e)
+            raise
+        with self._lock:
+            self._entries[app_name] = (manifest, mtime, time.monotonic())
+            self.errors.pop(app_name, None)
+        return manifest
+
+    def remove(self, app_name: str) -> None:
+        with self._lock:
+            self._entries.pop(app_name, None)
+            self.errors.pop(app_name, None)
+
+    def reload(self) -> Dict[str, str]:
+        """Rescans the apps folder, re-reads changed manifests and forgets removed apps. Returns errors by app."""
+        app_names = set()
+        if path.isdir(self.apps_folder):
+            app_names = {i.name for i in scandir(self.apps_folder) if i.is_dir()}
+        for app_name in (set(self._entries) | set(self.errors)) - app_names:
+            self.remove(app_name)
+        for app_name in app_names:
+            try:
+                self.load(app_name)
+            except (OSError, ManifestError):
+                pass
+        with self._lock:
+            return dict(self.errors)
@@ -0,0 +1,251 @@
+"""
+Prometheus metrics of the daemon, rendered in the text exposition format.
+
+Recording takes no locks: every thread updates its own shard of a metric and shards are summed up on collection.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Hook = Callable[["Metric", float, Tuple[str, ...]], None]
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], hooks: List[Hook]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._hooks = hooks
+        self._shards: List[Dict[Tuple[str, ...], List[float]]] = []
+        self._local = threading.local()
+
+    def _values(self, label_values: Tuple[str, ...]) -> List[float]:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            self._shards.append(shard)
+        values = shard.get(label_values, None)
+        if values is None:
+            values = shard[label_values] = self._new_values()
+        return values
+
+    def _new_values(self) -> List[float]:
+        return [0.0]
+
+    def _notify(self, value: float, label_values: Tuple[str, ...]) -> None:
+        for hook in self._hooks:
+            hook(self, value, label_values)
+
+    def collect(self) -> Dict[Tuple[str, ...], List[float]]:
+        """Values by label values, summed over all threads."""
+        totals: Dict[Tuple[str, ...], List[float]] = {}
+        for shard in list(self._shards):
+            for label_values, values in list(shard.items()):
+                total = totals.get(label_values, None)
+                if total is None:
+                    totals[label_values] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        total[i] += value
+        return totals
+
+    def samples(self, values_by_labels: Dict[Tuple[str, ...], List[float]]) -> Iterator[str]:
+        for label_values, values in sorted(values_by_labels.items()):
+            yield f"{self.name}{_labels(self.labels, label_values)} {_number(values[0])}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        self._values(label_values)[0] += amount
+        if self._hooks:
+            self._notify(amount, label_values)
+
+
+class Histogram(Metric):
+    """Values are counts per bucket (not cumulative, the last one is +Inf) followed by the sum."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], hooks: List[Hook], buckets=None):
+        super().__init__(name, documentation, labels, hooks)
+        self.buckets = tuple(buckets or DEFAULT_BUCKETS)
+
+    def _new_values(self) -> List[float]:
+        return [0.0] * (len(self.buckets) + 2)
+
+    def observe(self, value: float, *label_values: str) -> None:
+        values = self._values(label_values)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+        if self._hooks:
+            self._notify(value, label_values)
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        """Observes the duration of the block in seconds, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def samples(self, values_by_labels: Dict[Tuple[str, ...], List[float]]) -> Iterator[str]:
+        for label_values, values in sorted(values_by_labels.items()):
+            count = 0.0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), values):
+                count += bucket_count
+                le_labels = _labels((*self.labels, "le"), (*label_values, _number(bound)))
+                yield f"{self.name}_bucket{le_labels} {_number(count)}"
+            labels = _labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_number(values[-1])}"
+            yield f"{self.name}_count{labels} {_number(count)}"
+
+
+class Gauge(Metric):
+    """Value read at collection time from ``read``, which returns values by label values."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str],
+        hooks: List[Hook],
+        read: Callable[[], Dict[Tuple[str, ...], float]],
+    ):
+        super().__init__(name, documentation, labels, hooks)
+        self.read = read
+
+    def collect(self) -> Dict[Tuple[str, ...], List[float]]:
+        return {k: [v] for k, v in self.read().items()}
+
+
+class Registry:
+    """Metrics of the daemon. ``hooks`` are called with every recorded value, e.g. to export it to OpenTelemetry."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.hooks: List[Hook] = []
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labels, self.hooks))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (), buckets=None) -> Histogram:
+        return self._add(Histogram(name, documentation, labels, self.hooks, buckets))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str], read) -> Gauge:
+        return self._add(Gauge(name, documentation, labels, self.hooks, read))
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> Dict[str, list]:
+        """Recorded counters and histograms in a JSON serializable form, to be merged by another process."""
+        return {
+            name: [[list(k), v] for k, v in metric.collect().items()]
+            for name, metric in self.metrics.items()
+            if not isinstance(metric, Gauge)
+        }
+
+    def render(self, snapshots: Optional[List[Dict[str, list]]] = None) -> str:
+        """Text exposition of all metrics, with values of ``snapshots`` from other processes added."""
+        lines = []
+        for name, metric in self.metrics.items():
+            values_by_labels = metric.collect()
+            for snapshot in snapshots or []:
+                for label_values, values in snapshot.get(name, []):
+                    total = values_by_labels.setdefault(tuple(label_values), [0.0] * len(values))
+                    for i, value in enumerate(values[: len(total)]):
+                        total[i] += value
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.samples(values_by_labels))
+        return "\n".join(lines) + "\n"
+
+
+class RequestMetrics:
+    """ASGI middleware observing the duration of HTTP requests by method, route template and status code."""
+
+    def __init__(self, app, histogram: Histogram):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # the router sets the matched route in the scope, unmatched paths are not used as label values
+            route = getattr(scope.get("route", None), "path", "")
+            self.histogram.observe(time.perf_counter() - started, scope["method"], route, str(status_code))
+
+
+def _number(value) -> str:
+    if isinstance(value, str):
+        return value
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(names, escaped)) + "}"
+
+
+def otel_hook(meter_name: str = "nc_sea_daemon") -> Hook:
+    """Returns a hook recording every value into OpenTelemetry instruments of the same name.
+
+    Raises ImportError if ``opentelemetry-api`` is not installed. The exporter is set up by the OpenTelemetry SDK.
+    """
+    from opentelemetry import (  # pylint: disable=import-outside-toplevel,import-error
+        metrics as otel_metrics,
+    )
+
+    meter = otel_metrics.get_meter(meter_name)
+    instruments: dict = {}
+
+    def record(metric: Metric, value: float, label_values: Tuple[str, ...]) -> None:
+        instrument = instruments.get(metric.name, None)
+        if instrument is None:
+            if isinstance(metric, Counter):
+                instrument = meter.create_counter(metric.name, description=metric.documentation)
+            else:
+                instrument = meter.create_histogram(metric.name, unit="s", description=metric.documentation)
+            instruments[metric.name] = instrument
+        attributes = dict(zip(metric.labels, label_values))
+        if isinstance(metric, Counter):
+            instrument.add(value, attributes)
+        else:
+            instrument.record(value, attributes)
+
+    return record
+
+
+REGISTRY = Registry()
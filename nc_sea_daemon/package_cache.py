@@ -0,0 +1,334 @@
+"""
+Content-addressed store of downloaded packages and their files, shared between app installs.
+
+Stored objects are read-only. Installed files that are read-only in the package are hard links to them, writable ones
+are copies (copy-on-write clones where the file system supports them), so apps changing their files never change the
+store or the files of other apps.
+
+The store is shared by all daemon processes. Each process keeps a copy of the index, changes are merged into
+``index.json`` under an exclusive lock of ``index.lock``, so one process never drops the entries of another, and objects
+are looked up on disk before a package counts as cached, as another process may have evicted them.
+"""
+
+import fcntl
+import hashlib
+import logging as log
+import threading
+import time
+from json import dump, load
+from os import chmod, link, lstat, makedirs, path, remove, replace, sep, stat, symlink, unlink, walk
+from shutil import copyfile
+from stat import S_ISREG
+from tempfile import NamedTemporaryFile
+from typing import IO, Callable, Dict, List, Optional, Tuple
+
+LOG = log.getLogger()
+
+READ_SIZE = 256 * 1024
+FICLONE = 0x40049409
+WRITE_BITS = 0o222
+
+
+def _clone(source: str, destination: str) -> None:
+    """Copies the file, as a copy-on-write clone where the file system supports it."""
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+    copyfile(source, destination)
+
+
+def _inside(root: str, file_path: str) -> bool:
+    return file_path.startswith(root.rstrip(sep) + sep)
+
+
+def safe_destination(root: str, member_path: str) -> str:
+    """Destination of the package member ``member_path`` in the folder ``root``, with the symlinks of its parent folders
+    resolved. The member itself is replaced, never written through. Raises ValueError if it is outside of ``root``."""
+    root = path.realpath(root)
+    parent, name = path.split(path.normpath(member_path))
+    destination = path.join(path.realpath(path.join(root, parent)), name)
+    if name in ("", ".", "..") or not _inside(root, destination):
+        raise ValueError(f"package member {member_path} is outside of the app folder")
+    return destination
+
+
+def check_symlink(root: str, destination: str, target: str) -> None:
+    """Raises ValueError if a symlink at ``destination`` to ``target`` points outside of the folder ``root``."""
+    if path.isabs(target) or not _inside(
+        path.realpath(root), path.realpath(path.join(path.dirname(destination), target))
+    ):
+        raise ValueError(f"package symlink {path.basename(destination)} -> {target} is outside of the app folder")
+
+
+def make_symlink(target: str, destination: str) -> None:
+    if path.lexists(destination):
+        unlink(destination)
+    else:
+        makedirs(path.dirname(destination), exist_ok=True)
+    symlink(target, destination)
+
+
+class PackageManifest:
+    """Layout of one unpacked archive: regular files with their object hash and mode, directories and symlinks."""
+
+    def __init__(self):
+        self.files: Dict[str, Tuple[str, int]] = {}
+        self.dirs: List[str] = []
+        self.symlinks: Dict[str, str] = {}
+
+    def to_dict(self) -> dict:
+        return {"files": self.files, "dirs": self.dirs, "symlinks": self.symlinks}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PackageManifest":
+        manifest = cls()
+        manifest.files = {k: (v[0], v[1]) for k, v in data["files"].items()}
+        manifest.dirs = data["dirs"]
+        manifest.symlinks = data["symlinks"]
+        return manifest
+
+
+def _empty_index() -> dict:
+    return {"packages": {}, "archives": {}, "objects": {}}
+
+
+class PackageCache:
+    index_name = "index.json"
+    lock_name = "index.lock"
+
+    def __init__(self, root: str, max_size: int):
+        self.root = root
+        self.max_size = max_size
+        self.objects_path = path.join(root, "objects")
+        self._lock = threading.Lock()
+        makedirs(self.objects_path, exist_ok=True)
+        self._index: dict = _empty_index()
+        self._version: Optional[Tuple[int, int]] = None  # inode and mtime of the index file read last
+        self._stored: Dict[str, dict] = {}  # objects stored since the index was last written
+        self._used: Dict[str, float] = {}  # last use of objects since the index was last written
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self) -> None:
+        """Reads the index again if another process has written it since."""
+        index_path = path.join(self.root, self.index_name)
+        try:
+            info = stat(index_path)
+        except FileNotFoundError:
+            return
+        if (info.st_ino, info.st_mtime_ns) == self._version:
+            return
+        try:
+            with open(index_path, "r", encoding="utf8") as fp:
+                self._index = load(fp)
+        except (OSError, ValueError) as e:
+            LOG.warning("package cache index is broken, starting from scratch: %s", e)
+            self._index = _empty_index()
+        self._version = (info.st_ino, info.st_mtime_ns)
+
+    def _object_path(self, object_hash: str) -> str:
+        return path.join(self.objects_path, object_hash[:2], object_hash)
+
+    def conditional_headers(self, package_url: str) -> Dict[str, str]:
+        """Headers for revalidating an already cached package, empty if the package is not cached."""
+        with self._lock:
+            self._refresh()
+            package = self._index["packages"].get(package_url, None)
+        headers = {}
+        if package:
+            if package.get("etag", None):
+                headers["If-None-Match"] = package["etag"]
+            if package.get("last_modified", None):
+                headers["If-Modified-Since"] = package["last_modified"]
+        return headers
+
+    def cached_manifest(self, package_url: str) -> Optional[PackageManifest]:
+        """Returns manifest of the cached package if all of its files are still in the store."""
+        with self._lock:
+            self._refresh()
+            package = self._index["packages"].get(package_url, None)
+            archive = self._index["archives"].get(package["archive_hash"], None) if package else None
+            if archive is None:
+                return None
+            manifest = PackageManifest.from_dict(archive)
+        if any(not path.isfile(self._object_path(i[0])) for i in manifest.files.values()):
+            return None
+        return manifest
+
+    def store(self, fileobj: IO[bytes], mode: int) -> str:
+        """Puts file content into the store (if not already there) and returns its hash."""
+        sha = hashlib.sha256()
+        with NamedTemporaryFile(dir=self.objects_path, delete=False) as tmp:
+            size = 0
+            while True:
+                chunk = fileobj.read(READ_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+        object_hash = sha.hexdigest()
+        object_path = self._object_path(object_hash)
+        with self._lock:
+            if object_hash in self._index["objects"] and path.isfile(object_path):
+                remove(tmp.name)
+            else:
+                makedirs(path.dirname(object_path), exist_ok=True)
+                chmod(tmp.name, mode & ~WRITE_BITS)
+                replace(tmp.name, object_path)
+            self._index["objects"][object_hash] = self._stored[object_hash] = {"size": size, "last_used": time.time()}
+        return object_hash
+
+    def link(self, object_hash: str, mode: int, destination: str) -> bool:
+        """Places stored object at `destination`, as a hard link if `mode` is read-only. Returns False when an identical
+        file was already there."""
+        object_path = self._object_path(object_hash)
+        if path.islink(destination):
+            unlink(destination)
+        elif path.isfile(destination):
+            if path.samefile(destination, object_path):
+                return False
+            unlink(destination)
+        else:
+            makedirs(path.dirname(destination), exist_ok=True)
+        if not mode & WRITE_BITS and stat(object_path).st_mode & 0o7777 == mode:
+            try:
+                link(object_path, destination)
+                return True
+            except OSError:
+                pass
+        _clone(object_path, destination)
+        chmod(destination, mode)
+        return True
+
+    def materialize(self, manifest: PackageManifest, destination_path: str) -> int:
+        """Lays out cached package in `destination_path`, returns number of changed files. Raises ValueError for members
+        outside of it."""
+        changed = 0
+        for i in manifest.dirs:
+            makedirs(safe_destination(destination_path, i), exist_ok=True)
+        for file_path, (object_hash, mode) in manifest.files.items():
+            if self.link(object_hash, mode, safe_destination(destination_path, file_path)):
+                changed += 1
+        for file_path, target in manifest.symlinks.items():
+            destination = safe_destination(destination_path, file_path)
+            check_symlink(destination_path, destination, target)
+            make_symlink(target, destination)
+        self.touch(manifest)
+        return changed
+
+    def adopt(self, folder: str) -> int:
+        """Makes regular files under `folder` read-only hard links to the stored objects of the same content and mode,
+        files not in the store yet are stored by linking them. Returns the number of files now sharing an existing
+        object."""
+        shared = 0
+        for root, _, file_names in walk(folder):
+            for file_name in file_names:
+                file_path = path.join(root, file_name)
+                info = lstat(file_path)
+                if not S_ISREG(info.st_mode):
+                    continue
+                if info.st_mode & WRITE_BITS:
+                    chmod(file_path, info.st_mode & 0o7777 & ~WRITE_BITS)
+                    info = lstat(file_path)
+                sha = hashlib.sha256()
+                with open(file_path, "rb") as fp:
+                    while True:
+                        chunk = fp.read(READ_SIZE)
+                        if not chunk:
+                            break
+                        sha.update(chunk)
+                object_hash = sha.hexdigest()
+                object_path = self._object_path(object_hash)
+                with self._lock:
+                    if object_hash in self._index["objects"] and path.isfile(object_path):
+                        stored = stat(object_path)
+                        if stored.st_ino != info.st_ino and stored.st_mode == info.st_mode:
+                            tmp_path = f"{file_path}.{object_hash[:8]}.tmp"
+                            link(object_path, tmp_path)
+                            replace(tmp_path, file_path)
+                            shared += 1
+                    else:
+                        makedirs(path.dirname(object_path), exist_ok=True)
+                        if path.lexists(object_path):
+                            unlink(object_path)
+                        link(file_path, object_path)
+                    self._index["objects"][object_hash] = self._stored[object_hash] = {
+                        "size": info.st_size,
+                        "last_used": time.time(),
+                    }
+        self._commit()
+        return shared
+
+    def touch(self, manifest: PackageManifest) -> None:
+        now = time.time()
+        with self._lock:
+            for object_hash, _ in manifest.files.values():
+                self._used[object_hash] = now
+        self._commit()
+
+    def add_package(self, package_url: str, headers: Dict[str, str], archive_hash: str, manifest: PackageManifest):
+        package = {
+            "archive_hash": archive_hash,
+            "etag": headers.get("etag", None),
+            "last_modified": headers.get("last-modified", None),
+        }
+
+        def add(index: dict) -> None:
+            index["archives"][archive_hash] = manifest.to_dict()
+            index["packages"][package_url] = package
+
+        self._commit(add)
+
+    def _commit(self, change: Optional[Callable[[dict], None]] = None) -> None:
+        """Merges the objects stored and used by this process and ``change`` into the index written by all processes,
+        evicts objects over ``max_size`` and writes the index."""
+        with self._lock, open(path.join(self.root, self.lock_name), "a", encoding="utf8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._refresh()
+            objects = self._index["objects"]
+            objects.update(self._stored)
+            for object_hash, last_used in self._used.items():
+                if object_hash in objects:
+                    objects[object_hash]["last_used"] = max(objects[object_hash]["last_used"], last_used)
+            if change is not None:
+                change(self._index)
+            self._evict()
+            self._save()
+            self._stored.clear()
+            self._used.clear()
+
+    def _evict(self) -> None:
+        objects = self._index["objects"]
+        total = sum(i["size"] for i in objects.values())
+        if total <= self.max_size:
+            return
+        evicted = set()
+        for object_hash, info in sorted(objects.items(), key=lambda x: x[1]["last_used"]):
+            if total <= self.max_size:
+                break
+            try:
+                remove(self._object_path(object_hash))
+            except OSError:
+                pass
+            total -= info["size"]
+            evicted.add(object_hash)
+        for object_hash in evicted:
+            del objects[object_hash]
+        archives = self._index["archives"]
+        for archive_hash in [k for k, v in archives.items() if any(i[0] in evicted for i in v["files"].values())]:
+            del archives[archive_hash]
+        packages = self._index["packages"]
+        for package_url in [k for k, v in packages.items() if v["archive_hash"] not in archives]:
+            del packages[package_url]
+
+    def _save(self) -> None:
+        index_path = path.join(self.root, self.index_name)
+        with NamedTemporaryFile("w", dir=self.root, delete=False, encoding="utf8") as fp:
+            dump(self._index, fp)
+        replace(fp.name, index_path)
+        info = stat(index_path)
+        self._version = (info.st_ino, info.st_mtime_ns)
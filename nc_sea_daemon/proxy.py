@@ -0,0 +1,167 @@
+"""
+Reverse proxy from the daemon to the workers of running apps.
+"""
+
+import asyncio
+import logging as log
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import httpx
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+from supervisor import Supervisor
+
+LOG = log.getLogger()
+
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+}
+FORWARDED_HEADERS = {"x-forwarded-for", "x-forwarded-proto", "x-forwarded-host"}
+REQUEST_SKIP_HEADERS = HOP_BY_HOP_HEADERS | FORWARDED_HEADERS | {"host", "authorization"}
+
+
+def forwarded_headers(request: Request) -> List[Tuple[str, str]]:
+    """``X-Forwarded-*`` headers with the client address, scheme and host of the request, the address is appended to
+    the ones of proxies in front of the daemon, whose scheme and host are kept."""
+    headers = []
+    forwarded_for = request.headers.getlist("x-forwarded-for")
+    if request.client is not None:
+        forwarded_for.append(request.client.host)
+    if forwarded_for:
+        headers.append(("X-Forwarded-For", ", ".join(forwarded_for)))
+    headers.append(("X-Forwarded-Proto", request.headers.get("x-forwarded-proto", request.url.scheme)))
+    host = request.headers.get("x-forwarded-host", request.headers.get("host", None))
+    if host:
+        headers.append(("X-Forwarded-Host", host))
+    return headers
+
+
+class AppProxy:
+    """Forwards requests to the least busy healthy worker of an app, streaming bodies in both directions.
+
+    Workers are looked up in the shared state in the default executor, at most every ``ports_ttl`` seconds per app, so
+    the event loop never waits for the database.
+    """
+
+    def __init__(
+        self, supervisor: Supervisor, health_interval: float = 5.0, timeout: float = 60.0, ports_ttl: float = 1.0
+    ):
+        self.supervisor = supervisor
+        self.health_interval = health_interval
+        self.timeout = timeout
+        self.ports_ttl = ports_ttl
+        self.in_flight: Dict[Tuple[str, int], int] = {}
+        self.unhealthy: Set[Tuple[str, int]] = set()
+        self._ports: Dict[str, Tuple[List[int], float]] = {}  # alive ports by app and when they were read
+        self._client: Optional[httpx.AsyncClient] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_keepalive_connections=100, max_connections=500, keepalive_expiry=30.0)
+            self._client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        return self._client
+
+    async def alive_ports(self, app_name: str) -> List[int]:
+        entry = self._ports.get(app_name, None)
+        now = time.monotonic()
+        if entry is None or now - entry[1] >= self.ports_ttl:
+            ports = await asyncio.get_running_loop().run_in_executor(None, self.supervisor.alive_ports, app_name)
+            entry = self._ports[app_name] = (ports, now)
+        return entry[0]
+
+    def pick(self, app_name: str, ports: List[int]) -> Optional[int]:
+        """Returns the port of the healthy worker with the fewest requests in flight from this process."""
+        ports = [i for i in ports if (app_name, i) not in self.unhealthy]
+        if not ports:
+            return None
+        return min(ports, key=lambda x: self.in_flight.get((app_name, x), 0))
+
+    async def forward(self, request: Request, app_name: str, path: str) -> Response:
+        self._ensure_health_task()
+        port = self.pick(app_name, await self.alive_ports(app_name))
+        if port is None:
+            return JSONResponse({"status": "fail", "error": "no running workers of the app"}, status_code=503)
+        key = (app_name, port)
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in REQUEST_SKIP_HEADERS]
+        headers.extend(forwarded_headers(request))
+        upstream_request = self.client.build_request(
+            request.method,
+            httpx.URL(f"http://127.0.0.1:{port}/{path}", query=request.url.query.encode("utf8") or None),
+            headers=headers,
+            content=request.stream(),
+        )
+        self.in_flight[key] = self.in_flight.get(key, 0) + 1
+        try:
+            upstream = await self.client.send(upstream_request, stream=True)
+        except httpx.TransportError as e:
+            self._release(key)
+            if isinstance(e, httpx.ConnectError):
+                self.unhealthy.add(key)
+                self._ports.pop(app_name, None)  # the worker may have exited, read them again
+            LOG.warning("proxy to %s:%s failed: %s", app_name, port, e)
+            return JSONResponse({"status": "fail", "error": f"app worker is not reachable: {e}"}, status_code=502)
+
+        async def finish() -> None:
+            await upstream.aclose()
+            self._release(key)
+
+        response_headers = {k: v for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            status_code=upstream.status_code,
+            headers=response_headers,
+            background=BackgroundTask(finish),
+        )
+
+    def _release(self, key: Tuple[str, int]) -> None:
+        self.in_flight[key] -= 1
+        if not self.in_flight[key]:
+            del self.in_flight[key]
+
+    def _ensure_health_task(self) -> None:
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop())
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            checks = await asyncio.get_running_loop().run_in_executor(None, self.supervisor.health_targets)
+            results = await asyncio.gather(*[self._check(i[1], i[2]) for i in checks])
+            alive = set()
+            for (app_name, port, _), healthy in zip(checks, results):
+                alive.add((app_name, port))
+                if healthy:
+                    self.unhealthy.discard((app_name, port))
+                else:
+                    self.unhealthy.add((app_name, port))
+            self.unhealthy &= alive
+
+    async def _check(self, port: int, health_path: Optional[str]) -> bool:
+        try:
+            if health_path:
+                response = await self.client.get(f"http://127.0.0.1:{port}/{health_path.lstrip('/')}", timeout=2.0)
+                return response.status_code < 500
+            _, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), 2.0)
+            writer.close()
+            return True
+        except (OSError, asyncio.TimeoutError, httpx.HTTPError):
+            return False
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,719 @@
+"""
+Runtime state shared by all worker processes of the daemon, kept in a local SQLite database.
+
+App processes belong to the daemon worker that started them (the ``owner``). Other workers see them here and can
+ask for a stop, the owner notices the exit and records it. Processes are recorded with their pid and start identity,
+a pid read back from the database is only signalled while it still belongs to the recorded process.
+"""
+
+import json
+import os
+import signal
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pools (
+    app_name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    restart TEXT NOT NULL,
+    limits TEXT NOT NULL,
+    health_path TEXT,
+    fork_server INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS workers (
+    app_name TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    port INTEGER NOT NULL UNIQUE,
+    pid INTEGER,
+    pid_start TEXT,
+    owner INTEGER,
+    state TEXT NOT NULL,
+    args TEXT,
+    started REAL,
+    exit_code INTEGER,
+    restarts INTEGER NOT NULL DEFAULT 0,
+    stop_requested INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (app_name, idx)
+);
+CREATE INDEX IF NOT EXISTS workers_pid ON workers (pid);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    app_name TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    pid INTEGER,
+    port INTEGER,
+    args TEXT,
+    started REAL,
+    finished REAL,
+    exit_code INTEGER,
+    restarts INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_app ON runs (app_name, id);
+CREATE TABLE IF NOT EXISTS install_jobs (
+    job_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    owner INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queue_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    app_name TEXT NOT NULL,
+    args TEXT NOT NULL,
+    nc_url TEXT NOT NULL,
+    user_token TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    timeout REAL,
+    schedule_id INTEGER,
+    state TEXT NOT NULL,
+    not_before REAL NOT NULL,
+    created REAL NOT NULL,
+    owner INTEGER,
+    pid INTEGER,
+    pid_start TEXT,
+    started REAL,
+    finished REAL,
+    exit_code INTEGER,
+    error TEXT,
+    output TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS queue_jobs_state ON queue_jobs (state, app_name, priority, id);
+CREATE TABLE IF NOT EXISTS schedules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    app_name TEXT NOT NULL,
+    args TEXT NOT NULL,
+    nc_url TEXT NOT NULL,
+    user_token TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    timeout REAL,
+    cron TEXT NOT NULL,
+    next_run REAL NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+BUSY_STATES = ("starting", "running", "restarting")
+WORKER_FIELDS = "app_name, idx, port, pid, owner, state, args, started, exit_code, restarts"
+RUN_FIELDS = "app_name, idx, pid, port, args, started, finished, exit_code, restarts"
+QUEUE_ACTIVE_STATES = ("queued", "running")
+QUEUE_JOB_FIELDS = (
+    "id, app_name, args, priority, timeout, schedule_id, state, not_before, created, owner, pid, started, finished,"
+    " exit_code, error, cancel_requested"
+)
+SCHEDULE_FIELDS = "id, app_name, args, priority, timeout, cron, next_run, created"
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+
+def _in(values: Sequence) -> str:
+    """Placeholders of an ``IN`` list for ``values``."""
+    return f"({', '.join('?' * len(values))})"
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def process_start(pid: int) -> Optional[str]:
+    """Identity of the running process with the pid: the boot id and the start time of the process, so a pid reused
+    after the process exited or after a reboot does not match. None if the process is gone or /proc is missing."""
+    try:
+        with open(BOOT_ID_PATH, "r", encoding="utf8") as fp:
+            boot_id = fp.read().strip()
+        with open(f"/proc/{pid}/stat", "r", encoding="utf8") as fp:
+            # the start time is the 22nd field, the 2nd (the command name in parentheses) may contain spaces
+            start_time = fp.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+    return f"{boot_id}:{start_time}"
+
+
+def kill_process(pid: int, start: Optional[str]) -> bool:
+    """Kills the process if the pid still belongs to the process with the ``start`` identity, an unknown identity
+    kills nothing. Returns whether the process was signalled."""
+    if not start or process_start(pid) != start:
+        return False
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except OSError:
+        return False
+    return True
+
+
+def _worker_dict(row: tuple) -> dict:
+    app_name, idx, port, pid, owner, state, args, started, exit_code, restarts = row
+    return {
+        "index": idx,
+        "pid": pid,
+        "port": port,
+        "owner": owner,
+        "state": state,
+        "alive": state == "running",
+        "args": json.loads(args) if args else None,
+        "started": started,
+        "exit_code": exit_code,
+        "restarts": restarts,
+    }
+
+
+def _run_dict(row: tuple) -> dict:
+    app_name, idx, pid, port, args, started, finished, exit_code, restarts = row
+    return {
+        "app_name": app_name,
+        "index": idx,
+        "pid": pid,
+        "port": port,
+        "args": json.loads(args) if args else None,
+        "started": started,
+        "finished": finished,
+        "exit_code": exit_code,
+        "restarts": restarts,
+    }
+
+
+def _queue_job_dict(row: tuple, output: Optional[str] = None) -> dict:
+    job_id, app_name, args, priority, timeout, schedule_id, state, not_before, created, owner, pid, started = row[:12]
+    finished, exit_code, error, cancel_requested = row[12:16]
+    job = {
+        "job_id": job_id,
+        "app_name": app_name,
+        "args": json.loads(args),
+        "priority": priority,
+        "timeout": timeout,
+        "schedule_id": schedule_id,
+        "state": state,
+        "not_before": not_before,
+        "created": created,
+        "owner": owner,
+        "pid": pid,
+        "started": started,
+        "finished": finished,
+        "exit_code": exit_code,
+        "error": error or "",
+        "cancel_requested": bool(cancel_requested),
+    }
+    if output is not None:
+        job["output"] = output
+    return job
+
+
+def _schedule_dict(row: tuple) -> dict:
+    schedule_id, app_name, args, priority, timeout, cron, next_run, created = row
+    return {
+        "schedule_id": schedule_id,
+        "app_name": app_name,
+        "args": json.loads(args),
+        "priority": priority,
+        "timeout": timeout,
+        "cron": cron,
+        "next_run": next_run,
+        "created": created,
+    }
+
+
+class SharedState:
+    """Pools, their worker slots, finished runs, install jobs, the job queue and its schedules of all daemon workers.
+
+    Every thread gets its own connection, writes that must not interleave run in ``BEGIN IMMEDIATE`` transactions.
+    """
+
+    def __init__(self, db_path: str, history_size: int = 1000, jobs_history_size: int = 100):
+        self.db_path = db_path
+        self.history_size = history_size
+        self.jobs_history_size = jobs_history_size
+        self.owner = os.getpid()
+        self._local = threading.local()
+        # tokens of queued jobs and schedules are kept here, SQLite creates the -wal and -shm files with the same mode
+        os.close(os.open(db_path, os.O_RDONLY | os.O_CREAT, 0o600))
+        for file_path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+            if os.path.exists(file_path):
+                os.chmod(file_path, 0o600)
+        self.db.executescript(SCHEMA)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.db_path, timeout=10.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def reap_lost(self) -> None:
+        """Marks workers of daemon processes that are gone as exited, killing what they left running if it is still
+        the recorded process.
+
+        Called before this process starts any worker, so rows that name it as the owner are left from a previous
+        process with the same pid.
+        """
+        with self.transaction() as db:
+            rows = db.execute(
+                f"SELECT app_name, idx, pid, pid_start, owner FROM workers WHERE state IN {_in(BUSY_STATES)}",
+                BUSY_STATES,
+            ).fetchall()
+            for app_name, idx, pid, pid_start, owner in rows:
+                if owner != self.owner and _process_exists(owner):
+                    continue
+                if pid:
+                    kill_process(pid, pid_start)
+                db.execute("UPDATE workers SET state = 'exited' WHERE app_name = ? AND idx = ?", (app_name, idx))
+
+    def claim_workers(self, app_name: str, pool: dict, port_range: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """Saves the pool settings and claims free worker slots up to the pool size for this process.
+
+        Returns index and port of every claimed slot. Raises ValueError if the pool is full or ports ran out.
+        """
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO pools (app_name, size, restart, limits, health_path, fork_server)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    app_name,
+                    pool["size"],
+                    pool["restart"],
+                    json.dumps(pool["limits"]),
+                    pool["health_path"],
+                    int(pool["fork_server"]),
+                ),
+            )
+            slots = db.execute("SELECT idx, port, state FROM workers WHERE app_name = ?", (app_name,)).fetchall()
+            busy = len([i for i in slots if i[2] in BUSY_STATES])
+            if busy >= pool["size"]:
+                raise ValueError(f"all {pool['size']} workers of the app are already running")
+            claimed = [(i[0], i[1]) for i in sorted(slots) if i[2] not in BUSY_STATES][: pool["size"] - busy]
+            used_ports = {i[0] for i in db.execute("SELECT port FROM workers")}
+            next_index = max((i[0] for i in slots), default=-1) + 1
+            free_ports = (i for i in range(port_range[0], port_range[1] + 1) if i not in used_ports)
+            while len(claimed) < pool["size"] - busy:
+                port = next(free_ports, None)
+                if port is None:
+                    raise ValueError("no free ports left for app workers")
+                db.execute(
+                    "INSERT INTO workers (app_name, idx, port, state) VALUES (?, ?, ?, 'exited')",
+                    (app_name, next_index, port),
+                )
+                claimed.append((next_index, port))
+                next_index += 1
+            db.executemany(
+                "UPDATE workers SET state = 'starting', owner = ?, pid = NULL, pid_start = NULL, exit_code = NULL,"
+                " restarts = 0, stop_requested = 0 WHERE app_name = ? AND idx = ?",
+                [(self.owner, app_name, i[0]) for i in claimed],
+            )
+        return claimed
+
+    def worker_started(self, app_name: str, index: int, worker: dict) -> None:
+        self.db.execute(
+            "UPDATE workers SET state = 'running', pid = ?, pid_start = ?, args = ?, started = ?, exit_code = NULL,"
+            " restarts = ? WHERE app_name = ? AND idx = ? AND owner = ?",
+            (
+                worker["pid"],
+                process_start(worker["pid"]),
+                json.dumps(worker["args"]),
+                worker["started"],
+                worker["restarts"],
+                app_name,
+                index,
+                self.owner,
+            ),
+        )
+
+    def worker_exited(self, app_name: str, index: int, worker: dict, restart: bool, stopped: bool) -> bool:
+        """Records the finished run. Returns whether the worker should be restarted: ``restart`` unless another
+        daemon process asked for a stop or removed the pool."""
+        finished = time.time()
+        with self.transaction() as db:
+            row = db.execute(
+                "SELECT stop_requested FROM workers WHERE app_name = ? AND idx = ? AND owner = ?",
+                (app_name, index, self.owner),
+            ).fetchone()
+            restart = restart and row is not None and not row[0]
+            state = "restarting" if restart else ("stopped" if stopped or row is None or row[0] else "exited")
+            db.execute(
+                "UPDATE workers SET state = ?, exit_code = ? WHERE app_name = ? AND idx = ? AND owner = ?",
+                (state, worker["exit_code"], app_name, index, self.owner),
+            )
+            cursor = db.execute(
+                f"INSERT INTO runs ({RUN_FIELDS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    app_name,
+                    index,
+                    worker["pid"],
+                    worker["port"],
+                    json.dumps(worker["args"]),
+                    worker["started"],
+                    finished,
+                    worker["exit_code"],
+                    worker["restarts"],
+                ),
+            )
+            db.execute("DELETE FROM runs WHERE id <= ?", (cursor.lastrowid - self.history_size,))
+        return restart
+
+    def claim_restart(self, app_name: str, index: int) -> bool:
+        """Returns False if the worker was stopped or its pool removed while it was waiting for a restart."""
+        with self.transaction() as db:
+            cursor = db.execute(
+                "UPDATE workers SET state = 'starting' WHERE app_name = ? AND idx = ? AND owner = ?"
+                " AND state = 'restarting' AND stop_requested = 0",
+                (app_name, index, self.owner),
+            )
+            return cursor.rowcount == 1
+
+    def set_worker_state(self, app_name: str, index: int, state: str) -> None:
+        self.db.execute(
+            "UPDATE workers SET state = ? WHERE app_name = ? AND idx = ? AND owner = ?",
+            (state, app_name, index, self.owner),
+        )
+
+    def request_stop(self, pid: int) -> Optional[Tuple[str, int, int, str, Optional[str]]]:
+        """Flags the worker with the pid for a stop, returns its app name, index, owner, state and process identity."""
+        with self.transaction() as db:
+            row = db.execute(
+                "SELECT app_name, idx, owner, state, pid_start FROM workers WHERE pid = ?"
+                f" AND state IN {_in(BUSY_STATES)}",
+                (pid, *BUSY_STATES),
+            ).fetchone()
+            if row is not None:
+                db.execute("UPDATE workers SET stop_requested = 1 WHERE app_name = ? AND idx = ?", row[:2])
+        return row
+
+    def remove_pool(self, app_name: str) -> List[Tuple[int, int, Optional[str]]]:
+        """Forgets the pool and its slots, returns pid, owner and process identity of its running workers."""
+        with self.transaction() as db:
+            running = db.execute(
+                "SELECT pid, owner, pid_start FROM workers WHERE app_name = ? AND state = 'running'", (app_name,)
+            ).fetchall()
+            db.execute("DELETE FROM workers WHERE app_name = ?", (app_name,))
+            db.execute("DELETE FROM pools WHERE app_name = ?", (app_name,))
+        return running
+
+    def alive_ports(self, app_name: str) -> List[int]:
+        return [
+            i[0]
+            for i in self.db.execute(
+                "SELECT port FROM workers WHERE app_name = ? AND state = 'running'", (app_name,)
+            ).fetchall()
+        ]
+
+    def health_targets(self) -> List[Tuple[str, int, Optional[str]]]:
+        return self.db.execute(
+            "SELECT w.app_name, w.port, p.health_path FROM workers w JOIN pools p ON p.app_name = w.app_name"
+            " WHERE w.state = 'running'"
+        ).fetchall()
+
+    def pools_status(self, app_name: str = "", state: str = "") -> Dict[str, dict]:
+        db = self.db
+        where, params = (" WHERE app_name = ?", (app_name,)) if app_name else ("", ())
+        statuses = {}
+        for name, size, restart, limits, health_path, fork_server in db.execute(
+            f"SELECT app_name, size, restart, limits, health_path, fork_server FROM pools{where}", params
+        ):
+            statuses[name] = {
+                "size": size,
+                "restart": restart,
+                "limits": json.loads(limits),
+                "health_check": health_path,
+                "fork_server": bool(fork_server),
+                "workers": [],
+            }
+        for row in db.execute(f"SELECT {WORKER_FIELDS} FROM workers{where} ORDER BY app_name, idx", params):
+            if row[0] in statuses and (not state or row[5] == state):
+                statuses[row[0]]["workers"].append(_worker_dict(row))
+        return statuses
+
+    def runs(self, app_name: str = "", offset: int = 0, limit: int = 100) -> Tuple[int, List[dict]]:
+        where, params = (" WHERE app_name = ?", (app_name,)) if app_name else ("", ())
+        db = self.db
+        total = db.execute(f"SELECT COUNT(*) FROM runs{where}", params).fetchone()[0]
+        rows = db.execute(
+            f"SELECT {RUN_FIELDS} FROM runs{where} ORDER BY id DESC LIMIT ? OFFSET ?", (*params, limit, offset)
+        ).fetchall()
+        return total, [_run_dict(i) for i in rows]
+
+    def save_job(self, job: dict) -> None:
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO install_jobs (job_id, data, created) VALUES (?, ?, ?)",
+                (job["job_id"], json.dumps(job), job["created"]),
+            )
+            db.execute(
+                "DELETE FROM install_jobs WHERE job_id NOT IN"
+                " (SELECT job_id FROM install_jobs ORDER BY created DESC LIMIT ?)",
+                (self.jobs_history_size,),
+            )
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        row = self.db.execute("SELECT data FROM install_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def worker_stats(self) -> List[Tuple[str, str, int, int]]:
+        """Returns app name, state, number of workers and their restarts for every app and worker state."""
+        return self.db.execute(
+            "SELECT app_name, state, COUNT(*), SUM(restarts) FROM workers GROUP BY app_name, state"
+        ).fetchall()
+
+    def save_metrics(self, snapshot: dict) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO metrics (owner, data) VALUES (?, ?)", (self.owner, json.dumps(snapshot))
+        )
+
+    def other_metrics(self) -> List[dict]:
+        """Metric snapshots saved by the other daemon processes, forgets the ones of processes that are gone."""
+        snapshots = []
+        rows = self.db.execute("SELECT owner, data FROM metrics WHERE owner != ?", (self.owner,)).fetchall()
+        for owner, data in rows:
+            if _process_exists(owner):
+                snapshots.append(json.loads(data))
+            else:
+                self.db.execute("DELETE FROM metrics WHERE owner = ?", (owner,))
+        return snapshots
+
+    def queue_submit(self, job: dict, not_before: float, schedule_id: Optional[int] = None) -> int:
+        """Adds a job to the queue, ``job`` has the fields of a job submitted to ``POST /jobs``."""
+        cursor = self.db.execute(
+            "INSERT INTO queue_jobs (app_name, args, nc_url, user_token, priority, timeout, schedule_id, state,"
+            " not_before, created) VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (
+                job["app_name"],
+                json.dumps(job["args"]),
+                job["nc_url"],
+                job["user_token"],
+                job["priority"],
+                job["timeout"],
+                schedule_id,
+                not_before,
+                time.time(),
+            ),
+        )
+        return cursor.lastrowid  # type: ignore[return-value]
+
+    def queue_job(self, job_id: int) -> Optional[dict]:
+        """The job with its retained output, without its credentials."""
+        row = self.db.execute(f"SELECT {QUEUE_JOB_FIELDS}, output FROM queue_jobs WHERE id = ?", (job_id,)).fetchone()
+        return _queue_job_dict(row[:-1], row[-1] or "") if row else None
+
+    def queue_jobs(
+        self, app_name: str = "", state: str = "", offset: int = 0, limit: int = 100
+    ) -> Tuple[int, List[dict]]:
+        """Returns the number of matching jobs and a page of them without output, latest first."""
+        conditions = [i for i, v in (("app_name = ?", app_name), ("state = ?", state)) if v]
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        params = tuple(i for i in (app_name, state) if i)
+        db = self.db
+        total = db.execute(f"SELECT COUNT(*) FROM queue_jobs{where}", params).fetchone()[0]
+        rows = db.execute(
+            f"SELECT {QUEUE_JOB_FIELDS} FROM queue_jobs{where} ORDER BY id DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        ).fetchall()
+        return total, [_queue_job_dict(i) for i in rows]
+
+    def queue_counts(self) -> Dict[Tuple[str, str], int]:
+        """Queued and running jobs by app and state."""
+        rows = self.db.execute(
+            f"SELECT app_name, state, COUNT(*) FROM queue_jobs WHERE state IN {_in(QUEUE_ACTIVE_STATES)}"
+            " GROUP BY app_name, state",
+            QUEUE_ACTIVE_STATES,
+        ).fetchall()
+        return {(app_name, state): count for app_name, state, count in rows}
+
+    def queue_cancel(self, job_id: int) -> Optional[str]:
+        """Cancels a queued job or flags a running one for its owner to stop. Returns the state the job was in."""
+        with self.transaction() as db:
+            row = db.execute("SELECT state FROM queue_jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == "queued":
+                db.execute(
+                    "UPDATE queue_jobs SET state = 'cancelled', finished = ?, user_token = '' WHERE id = ?",
+                    (time.time(), job_id),
+                )
+            elif row[0] == "running":
+                db.execute("UPDATE queue_jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        return row[0]
+
+    def queue_claim(self, app_limit: Callable[[str], int], count: int) -> List[dict]:
+        """Claims up to ``count`` due jobs for this process, highest priority first, keeping the running jobs of every
+        app within ``app_limit(app_name)`` over all processes. Returns them with their credentials."""
+        now = time.time()
+        with self.transaction() as db:
+            running = dict(
+                db.execute("SELECT app_name, COUNT(*) FROM queue_jobs WHERE state = 'running' GROUP BY app_name")
+            )
+            # the first `count` due jobs of every app, so apps at their limit do not hide the jobs of the others
+            rows = db.execute(
+                "SELECT id, app_name FROM (SELECT id, app_name, priority, ROW_NUMBER() OVER"
+                " (PARTITION BY app_name ORDER BY priority DESC, id) AS n FROM queue_jobs"
+                " WHERE state = 'queued' AND not_before <= ?) WHERE n <= ? ORDER BY priority DESC, id",
+                (now, count),
+            ).fetchall()
+            claimed = []
+            limits: Dict[str, int] = {}
+            for job_id, app_name in rows:
+                if len(claimed) >= count:
+                    break
+                if app_name not in limits:
+                    limits[app_name] = app_limit(app_name)
+                if running.get(app_name, 0) >= limits[app_name]:
+                    continue
+                running[app_name] = running.get(app_name, 0) + 1
+                claimed.append(job_id)
+            db.executemany(
+                "UPDATE queue_jobs SET state = 'running', owner = ?, started = ? WHERE id = ?",
+                [(self.owner, now, i) for i in claimed],
+            )
+            if not claimed:
+                return []
+            rows = db.execute(
+                f"SELECT {QUEUE_JOB_FIELDS}, nc_url, user_token FROM queue_jobs WHERE id IN {_in(claimed)}"
+                " ORDER BY priority DESC, id",
+                claimed,
+            ).fetchall()
+        jobs = []
+        for row in rows:
+            job = _queue_job_dict(row[:-2])
+            job["nc_url"], job["user_token"] = row[-2:]
+            jobs.append(job)
+        return jobs
+
+    def queue_started(self, job_id: int, pid: int) -> None:
+        self.db.execute(
+            "UPDATE queue_jobs SET pid = ?, pid_start = ? WHERE id = ? AND owner = ?",
+            (pid, process_start(pid), job_id, self.owner),
+        )
+
+    def queue_finished(self, job_id: int, state: str, exit_code: Optional[int], error: str, output: str) -> None:
+        self.db.execute(
+            "UPDATE queue_jobs SET state = ?, finished = ?, exit_code = ?, error = ?, output = ?, user_token = ''"
+            " WHERE id = ? AND owner = ?",
+            (state, time.time(), exit_code, error, output, job_id, self.owner),
+        )
+
+    def queue_cancel_requests(self) -> List[int]:
+        """Running jobs of this process that were asked to stop."""
+        return [
+            i[0]
+            for i in self.db.execute(
+                "SELECT id FROM queue_jobs WHERE state = 'running' AND owner = ? AND cancel_requested = 1",
+                (self.owner,),
+            ).fetchall()
+        ]
+
+    def queue_reap_lost(self, own: bool) -> int:
+        """Fails running jobs of daemon processes that are gone, killing what they left running if it is still the
+        recorded process. With ``own``, jobs that name this process as the owner are left from a previous process with
+        the same pid."""
+        with self.transaction() as db:
+            rows = db.execute("SELECT id, owner, pid, pid_start FROM queue_jobs WHERE state = 'running'").fetchall()
+            lost = []
+            for job_id, owner, pid, pid_start in rows:
+                if (owner == self.owner and not own) or (owner != self.owner and _process_exists(owner)):
+                    continue
+                if pid:
+                    kill_process(pid, pid_start)
+                lost.append((time.time(), job_id))
+            db.executemany(
+                "UPDATE queue_jobs SET state = 'failed', finished = ?, error = 'daemon process exited', user_token = ''"
+                " WHERE id = ?",
+                lost,
+            )
+        return len(lost)
+
+    def queue_trim(self, retention: float, keep: int) -> int:
+        """Forgets finished jobs older than ``retention`` seconds and all but the latest ``keep`` of them."""
+        with self.transaction() as db:
+            cursor = db.execute(
+                f"DELETE FROM queue_jobs WHERE state NOT IN {_in(QUEUE_ACTIVE_STATES)} AND (finished < ? OR id IN"
+                f" (SELECT id FROM queue_jobs WHERE state NOT IN {_in(QUEUE_ACTIVE_STATES)} ORDER BY id DESC"
+                " LIMIT -1 OFFSET ?))",
+                (*QUEUE_ACTIVE_STATES, time.time() - retention, *QUEUE_ACTIVE_STATES, keep),
+            )
+        return cursor.rowcount
+
+    def queue_remove_app(self, app_name: str) -> None:
+        """Cancels the queued jobs and the schedules of the app, its running jobs are asked to stop."""
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE queue_jobs SET state = 'cancelled', finished = ?, user_token = '' WHERE app_name = ?"
+                " AND state = 'queued'",
+                (time.time(), app_name),
+            )
+            db.execute(
+                "UPDATE queue_jobs SET cancel_requested = 1 WHERE app_name = ? AND state = 'running'", (app_name,)
+            )
+            db.execute("DELETE FROM schedules WHERE app_name = ?", (app_name,))
+
+    def schedule_add(self, job: dict, cron: str, next_run: float) -> int:
+        cursor = self.db.execute(
+            "INSERT INTO schedules (app_name, args, nc_url, user_token, priority, timeout, cron, next_run, created)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job["app_name"],
+                json.dumps(job["args"]),
+                job["nc_url"],
+                job["user_token"],
+                job["priority"],
+                job["timeout"],
+                cron,
+                next_run,
+                time.time(),
+            ),
+        )
+        return cursor.lastrowid  # type: ignore[return-value]
+
+    def schedule_remove(self, schedule_id: int) -> bool:
+        return self.db.execute("DELETE FROM schedules WHERE id = ?", (schedule_id,)).rowcount == 1
+
+    def schedules(self, app_name: str = "") -> List[dict]:
+        where, params = (" WHERE app_name = ?", (app_name,)) if app_name else ("", ())
+        rows = self.db.execute(f"SELECT {SCHEDULE_FIELDS} FROM schedules{where} ORDER BY id", params).fetchall()
+        return [_schedule_dict(i) for i in rows]
+
+    def schedules_due(self, next_run: Callable[[str, float], float]) -> int:
+        """Queues a job for every schedule that is due, unless its previous job is still queued or running, and moves
+        the schedule to ``next_run(cron, now)``. Returns the number of queued jobs."""
+        now = time.time()
+        queued = 0
+        with self.transaction() as db:
+            rows = db.execute(
+                "SELECT id, app_name, args, nc_url, user_token, priority, timeout, cron FROM schedules"
+                " WHERE next_run <= ?",
+                (now,),
+            ).fetchall()
+            for schedule_id, app_name, args, nc_url, user_token, priority, timeout, cron in rows:
+                active = db.execute(
+                    f"SELECT 1 FROM queue_jobs WHERE schedule_id = ? AND state IN {_in(QUEUE_ACTIVE_STATES)} LIMIT 1",
+                    (schedule_id, *QUEUE_ACTIVE_STATES),
+                ).fetchone()
+                if active is None:
+                    db.execute(
+                        "INSERT INTO queue_jobs (app_name, args, nc_url, user_token, priority, timeout, schedule_id,"
+                        " state, not_before, created) VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+                        (app_name, args, nc_url, user_token, priority, timeout, schedule_id, now, now),
+                    )
+                    queued += 1
+                db.execute("UPDATE schedules SET next_run = ? WHERE id = ?", (next_run(cron, now), schedule_id))
+        return queued
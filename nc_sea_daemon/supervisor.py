@@ -0,0 +1,493 @@
+"""
+Supervision of app processes: pools of workers per app with ports, restarts with backoff and resource limits.
+"""
+
+import logging as log
+import os
+import selectors
+import threading
+import time
+from collections import deque
+from subprocess import PIPE, Popen
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from applogs import OutputCapture
+from forkserver import ForkedProcess, ForkServer
+from metrics import REGISTRY
+from state import SharedState, kill_process
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore
+
+LOG = log.getLogger()
+
+RESTART_POLICIES = ("never", "on-failure", "always")
+BACKOFF_INITIAL = 1.0
+BACKOFF_MAX = 60.0
+STABLE_UPTIME = 30.0
+STREAMS = ("stdout", "stderr")
+
+SPAWN_SECONDS = REGISTRY.histogram(
+    "nc_sea_daemon_spawn_duration_seconds", "Time to start an app process.", ["app", "mode"]
+)
+SPAWN_FAILURES = REGISTRY.counter(
+    "nc_sea_daemon_spawn_failures_total", "App processes that could not be started.", ["app", "mode"]
+)
+
+
+class Worker:
+    def __init__(self, index: int, port: int):
+        self.index = index
+        self.port = port
+        # command, environment and folder of the start of the worker, its restarts use them again
+        self.cmd: List[str] = []
+        self.env: Dict[str, str] = {}
+        self.cwd = ""
+        self.process: Optional[Union[Popen, ForkedProcess]] = None
+        self.started: Optional[float] = None
+        self.exit_code: Optional[int] = None
+        self.restarts = 0
+        self.backoff = BACKOFF_INITIAL
+        self.next_start: Optional[float] = None
+        self.stopped = False
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.exit_code is None
+
+    @property
+    def state(self) -> str:
+        if self.alive:
+            return "running"
+        if self.next_start is not None:
+            return "restarting"
+        return "stopped" if self.stopped else "exited"
+
+    def to_dict(self) -> dict:
+        return {
+            "index": self.index,
+            "pid": self.pid,
+            "port": self.port,
+            "state": self.state,
+            "alive": self.alive,
+            "args": self.process.args if self.process else None,
+            "started": self.started,
+            "exit_code": self.exit_code,
+            "restarts": self.restarts,
+        }
+
+
+class AppPool:
+    def __init__(
+        self, app_name: str, cmd: List[str], env: Dict[str, str], cwd: str, size: int, restart: str, limits: dict
+    ):
+        self.app_name = app_name
+        self.cmd = cmd
+        self.env = env  # of the fork server, workers run with the environment of their start
+        self.cwd = cwd
+        self.size = size
+        self.restart = restart
+        self.limits = limits
+        self.health_path: Optional[str] = None
+        self.fork_server: Optional[ForkServer] = None
+        self.workers: List[Worker] = []
+
+    def to_dict(self) -> dict:
+        return {
+            "size": self.size,
+            "restart": self.restart,
+            "limits": self.limits,
+            "fork_server": self.fork_server is not None,
+            "workers": [i.to_dict() for i in self.workers],
+        }
+
+
+def resource_limits(limits: dict) -> List[Tuple[int, int]]:
+    """Resource limits and their values for the ``limits`` of an app, invalid ones are logged and skipped. Values above
+    the hard limit of the daemon, which app processes inherit, are lowered to it."""
+    if not limits:
+        return []
+    if resource is None:
+        LOG.warning("resource limits are not supported on this platform")
+        return []
+    rlimits = {
+        "memory_mb": (resource.RLIMIT_AS, 1024 * 1024),
+        "cpu_seconds": (resource.RLIMIT_CPU, 1),
+        "nofile": (resource.RLIMIT_NOFILE, 1),
+    }
+    result = []
+    for key, value in limits.items():
+        if key not in rlimits:
+            LOG.warning("unknown resource limit: %s", key)
+            continue
+        rlimit, multiplier = rlimits[key]
+        try:
+            value = int(value) * multiplier
+        except (TypeError, ValueError):
+            LOG.warning("invalid resource limit %s: %r", key, value)
+            continue
+        hard = resource.getrlimit(rlimit)[1]
+        if hard != resource.RLIM_INFINITY and value > hard:
+            LOG.warning("resource limit %s is above the hard limit of %s", key, hard)
+            value = hard
+        result.append((rlimit, value))
+    return result
+
+
+def limits_preexec(limits: dict) -> Optional[Callable[[], None]]:
+    """``preexec_fn`` for `Popen` setting resource limits in the child before it executes the app, so the app never
+    runs without them. Values are computed here, the child only makes the system calls."""
+    rlimits = resource_limits(limits)
+    if not rlimits:
+        return None
+
+    def preexec() -> None:
+        for rlimit, value in rlimits:
+            resource.setrlimit(rlimit, (value, value))
+
+    return preexec
+
+
+class Supervisor:
+    """Keeps pools of app processes, restarting exited workers according to the pool's restart policy.
+
+    Pool slots, ports and finished runs are kept in ``state`` shared by all daemon processes, each process supervises
+    the workers it started. Running workers are also indexed by pid locally. Exits are picked up from pidfds of the
+    processes (or from the fork server) by a monitor thread. ``check_interval`` is only used to poll processes on
+    platforms without ``os.pidfd_open``.
+
+    With ``capture``, stdout and stderr of workers go through pipes to the app's log instead of the daemon's own.
+    """
+
+    def __init__(
+        self,
+        port_range: Tuple[int, int],
+        state: SharedState,
+        check_interval: float = 0.5,
+        capture: Optional[OutputCapture] = None,
+    ):
+        self.port_range = port_range
+        self.state = state
+        self.check_interval = check_interval
+        self.capture = capture
+        self.pools: Dict[str, AppPool] = {}
+        self._by_pid: Dict[int, Tuple[AppPool, Worker]] = {}
+        self._pidfds: Dict[Worker, int] = {}
+        self._polled: Dict[Worker, AppPool] = {}
+        self._restarts: Dict[Worker, AppPool] = {}
+        self._exits: Deque[Tuple[AppPool, Worker, Union[Popen, ForkedProcess]]] = deque()
+        self._lock = threading.RLock()
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._monitor: Optional[threading.Thread] = None
+        self._shutdown = threading.Event()
+        self.state.reap_lost()
+
+    def start(
+        self,
+        app_name: str,
+        cmd: List[str],
+        env: Dict[str, str],
+        cwd: str,
+        size: int = 1,
+        restart: str = "never",
+        limits: Optional[dict] = None,
+        health_path: Optional[str] = None,
+        preload: Optional[List[str]] = None,
+        server_env: Optional[Dict[str, str]] = None,
+    ) -> List[Worker]:
+        """Starts workers of the app up to the pool size, returns the started ones.
+
+        With ``preload`` set, workers are forked from a fork server of the app that imported these modules once.
+        ``cmd`` is then the interpreter followed by the script (or ``-m module``) and its arguments. The server runs
+        with ``server_env``, ``env`` without the ``nc_*`` and ``nextcloud_url`` variables by default: preloaded modules
+        keep what they read of it for all runs, so it must not hold the credentials of one.
+
+        Raises ValueError if the pool is already full, OSError or TypeError if the process can not be started.
+        """
+        if restart not in RESTART_POLICIES:
+            raise ValueError(f"`restart` must be one of {RESTART_POLICIES}")
+        pool_settings = {
+            "size": size,
+            "restart": restart,
+            "limits": limits or {},
+            "health_path": health_path,
+            "fork_server": preload is not None,
+        }
+        if server_env is None:
+            server_env = {k: v for k, v in env.items() if not k.startswith("nc_") and k != "nextcloud_url"}
+        claimed = self.state.claim_workers(app_name, pool_settings, self.port_range)
+        with self._lock:
+            pool = self.pools.get(app_name, None)
+            if pool is None:
+                pool = self.pools[app_name] = AppPool(app_name, cmd, server_env, cwd, size, restart, limits or {})
+            else:
+                pool.cmd, pool.env, pool.cwd, pool.size, pool.restart = cmd, server_env, cwd, size, restart
+                pool.limits = limits or {}
+            pool.health_path = health_path
+            self._update_fork_server(pool, preload)
+            started: List[Worker] = []
+            try:
+                for index, port in claimed:
+                    worker = next((i for i in pool.workers if i.index == index), None)
+                    if worker is None:
+                        worker = Worker(index, port)
+                        pool.workers.append(worker)
+                    elif worker.alive and worker.process is not None:
+                        # killed by another daemon process, its exit was not handled yet
+                        self._on_exit(pool, worker, worker.process.wait())
+                    worker.port = port
+                    worker.cmd, worker.env, worker.cwd = cmd, env, cwd
+                    worker.restarts = 0
+                    worker.backoff = BACKOFF_INITIAL
+                    self._spawn(pool, worker)
+                    started.append(worker)
+            except BaseException:
+                for index, _ in claimed[len(started) :]:
+                    self.state.set_worker_state(app_name, index, "exited")
+                raise
+            self._ensure_monitor()
+        self._wakeup()
+        return started
+
+    def stop_pid(self, pid: int) -> bool:
+        with self._lock:
+            pool, worker = self._by_pid.get(pid, (None, None))
+            if worker is not None:
+                self._stop_worker(pool, worker)
+                return True
+        stopped = self.state.request_stop(pid)
+        if stopped is None:
+            return False
+        if stopped[3] == "running":
+            kill_process(pid, stopped[4])
+        return True
+
+    def remove(self, app_name: str) -> None:
+        running = self.state.remove_pool(app_name)
+        with self._lock:
+            pool = self.pools.pop(app_name, None)
+            if pool is not None:
+                for worker in pool.workers:
+                    self._stop_worker(pool, worker)
+                if pool.fork_server is not None:
+                    pool.fork_server.stop()
+        for pid, owner, pid_start in running:
+            if owner != self.state.owner:
+                kill_process(pid, pid_start)
+
+    def alive_ports(self, app_name: str) -> List[int]:
+        return self.state.alive_ports(app_name)
+
+    def health_targets(self) -> List[Tuple[str, int, Optional[str]]]:
+        """Returns app name, port and health check path of every running worker."""
+        return self.state.health_targets()
+
+    def status(self, app_name: str = "", state: str = "") -> Dict[str, dict]:
+        """Pools of all apps or of ``app_name`` only, with workers in ``state`` only if it is set."""
+        return self.state.pools_status(app_name, state)
+
+    def runs(self, app_name: str = "", offset: int = 0, limit: int = 100) -> Tuple[int, List[dict]]:
+        """Returns the number of finished runs of all apps or of ``app_name`` and a page of them, latest first."""
+        return self.state.runs(app_name, offset, limit)
+
+    def shutdown(self) -> None:
+        """Stops the workers of this process, pools stay configured for the other daemon processes."""
+        self._shutdown.set()
+        self._wakeup()
+        with self._lock:
+            for pool in self.pools.values():
+                for worker in pool.workers:
+                    self._stop_worker(pool, worker)
+                if pool.fork_server is not None:
+                    pool.fork_server.stop()
+
+    @staticmethod
+    def _update_fork_server(pool: AppPool, preload: Optional[List[str]]) -> None:
+        server = pool.fork_server
+        if server is not None and (preload != server.preload or pool.cmd[0] != server.executable):
+            server.stop()
+            pool.fork_server = server = None
+        if server is None and preload is not None:
+            pool.fork_server = ForkServer(pool.cmd[0], pool.cwd, pool.env, preload)
+
+    def _spawn(self, pool: AppPool, worker: Worker) -> None:
+        env = dict(worker.env)
+        env["app_port"] = str(worker.port)
+        env["app_worker"] = str(worker.index)
+        mode = "popen" if pool.fork_server is None else "fork"
+        started = time.perf_counter()
+        try:
+            if pool.fork_server is not None:
+                worker.process = self._fork(pool, worker, env)
+            elif self.capture is not None:
+                # pylint: disable=consider-using-with
+                worker.process = Popen(
+                    worker.cmd,
+                    env=env,
+                    cwd=worker.cwd,
+                    stdout=PIPE,
+                    stderr=PIPE,
+                    preexec_fn=limits_preexec(pool.limits),
+                )
+                self.capture.add(pool.app_name, worker.index, STREAMS[0], worker.process.stdout)  # type: ignore
+                self.capture.add(pool.app_name, worker.index, STREAMS[1], worker.process.stderr)  # type: ignore
+            else:
+                worker.process = Popen(worker.cmd, env=env, cwd=worker.cwd, preexec_fn=limits_preexec(pool.limits))
+                # pylint: enable=consider-using-with
+        except BaseException:
+            SPAWN_FAILURES.inc(pool.app_name, mode)
+            raise
+        SPAWN_SECONDS.observe(time.perf_counter() - started, pool.app_name, mode)
+        worker.started = time.time()
+        worker.exit_code = None
+        worker.next_start = None
+        worker.stopped = False
+        self._restarts.pop(worker, None)
+        self._by_pid[worker.process.pid] = (pool, worker)
+        self._watch(pool, worker, worker.process)
+        self.state.worker_started(pool.app_name, worker.index, worker.to_dict())
+
+    def _fork(self, pool: AppPool, worker: Worker, env: Dict[str, str]) -> ForkedProcess:
+        limits = resource_limits(pool.limits)
+        if self.capture is None:
+            return pool.fork_server.spawn(worker.cmd[1:], env, worker.cwd, limits=limits)  # type: ignore[union-attr]
+        paths, fds = self.capture.fifos(len(STREAMS))
+        try:
+            process = pool.fork_server.spawn(worker.cmd[1:], env, worker.cwd, paths, limits)  # type: ignore[union-attr]
+        except BaseException:
+            for fd in fds:
+                os.close(fd)
+            raise
+        finally:
+            for fifo_path in paths:
+                os.unlink(fifo_path)
+        for stream, fd in zip(STREAMS, fds):
+            self.capture.add(pool.app_name, worker.index, stream, fd)
+        return process
+
+    def _watch(self, pool: AppPool, worker: Worker, process: Union[Popen, ForkedProcess]) -> None:
+        if isinstance(process, ForkedProcess):
+            process.on_exit = lambda: self._notify_exit(pool, worker, process)
+            if process.poll() is not None:
+                self._notify_exit(pool, worker, process)
+            return
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except (AttributeError, OSError):
+            self._polled[worker] = pool
+            return
+        self._pidfds[worker] = pidfd
+        self._selector.register(pidfd, selectors.EVENT_READ, (pool, worker, process))
+
+    def _unwatch(self, worker: Worker) -> None:
+        self._polled.pop(worker, None)
+        pidfd = self._pidfds.pop(worker, None)
+        if pidfd is not None:
+            self._selector.unregister(pidfd)
+            os.close(pidfd)
+
+    def _notify_exit(self, pool: AppPool, worker: Worker, process: Union[Popen, ForkedProcess]) -> None:
+        """Called from other threads, the exit is handled by the monitor thread."""
+        self._exits.append((pool, worker, process))
+        self._wakeup()
+
+    def _wakeup(self) -> None:
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _stop_worker(self, pool: AppPool, worker: Worker) -> None:
+        restarting = worker.next_start is not None
+        worker.stopped = True
+        worker.next_start = None
+        self._restarts.pop(worker, None)
+        if worker.alive and worker.process is not None:
+            worker.process.kill()
+            self._on_exit(pool, worker, worker.process.wait())
+        elif restarting:
+            self.state.set_worker_state(pool.app_name, worker.index, "stopped")
+
+    def _collect(self, pool: AppPool, worker: Worker, process: Union[Popen, ForkedProcess]) -> None:
+        if worker.process is not process or worker.exit_code is not None:
+            return
+        exit_code = process.poll()
+        if exit_code is not None:
+            self._on_exit(pool, worker, exit_code)
+
+    def _on_exit(self, pool: AppPool, worker: Worker, exit_code: int) -> None:
+        now = time.time()
+        self._unwatch(worker)
+        self._by_pid.pop(worker.pid, None)  # type: ignore[arg-type]
+        worker.exit_code = exit_code
+        restart = not worker.stopped and self._should_restart(pool.restart, exit_code)
+        if not self.state.worker_exited(pool.app_name, worker.index, worker.to_dict(), restart, worker.stopped):
+            return
+        if worker.started is not None and now - worker.started > STABLE_UPTIME:
+            worker.backoff = BACKOFF_INITIAL
+        worker.next_start = now + worker.backoff
+        worker.backoff = min(worker.backoff * 2, BACKOFF_MAX)
+        self._restarts[worker] = pool
+        LOG.warning("%s worker %s exited with %s", pool.app_name, worker.index, exit_code)
+
+    def _restart_due(self) -> None:
+        now = time.time()
+        for worker, pool in list(self._restarts.items()):
+            if worker.next_start is None or worker.next_start > now:
+                continue
+            if not self.state.claim_restart(pool.app_name, worker.index):
+                del self._restarts[worker]
+                worker.next_start = None
+                continue
+            worker.restarts += 1
+            try:
+                self._spawn(pool, worker)
+            except (OSError, TypeError) as e:
+                LOG.error("can not restart %s worker %s: %s", pool.app_name, worker.index, e)
+                self.state.set_worker_state(pool.app_name, worker.index, "restarting")
+                worker.next_start = now + worker.backoff
+
+    def _next_timeout(self) -> Optional[float]:
+        timeouts = [i.next_start - time.time() for i in self._restarts if i.next_start is not None]
+        if self._polled:
+            timeouts.append(self.check_interval)
+        return max(min(timeouts), 0.0) if timeouts else None
+
+    @staticmethod
+    def _should_restart(policy: str, exit_code: int) -> bool:
+        return policy == "always" or (policy == "on-failure" and exit_code != 0)
+
+    def _ensure_monitor(self) -> None:
+        if self._monitor is None or not self._monitor.is_alive():
+            self._monitor = threading.Thread(target=self._monitor_loop, name="supervisor", daemon=True)
+            self._monitor.start()
+
+    def _monitor_loop(self) -> None:
+        while not self._shutdown.is_set():
+            with self._lock:
+                timeout = self._next_timeout()
+            events = self._selector.select(timeout)
+            with self._lock:
+                for key, _ in events:
+                    if key.fileobj == self._wakeup_r:
+                        try:
+                            os.read(self._wakeup_r, 4096)
+                        except BlockingIOError:
+                            pass
+                    else:
+                        self._collect(*key.data)
+                while self._exits:
+                    self._collect(*self._exits.popleft())
+                for worker, pool in list(self._polled.items()):
+                    self._collect(pool, worker, worker.process)  # type: ignore[arg-type]
+                self._restart_due()
@@ -0,0 +1,118 @@
+import io
+import sys
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from urllib.parse import quote
+
+import httpx
+import pytest
+
+DAEMON_PATH = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, DAEMON_PATH)
+sys.path.insert(0, path.join(DAEMON_PATH, "apps", "hello_world"))
+
+from nextcloud_sdk import AsyncNextcloud, Nextcloud  # noqa: E402 # pylint: disable=wrong-import-position
+
+NC_ARGS = {"nextcloud_url": "https://cloud.local", "nc_auth_user": "admin", "nc_auth_pass": "secret"}
+
+
+def ocs(data, status: str = "ok", statuscode: int = 100, message: str = "", headers=None) -> httpx.Response:
+    meta = {"status": status, "statuscode": statuscode, "message": message}
+    return httpx.Response(200, json={"ocs": {"meta": meta, "data": data}}, headers=headers)
+
+
+def multistatus(href: str, entries) -> bytes:
+    """Multistatus body of a PROPFIND at ``href``, entries are (relative path, is directory, etag, file id)."""
+    responses = []
+    for relative_path, is_dir, etag, fileid in entries:
+        entry_href = quote(f"{href.rstrip('/')}/{relative_path}".rstrip("/") + ("/" if is_dir else ""))
+        resource_type = "<d:collection/>" if is_dir else ""
+        responses.append(
+            f"<d:response><d:href>{entry_href}</d:href><d:propstat><d:prop>"
+            f"<d:resourcetype>{resource_type}</d:resourcetype><d:getetag>{etag}</d:getetag>"
+            f"<oc:fileid>{fileid}</oc:fileid></d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat>"
+            f"<d:propstat><d:prop><oc:size/></d:prop><d:status>HTTP/1.1 404 Not Found</d:status></d:propstat>"
+            "</d:response>"
+        )
+    return (
+        '<?xml version="1.0"?><d:multistatus xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">'
+        + "".join(responses)
+        + "</d:multistatus>"
+    ).encode()
+
+
+def mock_nextcloud(handler, **kwargs) -> Nextcloud:
+    """Nextcloud whose requests are answered by ``handler(httpx.Request) -> httpx.Response``."""
+    nc = Nextcloud(**{**NC_ARGS, **kwargs})
+    if "pool" not in kwargs:
+        nc.connection.adapter = httpx.Client(transport=httpx.MockTransport(handler))
+    return nc
+
+
+def mock_async_nextcloud(handler, **kwargs) -> AsyncNextcloud:
+    nc = AsyncNextcloud(**{**NC_ARGS, **kwargs})
+    if "pool" not in kwargs:
+        nc.connection.adapter = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return nc
+
+
+def make_tar(files: dict, top: str = "package") -> bytes:
+    """Gzipped tarball with ``files`` (name to bytes) under the folder ``top``, as packages are published."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(f"{top}/{name}")
+            info.size = len(content)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class StaticServer:
+    """HTTP server of ``routes`` (path to bytes), answering conditional requests for the ETag of the content."""
+
+    def __init__(self):
+        self.routes: dict = {}
+        self.requests: list = []
+        routes, requests = self.routes, self.requests
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # noqa: N802
+                requests.append((self.path, dict(self.headers)))
+                content = routes.get(self.path, None)
+                if content is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                etag = f'"{hash(content)}"'
+                if self.headers.get("If-None-Match", None) == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def static_server():
+    server = StaticServer()
+    yield server
+    server.close()
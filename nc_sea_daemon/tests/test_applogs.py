@@ -0,0 +1,75 @@
+import os
+import time
+
+from applogs import READ_SIZE, AppLogs, OutputCapture
+
+
+def _lines(count: int, start: int = 0, worker: int = 0) -> bytes:
+    return b"".join(f"1.000 {worker} stdout line {i}\n".encode() for i in range(start, start + count))
+
+
+def test_read_from_offsets(tmp_path):
+    logs = AppLogs(str(tmp_path))
+    assert logs.read("app") == (0, 0, [])
+    logs.write("app", _lines(3))
+    start, end, entries = logs.read("app")
+    assert start == 0 and end == logs.end("app")
+    assert [i["line"] for i in entries] == ["line 0", "line 1", "line 2"]
+    assert entries[1] == {
+        "offset": entries[1]["offset"],
+        "time": 1.0,
+        "worker": "0",
+        "stream": "stdout",
+        "line": "line 1",
+    }
+    _, next_end, more = logs.read("app", end)
+    assert more == [] and next_end == end
+    logs.write("app", _lines(1, 3))
+    assert [i["line"] for i in logs.read("app", end)[2]] == ["line 3"]
+
+
+def test_rotation_keeps_offsets(tmp_path):
+    logs = AppLogs(str(tmp_path), max_bytes=4 * READ_SIZE, segments=4)
+    chunk = _lines(4000)
+    for _ in range(8):
+        logs.write("app", chunk)
+    assert len(os.listdir(tmp_path / "app")) <= 5  # the segments and the lock
+    assert logs.end("app") == 8 * len(chunk)
+    start, _, entries = logs.read("app", 0)
+    assert start > 0 and entries[0]["offset"] == start
+    assert entries[0]["line"].startswith("line ")
+
+
+def test_tail_offset(tmp_path):
+    logs = AppLogs(str(tmp_path))
+    logs.write("app", _lines(10))
+    offset = logs.tail_offset("app", 3)
+    assert [i["line"] for i in logs.read("app", offset)[2]] == ["line 7", "line 8", "line 9"]
+    assert logs.tail_offset("app", 100) == 0
+    logs.remove("app")
+    assert logs.read("app") == (0, 0, [])
+
+
+def test_capture_pipes(tmp_path):
+    logs = AppLogs(str(tmp_path))
+    capture = OutputCapture(logs)
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    capture.add("app", 1, "stdout", out_r)
+    capture.add("app", 1, "stderr", err_r)
+    os.write(out_w, b"hello\nwor")
+    os.write(err_w, b"failed\n")
+    os.write(out_w, b"ld")
+    os.close(out_w)
+    os.close(err_w)
+    deadline = time.monotonic() + 5.0
+    while len(logs.read("app")[2]) < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    entries = logs.read("app")[2]
+    assert sorted((i["stream"], i["line"]) for i in entries) == [
+        ("stderr", "failed"),
+        ("stdout", "hello"),
+        ("stdout", "world"),
+    ]
+    assert {i["worker"] for i in entries} == {"1"}
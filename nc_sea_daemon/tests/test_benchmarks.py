@@ -0,0 +1,42 @@
+import io
+import json
+import sys
+import tarfile
+from os import path
+
+import httpx
+import pytest
+from conftest import DAEMON_PATH
+from nextcloud_sdk import Nextcloud
+
+sys.path.insert(0, path.join(DAEMON_PATH, "benchmarks"))
+
+from mock_nextcloud import MockNextcloud, Settings  # noqa: E402 # pylint: disable=wrong-import-position
+from stats import summarize  # noqa: E402 # pylint: disable=wrong-import-position
+
+
+def test_summarize():
+    summary = summarize([i / 1000 for i in range(100, 0, -1)])
+    assert summary == {"runs": 100, "median_ms": 50.5, "p95_ms": 96.0, "min_ms": 1.0}
+
+
+@pytest.fixture(scope="module")
+def mock_nextcloud():
+    with MockNextcloud(settings=Settings(users=25, entries=12, package_files=3, file_size=10)) as server:
+        yield server
+
+
+def test_mock_nextcloud_serves_the_sdk(mock_nextcloud):
+    nc = Nextcloud(nextcloud_url=mock_nextcloud.url, nc_auth_user="admin", nc_auth_pass="secret")
+    assert list(nc.users.iter_users(page_size=10)) == [f"user{i}" for i in range(25)]
+    nodes = list(nc.files.iter_files("admin", "entries-12"))
+    assert len(nodes) == 12 and sum(i.is_dir for i in nodes) == 2
+
+
+def test_mock_nextcloud_packages(mock_nextcloud):
+    url = f"{mock_nextcloud.url}/packages/app.tar.gz"
+    response = httpx.get(url)
+    with tarfile.open(fileobj=io.BytesIO(response.content)) as tar:
+        assert json.load(tar.extractfile("app/appinfo.json"))["entry_point"] == "sleep"
+        assert len(tar.getnames()) == 4
+    assert httpx.get(url, headers={"If-None-Match": response.headers["etag"]}).status_code == 304
@@ -0,0 +1,73 @@
+import datetime
+import json
+
+import pytest
+from codec import FastJSONResponse, dumps
+from conftest import mock_nextcloud, ocs
+
+from nextcloud_sdk import codec
+from nextcloud_sdk.exceptions import NextcloudException
+
+needs_msgspec = pytest.mark.skipif(codec.msgspec is None, reason="typed decoding requires msgspec")
+
+
+def _codec(name: str) -> codec.JsonCodec:
+    try:
+        return codec.get_codec(name)
+    except ValueError:
+        pytest.skip(f"{name} is not installed")
+
+
+@pytest.mark.parametrize("name", codec.PREFERENCE)
+def test_codecs_round_trip(name):
+    json_codec = _codec(name)
+    data = {"users": ["admin", "ünïcode"], "total": 2, "ratio": 0.5, "more": None}
+    assert json_codec.loads(json_codec.dumps(data)) == data
+    assert json_codec.loads(json_codec.dumps(data).decode()) == data
+
+
+def test_unknown_codec():
+    assert codec.get_codec().name == codec.PREFERENCE[0]
+    with pytest.raises(ValueError):
+        codec.get_codec("yaml")
+
+
+@pytest.mark.parametrize("name", codec.PREFERENCE)
+def test_ocs_responses_with_every_codec(name):
+    _codec(name)
+    nc = mock_nextcloud(lambda request: ocs({"id": "admin"}), json_codec=name)
+    assert nc.connection.codec.name == name
+    assert nc.users.get_user("admin") == {"id": "admin"}
+
+
+@needs_msgspec
+def test_typed_user_details():
+    details = {"id": "admin", "email": "a@b.c", "lastLogin": 1700000000, "quota": {"used": 10, "quota": "none"}}
+    nc = mock_nextcloud(lambda request: ocs(details))
+    user = nc.users.get_user("admin", typed=True)
+    assert isinstance(user, codec.UserDetails)
+    assert user.last_login == 1700000000 and user.quota.used == 10 and user.groups == []
+
+
+@needs_msgspec
+def test_typed_decoding_validates():
+    nc = mock_nextcloud(lambda request: ocs({"id": 1}))
+    with pytest.raises(codec.msgspec.ValidationError):
+        nc.users.get_user("admin", typed=True)
+
+
+@needs_msgspec
+def test_typed_decoding_of_failures():
+    nc = mock_nextcloud(lambda request: ocs([], status="failure", statuscode=404, message="User does not exist"))
+    with pytest.raises(NextcloudException) as e:
+        nc.users.get_user("missing", typed=True)
+    assert e.value.status_code == 404
+
+
+def test_daemon_replies():
+    moment = datetime.datetime(2024, 1, 2, 3, 4, 5)
+    assert json.loads(dumps({"at": moment, 1: "non str key"})) == {
+        "at": moment.isoformat(),
+        "1": "non str key",
+    }
+    assert FastJSONResponse({"status": "ok"}).body == b'{"status":"ok"}'
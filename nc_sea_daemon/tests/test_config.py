@@ -0,0 +1,60 @@
+import json
+import os
+
+import pytest
+from config import Config
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Config, "save_delay", 0.05)
+    monkeypatch.setattr(Config, "refresh_interval", 0.0)
+    config = Config()
+    yield config
+    config.flush()
+
+
+def _saved() -> dict:
+    with open(Config.config_name, encoding="utf8") as fp:
+        return json.load(fp)
+
+
+def test_defaults(config):
+    assert config.options["port"] == 8063
+    assert _saved()["options"]["host"] == "127.0.0.1"
+
+
+def test_changes_are_written_once(config, monkeypatch):
+    writes = []
+    replace = os.replace
+    monkeypatch.setattr("config.replace", lambda *args: (writes.append(args), replace(*args)))
+    for i in range(10):
+        config.set_option("counter", i)
+    assert config.options["counter"] == 9
+    assert "counter" not in _saved()["options"]
+    config.flush()
+    assert len(writes) == 1 and _saved()["options"]["counter"] == 9
+    config.flush()
+    assert len(writes) == 1
+
+
+def test_changes_of_other_processes_are_merged(config):
+    other = Config()
+    os.makedirs(os.path.join(Config.apps_folder, "app"))
+    with open(os.path.join(Config.apps_folder, "app", "appinfo.json"), "w", encoding="utf8") as fp:
+        fp.write("{}")
+    assert other.app_to_config("app")
+    other.flush()
+    config.set_option("mine", 1)
+    config.flush()
+    assert _saved()["apps"] == {"app": {}} and _saved()["options"]["mine"] == 1
+    os.utime(Config.config_name, ns=(0, 1))  # mtime differs from the last write of `config`
+    config.refresh()
+    assert "app" in config.apps
+
+
+def test_app_options(config):
+    config.set_option("key", "value", "missing")
+    config.flush()
+    assert _saved()["apps"] == {}
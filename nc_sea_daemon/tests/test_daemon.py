@@ -0,0 +1,61 @@
+import os
+import time
+
+import pytest
+from config import Config
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    """The daemon keeps its config, apps and state in the current folder, it runs in a folder of its own."""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("daemon"))
+    try:
+        import daemon  # pylint: disable=import-outside-toplevel
+
+        with TestClient(daemon.APP) as client:
+            client.auth = ("nextcloud", "")
+            yield client
+    finally:
+        os.chdir(cwd)
+
+
+def _set_xauth(value: str) -> None:
+    config = Config()
+    config.set_option("xauth", value)
+    config.flush()
+
+
+def _wait_for_auth(client, auth) -> None:
+    deadline = time.monotonic() + 5.0
+    while client.get("/app-install", params={"job_id": "x"}, auth=auth).status_code == 401:
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+
+
+def test_config_changes_of_other_processes(client):
+    _set_xauth("admin:secret")
+    try:
+        _wait_for_auth(client, ("admin", "secret"))
+        assert client.get("/app-install", params={"job_id": "x"}).status_code == 401
+    finally:
+        _set_xauth("nextcloud:")
+        _wait_for_auth(client, client.auth)
+
+
+def test_install_status_of_unknown_job(client):
+    reply = client.get("/app-install", params={"job_id": "x"}).json()
+    assert reply["status"] == "fail"
+
+
+def test_install_status_of_job_in_this_process(client, static_server):
+    job_id = client.post(
+        "/app-install",
+        params={"nc_url": "", "user_token": "", "app_name": "missing", "package_url": f"{static_server.url}/missing"},
+    ).json()["job_id"]
+    deadline = time.monotonic() + 10.0
+    while (job := client.get("/app-install", params={"job_id": job_id}).json()["job"])["state"] != "failed":
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert "404" in job["error"]
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+from forkserver import ForkedProcess, ForkServer
+
+SCRIPT = """
+import os, sys
+with open(os.environ["result"], "w") as fp:
+    fp.write(" ".join(sys.argv[1:]) + "|" + os.getcwd())
+sys.exit(int(sys.argv[1]))
+"""
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "app.py").write_text(SCRIPT)
+    server = ForkServer(sys.executable, str(tmp_path), dict(os.environ), ["json"])
+    yield server
+    server.stop()
+
+
+def test_spawn(server, tmp_path):
+    result = tmp_path / "result"
+    process = server.spawn(["app.py", "4", "x"], {"result": str(result)}, str(tmp_path))
+    assert process.wait(10.0) == 4
+    assert result.read_text() == f"4 x|{tmp_path}"
+    # the server is reused for the next run
+    pid = server.process.pid
+    assert server.spawn(["app.py", "0"], {"result": str(result)}, str(tmp_path)).wait(10.0) == 0
+    assert server.process.pid == pid
+
+
+def test_spawn_module(server, tmp_path):
+    result = tmp_path / "result"
+    process = server.spawn(["-m", "app", "2"], {"result": str(result)}, str(tmp_path))
+    assert process.wait(10.0) == 2
+    assert result.read_text().startswith("2|")
+
+
+def test_kill(server, tmp_path):
+    (tmp_path / "sleep.py").write_text("import time\ntime.sleep(60)\n")
+    process = server.spawn(["sleep.py"], {}, str(tmp_path))
+    exits = []
+    process.on_exit = lambda: exits.append(process.returncode)
+    process.kill()
+    assert process.wait(10.0) == -9
+    assert exits == [-9]
+
+
+def test_stopped_server_is_restarted(server, tmp_path):
+    result = tmp_path / "result"
+    server.spawn(["app.py", "0"], {"result": str(result)}, str(tmp_path)).wait(10.0)
+    server.stop()
+    assert server.spawn(["app.py", "1"], {"result": str(result)}, str(tmp_path)).wait(10.0) == 1
+
+
+def test_late_replies_are_not_taken_for_the_next_spawn(server, tmp_path):
+    (tmp_path / "sleep.py").write_text("import time\ntime.sleep(60)\n")
+    orphan = server.spawn(["sleep.py"], {}, str(tmp_path))
+    server._replies.put((0, ForkedProcess(orphan.pid)))  # late replies of requests that timed out
+    server._replies.put((0, "fork failed: late"))
+    process = server.spawn(["app.py", "3"], {"result": str(tmp_path / "result")}, str(tmp_path))
+    assert process.pid != orphan.pid and process.wait(10.0) == 3
+    assert orphan.wait(10.0) == -9  # nobody waits for the process of a late reply
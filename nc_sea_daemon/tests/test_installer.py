@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import io
+import os
+import socket
+import sys
+import tarfile
+import time
+from os import path
+
+import pytest
+from conftest import make_tar
+from installer import CHUNK_SIZE, Installer, _ChunkReader, _extract_stream
+from package_cache import PackageCache
+
+
+def _install(installer: Installer, package_url: str, on_installed=lambda app_name: {}) -> dict:
+    async def run():
+        job = installer.submit("app", package_url, on_installed)
+        await asyncio.gather(*installer._tasks)
+        return job.to_dict()
+
+    return asyncio.run(run())
+
+
+def _installer(tmp_path, **kwargs) -> Installer:
+    return Installer(str(tmp_path / "apps"), PackageCache(str(tmp_path / "cache"), 1 << 30), **kwargs)
+
+
+def test_chunk_reader():
+    reader = _ChunkReader()
+    for chunk in (b"abc", b"de", b"f"):
+        reader.feed(chunk)
+    reader.feed_eof()
+    assert reader.read(4) == b"abcd"
+    assert reader.read(1) == b"e"
+    assert reader.read() == b"f"
+    assert reader.read(10) == b""
+
+
+def test_install(tmp_path, static_server):
+    static_server.routes["/app.tar.gz"] = make_tar({"appinfo.json": b"{}", "lib/main.py": b"print(1)\n"})
+    updates = []
+    installer = _installer(tmp_path, on_update=updates.append)
+    job = _install(installer, f"{static_server.url}/app.tar.gz")
+    assert job["state"] == "finished", job["error"]
+    assert job["downloaded"] == len(static_server.routes["/app.tar.gz"])
+    app_path = tmp_path / "apps" / "app"
+    assert (app_path / "lib" / "main.py").read_bytes() == b"print(1)\n"
+    assert not (app_path / "package").exists()
+    assert updates[0]["state"] == "queued" and updates[-1]["state"] == "finished"
+
+
+def test_install_failure_removes_app(tmp_path, static_server):
+    installer = _installer(tmp_path)
+    job = _install(installer, f"{static_server.url}/missing.tar.gz")
+    assert job["state"] == "failed"
+    assert "404" in job["error"]
+    assert not path.exists(tmp_path / "apps" / "app")
+
+
+def test_install_failure_of_on_installed(tmp_path, static_server):
+    static_server.routes["/app.tar.gz"] = make_tar({"appinfo.json": b"{}"})
+
+    def on_installed(app_name):
+        raise RuntimeError(f"bad manifest of {app_name}")
+
+    job = _install(_installer(tmp_path), f"{static_server.url}/app.tar.gz", on_installed)
+    assert job["state"] == "failed"
+    assert job["error"] == "bad manifest of app"
+    assert not path.exists(tmp_path / "apps" / "app")
+
+
+def test_download_timeout(tmp_path):
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()  # accepts connections, never answers
+        url = f"http://127.0.0.1:{server.getsockname()[1]}/app.tar.gz"
+        started = time.monotonic()
+        job = _install(_installer(tmp_path, download_timeout=0.3), url)
+    assert job["state"] == "failed"
+    assert time.monotonic() - started < 5.0
+
+
+def test_failing_after_install_removes_app(tmp_path, static_server):
+    static_server.routes["/app.tar.gz"] = make_tar({"appinfo.json": b"{}"})
+    setup = {"after_install": [sys.executable, "-c", "raise SystemExit(3)"]}
+    job = _install(_installer(tmp_path), f"{static_server.url}/app.tar.gz", lambda app_name: setup)
+    assert job["state"] == "failed"
+    assert job["error"] == "after_install of app exited with 3"
+    assert not path.exists(tmp_path / "apps" / "app")
+
+
+def test_timeout_waits_for_the_extraction(tmp_path, static_server, monkeypatch):
+    static_server.routes["/app.tar.gz"] = make_tar({"appinfo.json": b"{}"})
+
+    def slow_extract(reader, destination_path, cache):
+        time.sleep(0.5)
+        return _extract_stream(reader, destination_path, cache)
+
+    monkeypatch.setattr("installer._extract_stream", slow_extract)
+    job = _install(_installer(tmp_path, timeout=0.2), f"{static_server.url}/app.tar.gz")
+    assert job["state"] == "failed"
+    assert job["error"] == "install did not finish in 0.2 seconds"
+    assert not path.exists(tmp_path / "apps" / "app")
+
+
+def _tar(members: list) -> bytes:
+    """Gzipped tarball of (name, bytes content or ``"-> target"`` for a symlink) pairs."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            if isinstance(content, str):
+                info.type, info.linkname = tarfile.SYMTYPE, content[3:]
+                tar.addfile(info)
+            else:
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize(
+    "members",
+    [
+        [("package/../../escape.txt", b"x")],
+        [("package/evil", "-> {outside}"), ("package/evil/owned.txt", b"x")],
+        [("package/evil", "-> ../../outside"), ("package/evil/owned.txt", b"x")],
+        [("package/lib", "-> ."), ("package/lib/evil", "-> ../..")],
+    ],
+)
+def test_members_outside_of_the_app_are_rejected(tmp_path, static_server, members):
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    members = [(name, i.format(outside=outside) if isinstance(i, str) else i) for name, i in members]
+    static_server.routes["/app.tar.gz"] = _tar(members)
+    job = _install(_installer(tmp_path), f"{static_server.url}/app.tar.gz")
+    assert job["state"] == "failed" and "outside of the app folder" in job["error"]
+    assert not path.exists(tmp_path / "escape.txt") and not path.exists(tmp_path / "apps" / "escape.txt")
+    assert list(outside.iterdir()) == []
+
+
+def test_symlinks_inside_of_the_app(tmp_path, static_server):
+    static_server.routes["/app.tar.gz"] = _tar(
+        [("package/lib/a.py", b"a"), ("package/b.py", "-> lib/a.py"), ("package/lib/b.py", b"b")]
+    )
+    job = _install(_installer(tmp_path), f"{static_server.url}/app.tar.gz")
+    assert job["state"] == "finished", job["error"]
+    assert (tmp_path / "apps" / "app" / "b.py").read_bytes() == b"a"
+
+
+def test_archive_hash_covers_the_whole_download(tmp_path, static_server):
+    content = static_server.routes["/app.tar.gz"] = make_tar({"appinfo.json": b"{}"}) + os.urandom(4 * CHUNK_SIZE)
+    installer = _installer(tmp_path)
+    assert _install(installer, f"{static_server.url}/app.tar.gz")["state"] == "finished"
+    package = installer.cache._index["packages"][f"{static_server.url}/app.tar.gz"]
+    assert package["archive_hash"] == hashlib.sha256(content).hexdigest()
+    assert installer._app_locks == {}
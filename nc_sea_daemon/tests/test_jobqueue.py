@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+from datetime import datetime
+
+import pytest
+from jobqueue import OUTPUT_TAIL, Cron, JobQueue
+from state import SharedState
+
+JOB = {"app_name": "app", "args": [], "nc_url": "http://nc", "user_token": "admin:secret", "priority": 0}
+
+
+def _submit(state: SharedState, **kwargs) -> int:
+    return state.queue_submit({**JOB, "timeout": None, **kwargs}, time.time())
+
+
+def _token(state: SharedState, job_id: int) -> str:
+    return state.db.execute("SELECT user_token FROM queue_jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+
+@pytest.fixture
+def state(tmp_path):
+    return SharedState(str(tmp_path / "state.db"))
+
+
+@pytest.mark.parametrize(
+    "expression, now, expected",
+    [
+        ("*/15 * * * *", datetime(2024, 5, 1, 10, 7, 30), datetime(2024, 5, 1, 10, 15)),
+        ("@daily", datetime(2024, 5, 1, 10, 7), datetime(2024, 5, 2, 0, 0)),
+        ("0 9 * * 1-5", datetime(2024, 5, 3, 9, 0), datetime(2024, 5, 6, 9, 0)),  # Friday to Monday
+        ("30 6 1 * 0", datetime(2024, 5, 2, 0, 0), datetime(2024, 5, 5, 6, 30)),  # the 1st or a Sunday
+        ("0 0 29 2 *", datetime(2024, 3, 1, 0, 0), datetime(2028, 2, 29, 0, 0)),
+    ],
+)
+def test_cron_next_after(expression, now, expected):
+    assert Cron(expression).next_after(now.timestamp()) == expected.timestamp()
+
+
+@pytest.mark.parametrize(
+    "expression", ["* * * *", "60 * * * *", "* * * * 8", "*/0 * * * *", "5-1 * * * *", "a b c d e"]
+)
+def test_cron_invalid(expression):
+    with pytest.raises(ValueError):
+        Cron(expression)
+
+
+def test_claim_by_priority_within_app_limits(state):
+    low, high = _submit(state), _submit(state, priority=5)
+    other = _submit(state, app_name="other")
+    jobs = state.queue_claim(lambda app_name: 1, 10)
+    assert [i["job_id"] for i in jobs] == [high, other]
+    assert jobs[0]["user_token"] == "admin:secret"
+    assert state.queue_counts() == {("app", "queued"): 1, ("app", "running"): 1, ("other", "running"): 1}
+    assert state.queue_claim(lambda app_name: 2, 10)[0]["job_id"] == low
+
+
+def test_tokens_are_dropped_with_finished_jobs(state):
+    finished, cancelled, lost = _submit(state), _submit(state), _submit(state)
+    state.queue_claim(lambda app_name: 10, 1)
+    state.queue_finished(finished, "finished", 0, "", "")
+    assert state.queue_cancel(cancelled) == "queued"
+    state.queue_claim(lambda app_name: 10, 1)
+    assert state.queue_reap_lost(own=True) == 1  # as after a restart of the daemon
+    assert [_token(state, i) for i in (finished, cancelled, lost)] == ["", "", ""]
+
+
+def test_trim_keeps_active_jobs(state):
+    finished = [_submit(state) for _ in range(3)]
+    for job in state.queue_claim(lambda app_name: 10, 3):
+        state.queue_finished(job["job_id"], "finished", 0, "", "")
+    queued = _submit(state)
+    assert state.queue_trim(retention=3600.0, keep=1) == 2
+    assert [i["job_id"] for i in state.queue_jobs()[1]] == [queued, finished[-1]]
+
+
+def test_schedule_queues_one_job_at_a_time(state):
+    schedule_id = state.schedule_add({**JOB, "timeout": None}, "* * * * *", time.time() - 1)
+    assert state.schedules_due(lambda cron, now: now - 1) == 1
+    assert state.schedules_due(lambda cron, now: now + 60) == 0  # the previous job is still queued
+    assert state.queue_jobs()[1][0]["schedule_id"] == schedule_id
+
+
+def _run(state: SharedState, code: str, limits: dict) -> dict:
+    def prepare(job):
+        return [sys.executable, "-c", code], dict(os.environ), os.getcwd(), {"limits": limits}
+
+    queue = JobQueue(state, prepare, lambda app_name: 1, poll_interval=0.05)
+    job_id = _submit(state)
+    queue.start()
+    try:
+        deadline = time.monotonic() + 10.0
+        while state.queue_job(job_id)["state"] in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        queue.shutdown()
+    return state.queue_job(job_id)
+
+
+def test_job_output_tail_and_limits(state):
+    code = (
+        "import resource, sys; sys.stdout.write('x' * 200000);"
+        " print('nofile', resource.getrlimit(resource.RLIMIT_NOFILE)); sys.exit(3)"
+    )
+    job = _run(state, code, {"nofile": 64})
+    assert job["state"] == "failed" and job["exit_code"] == 3
+    assert len(job["output"]) == OUTPUT_TAIL
+    assert job["output"].endswith("nofile (64, 64)\n")
+
+
+def test_output_held_open_does_not_block_the_dispatcher(state):
+    code = (
+        "import subprocess, sys; print('started', flush=True);"
+        " subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(3)'])"
+    )
+
+    def prepare(job):
+        return [sys.executable, "-c", code], dict(os.environ), os.getcwd(), {}
+
+    queue = JobQueue(state, prepare, lambda app_name: 1)
+    job_id = _submit(state)
+    queue._launch(state.queue_claim(lambda app_name: 1, 1)[0])  # pylint: disable=protected-access
+    queue.running[job_id].process.wait()
+    started = time.monotonic()
+    queue._check(queue.running[job_id], time.time())  # pylint: disable=protected-access
+    assert time.monotonic() - started < 0.5
+    deadline = time.monotonic() + 5.0
+    while state.queue_job(job_id)["state"] == "running" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    job = state.queue_job(job_id)
+    assert job["state"] == "finished" and job["output"] == "started\n"
+    assert queue.recording == {}
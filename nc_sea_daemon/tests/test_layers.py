@@ -0,0 +1,34 @@
+import asyncio
+import sys
+import time
+from os import pathsep
+
+import pytest
+from layers import VENV, activate, normalize_requirements, run_process
+
+
+def test_normalize_requirements():
+    requirements = ["httpx ", "# comment", "", "fastapi==0.110.0", "httpx"]
+    assert normalize_requirements(requirements) == ["fastapi==0.110.0", "httpx"]
+
+
+def test_activate(tmp_path):
+    env = {"PATH": "/usr/bin", "PYTHONHOME": "/opt/python"}
+    assert activate(dict(env), str(tmp_path)) == env
+    (tmp_path / VENV / "bin").mkdir(parents=True)
+    activated = activate(dict(env), str(tmp_path))
+    assert activated["PATH"] == f"{tmp_path / VENV / 'bin'}{pathsep}/usr/bin"
+    assert activated["VIRTUAL_ENV"] == str(tmp_path / VENV)
+    assert "PYTHONHOME" not in activated
+
+
+def test_run_process():
+    code = "print('out'); raise SystemExit(2)"
+    assert asyncio.run(run_process([sys.executable, "-c", code], capture=True)) == (2, b"out\n")
+
+
+def test_run_process_is_killed_on_timeout():
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(run_process([sys.executable, "-c", "import time; time.sleep(30)"]), 0.2))
+    assert time.monotonic() - started < 5.0
@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+from manifests import ManifestError, ManifestIndex, validate_manifest
+
+
+def _write(apps_folder, app_name: str, manifest, mtime: int = 1) -> None:
+    os.makedirs(apps_folder / app_name, exist_ok=True)
+    manifest_path = apps_folder / app_name / "appinfo.json"
+    manifest_path.write_text(manifest if isinstance(manifest, str) else json.dumps(manifest))
+    os.utime(manifest_path, (mtime, mtime))
+
+
+@pytest.mark.parametrize(
+    "manifest, error",
+    [
+        ([], "JSON object"),
+        ({}, "entry_point"),
+        ({"entry_point": "python3", "args": "main.py"}, "args"),
+        ({"entry_point": "python3", "preload": [1]}, "preload"),
+        ({"entry_point": "python3", "after_install": ["setup.sh", 1]}, "after_install"),
+        ({"entry_point": "python3", "after_install": {"run": "setup.sh"}}, "after_install"),
+        ({"entry_point": "python3", "workers": 0}, "workers"),
+        ({"entry_point": "python3", "workers": True}, "workers"),
+        ({"entry_point": "python3", "job_workers": "2"}, "job_workers"),
+        ({"entry_point": "python3", "restart": "sometimes"}, "restart"),
+        ({"entry_point": "python3", "limits": {"memory_mb": -1}}, "limits"),
+        ({"entry_point": "python3", "fork_server": "yes"}, "fork_server"),
+    ],
+)
+def test_validate_manifest(manifest, error):
+    with pytest.raises(ManifestError, match=error):
+        validate_manifest(manifest)
+
+
+@pytest.mark.parametrize("after_install", ["setup.sh", ["python3", "setup.py"]])
+def test_valid_manifest(after_install):
+    manifest = {"entry_point": "python3", "args": ["main.py"], "workers": 2, "limits": {"nofile": 256}}
+    manifest["after_install"] = after_install
+    assert validate_manifest(manifest) is manifest
+
+
+def test_manifest_read_once(tmp_path, monkeypatch):
+    _write(tmp_path, "app", {"entry_point": "python3"})
+    index = ManifestIndex(str(tmp_path), check_interval=60.0)
+    manifest = index.get("app")
+    assert manifest == {"entry_point": "python3"}
+    monkeypatch.setattr("builtins.open", None)
+    assert index.get("app") is manifest
+
+
+def test_changed_manifest_reloaded(tmp_path):
+    _write(tmp_path, "app", {"entry_point": "python3"})
+    index = ManifestIndex(str(tmp_path), check_interval=0.0)
+    first = index.get("app")
+    assert index.get("app") is first  # same mtime, not parsed again
+    _write(tmp_path, "app", {"entry_point": "python3", "workers": 3}, mtime=2)
+    assert index.get("app")["workers"] == 3
+
+
+def test_invalid_and_removed_manifests(tmp_path):
+    _write(tmp_path, "good", {"entry_point": "python3"})
+    _write(tmp_path, "bad", "{not json")
+    index = ManifestIndex(str(tmp_path), check_interval=0.0)
+    errors = index.reload()
+    assert list(errors) == ["bad"] and "invalid" in errors["bad"]
+    assert index.get("bad") is None
+    with pytest.raises(ManifestError):
+        index.load("bad")
+    os.remove(tmp_path / "good" / "appinfo.json")
+    os.rmdir(tmp_path / "good")
+    assert index.reload() == {"bad": errors["bad"]}
+    assert index.get("good") is None
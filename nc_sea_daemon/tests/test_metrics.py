@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from metrics import Registry, RequestMetrics
+from nextcloud_sdk import metrics as sdk_metrics
+
+
+def test_counters_of_all_threads_are_summed():
+    registry = Registry()
+    counter = registry.counter("jobs_total", "Jobs.", ["app"])
+    threads = [threading.Thread(target=lambda: [counter.inc("app") for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc("other", amount=2.5)
+    assert counter.collect() == {("app",): [4000.0], ("other",): [2.5]}
+    with pytest.raises(ValueError):
+        registry.counter("jobs_total", "Again.")
+
+
+def test_render_histogram_and_gauge():
+    registry = Registry()
+    histogram = registry.histogram("duration_seconds", "Duration.", ["stage"], buckets=(0.1, 1.0))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+    histogram.observe(5.0, "a")
+    registry.gauge("workers", "Workers.", ["state"], lambda: {('run"ning',): 2})
+    lines = registry.render().splitlines()
+    assert "# TYPE duration_seconds histogram" in lines
+    assert 'duration_seconds_bucket{stage="a",le="0.1"} 1' in lines
+    assert 'duration_seconds_bucket{stage="a",le="1"} 2' in lines
+    assert 'duration_seconds_bucket{stage="a",le="+Inf"} 3' in lines
+    assert 'duration_seconds_sum{stage="a"} 5.55' in lines
+    assert 'duration_seconds_count{stage="a"} 3' in lines
+    assert 'workers{state="run\\"ning"} 2' in lines
+
+
+def test_snapshots_of_other_processes_are_added():
+    registry = Registry()
+    counter = registry.counter("jobs_total", "Jobs.", ["app"])
+    registry.gauge("workers", "Workers.", [], lambda: {(): 1})
+    counter.inc("app")
+    snapshot = registry.snapshot()
+    assert list(snapshot) == ["jobs_total"]
+    rendered = registry.render([snapshot, {"jobs_total": [[["other"], [3.0]]]}])
+    assert 'jobs_total{app="app"} 2' in rendered and 'jobs_total{app="other"} 3' in rendered
+
+
+def test_hooks_get_every_value():
+    registry = Registry()
+    recorded = []
+    registry.hooks.append(lambda metric, value, labels: recorded.append((metric.name, value, labels)))
+    registry.counter("jobs_total", "Jobs.", ["app"]).inc("app")
+    assert recorded == [("jobs_total", 1.0, ("app",))]
+
+
+def test_request_metrics_use_route_templates():
+    registry = Registry()
+    histogram = registry.histogram("requests", "Requests.", ["method", "route", "status"])
+    app = FastAPI()
+    app.add_middleware(RequestMetrics, histogram=histogram)
+
+    @app.get("/apps/{app_name}")
+    async def app_status(app_name: str):
+        return {"app_name": app_name}
+
+    with TestClient(app) as client:
+        client.get("/apps/one")
+        client.get("/apps/two")
+        client.get("/missing")
+    counts = {k: sum(v[:-1]) for k, v in histogram.collect().items()}
+    assert counts == {("GET", "/apps/{app_name}", "200"): 2, ("GET", "", "404"): 1}
+
+
+def test_sdk_path_labels():
+    assert sdk_metrics.path_label("/ocs/v1.php/cloud/users/admin?format=json") == "/ocs/v1.php/cloud/users"
+    assert sdk_metrics.path_label("/remote.php/dav/files/admin/a/b.txt") == "/remote.php/dav/files"
+    sdk_metrics.observe(0.2, "GET", "/ocs/v1.php/cloud/users/admin", "200")
+    assert 'nextcloud_sdk_request_duration_seconds_count{method="GET",path="/ocs/v1.php/cloud/users",status="200"}' in (
+        sdk_metrics.render()
+    )
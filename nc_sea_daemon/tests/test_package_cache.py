@@ -0,0 +1,155 @@
+import asyncio
+import io
+import os
+import stat
+
+import pytest
+
+from conftest import make_tar
+from installer import Installer
+from package_cache import PackageCache, PackageManifest
+
+
+def _store(cache: PackageCache, content: bytes, mode: int = 0o644) -> str:
+    return cache.store(io.BytesIO(content), mode)
+
+
+def test_store_deduplicates_read_only_objects(tmp_path):
+    cache = PackageCache(str(tmp_path / "cache"), 1 << 30)
+    object_hash = _store(cache, b"data")
+    assert _store(cache, b"data") == object_hash
+    assert len(cache._index["objects"]) == 1
+    assert not os.stat(cache._object_path(object_hash)).st_mode & 0o222
+
+
+def test_link_read_only_member_shares_the_object(tmp_path):
+    cache = PackageCache(str(tmp_path / "cache"), 1 << 30)
+    object_hash = _store(cache, b"data", 0o444)
+    destination = str(tmp_path / "app" / "file")
+    assert cache.link(object_hash, 0o444, destination)
+    assert os.path.samefile(destination, cache._object_path(object_hash))
+    assert not cache.link(object_hash, 0o444, destination)
+
+
+def test_link_writable_member_is_a_copy(tmp_path):
+    cache = PackageCache(str(tmp_path / "cache"), 1 << 30)
+    object_hash = _store(cache, b"data")
+    destination = tmp_path / "app" / "file"
+    cache.link(object_hash, 0o644, str(destination))
+    assert stat.S_IMODE(destination.stat().st_mode) == 0o644
+    destination.write_bytes(b"changed by the app")
+    with open(cache._object_path(object_hash), "rb") as fp:
+        assert fp.read() == b"data"
+
+
+def test_materialize(tmp_path):
+    cache = PackageCache(str(tmp_path / "cache"), 1 << 30)
+    manifest = PackageManifest()
+    manifest.dirs = ["lib"]
+    manifest.files = {"lib/a.py": (_store(cache, b"a"), 0o644), "run.sh": (_store(cache, b"b", 0o555), 0o555)}
+    manifest.symlinks = {"lib/b.py": "a.py"}
+    assert cache.materialize(manifest, str(tmp_path / "app")) == 2
+    assert (tmp_path / "app" / "lib" / "b.py").read_bytes() == b"a"
+    assert stat.S_IMODE((tmp_path / "app" / "run.sh").stat().st_mode) == 0o555
+
+
+def test_adopt_makes_files_read_only_links(tmp_path):
+    cache = PackageCache(str(tmp_path / "cache"), 1 << 30)
+    for layer in ("one", "two"):
+        (tmp_path / layer).mkdir()
+        (tmp_path / layer / "module.py").write_bytes(b"shared")
+        (tmp_path / layer / "own.py").write_bytes(layer.encode())
+    assert cache.adopt(str(tmp_path / "one")) == 0
+    assert cache.adopt(str(tmp_path / "two")) == 1
+    assert os.path.samefile(tmp_path / "one" / "module.py", tmp_path / "two" / "module.py")
+    assert not (tmp_path / "two" / "own.py").stat().st_mode & 0o222
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = PackageCache(str(tmp_path / "cache"), 10)
+    old_manifest, new_manifest = PackageManifest(), PackageManifest()
+    old_manifest.files = {"a": (_store(cache, b"12345678"), 0o644)}
+    cache.add_package("old", {}, "old-archive", old_manifest)
+    new_manifest.files = {"b": (_store(cache, b"abcdefgh"), 0o644)}
+    cache.add_package("new", {}, "new-archive", new_manifest)
+    assert cache.cached_manifest("old") is None
+    assert cache.cached_manifest("new") is not None
+    assert not os.path.exists(cache._object_path(old_manifest.files["a"][0]))
+
+
+def test_reinstall_from_cache(tmp_path, static_server):
+    static_server.routes["/app.tar.gz"] = make_tar({"appinfo.json": b"{}", "main.py": b"print(1)\n"})
+    installer = Installer(str(tmp_path / "apps"), PackageCache(str(tmp_path / "cache"), 1 << 30))
+
+    async def install():
+        job = installer.submit("app", f"{static_server.url}/app.tar.gz", lambda app_name: {})
+        await asyncio.gather(*installer._tasks)
+        return job
+
+    assert not asyncio.run(install()).cached
+    (tmp_path / "apps" / "app" / "main.py").unlink()
+    job = asyncio.run(install())
+    assert job.state == "finished" and job.cached
+    assert static_server.requests[-1][1]["If-None-Match"]
+    assert (tmp_path / "apps" / "app" / "main.py").read_bytes() == b"print(1)\n"
+
+
+@pytest.mark.parametrize(
+    "files, symlinks",
+    [
+        ({"../escape.txt": "x"}, {}),
+        ({}, {"sub/evil": "/etc"}),
+        ({}, {"sub/evil": "../.."}),
+        ({"sub/evil/owned.txt": "x"}, {}),  # a symlink to outside left in the app folder
+    ],
+)
+def test_materialize_rejects_members_outside_of_the_app(tmp_path, files, symlinks):
+    cache = PackageCache(str(tmp_path / "cache"), 1 << 30)
+    (tmp_path / "outside").mkdir()
+    (tmp_path / "app" / "sub").mkdir(parents=True)
+    os.symlink(tmp_path / "outside", tmp_path / "app" / "sub" / "evil")
+    manifest = PackageManifest()
+    manifest.files = {k: (_store(cache, v.encode()), 0o644) for k, v in files.items()}
+    manifest.symlinks = symlinks
+    with pytest.raises(ValueError):
+        cache.materialize(manifest, str(tmp_path / "app"))
+    assert list((tmp_path / "outside").iterdir()) == [] and not (tmp_path / "escape.txt").exists()
+
+
+def test_link_replaces_symlinks(tmp_path):
+    cache = PackageCache(str(tmp_path / "cache"), 1 << 30)
+    (tmp_path / "target").write_bytes(b"kept")
+    os.symlink(tmp_path / "target", tmp_path / "file")
+    cache.link(_store(cache, b"data"), 0o644, str(tmp_path / "file"))
+    assert not (tmp_path / "file").is_symlink() and (tmp_path / "target").read_bytes() == b"kept"
+
+
+def _package(cache: PackageCache, url: str, content: bytes) -> PackageManifest:
+    manifest = PackageManifest()
+    manifest.files = {"file": (_store(cache, content), 0o444)}
+    cache.add_package(url, {"etag": f'"{url}"'}, f"{url}-archive", manifest)
+    return manifest
+
+
+def test_processes_merge_their_index_entries(tmp_path):
+    first = PackageCache(str(tmp_path / "cache"), 1 << 30)
+    second = PackageCache(str(tmp_path / "cache"), 1 << 30)
+    _package(first, "a", b"first")
+    _package(second, "b", b"second")
+    first.touch(_package(first, "c", b"third"))
+    for cache in (first, second, PackageCache(str(tmp_path / "cache"), 1 << 30)):
+        assert all(cache.cached_manifest(i) is not None for i in "abc")
+    assert second.conditional_headers("c") == {"If-None-Match": '"c"'}
+
+
+def test_objects_evicted_by_another_process_are_not_cached(tmp_path):
+    first = PackageCache(str(tmp_path / "cache"), 10)
+    second = PackageCache(str(tmp_path / "cache"), 10)
+    manifest = _package(first, "old", b"12345678")
+    assert second.cached_manifest("old") is not None
+    _package(second, "new", b"abcdefgh")
+    assert first.cached_manifest("old") is None
+    assert first.cached_manifest("new") is not None
+    os.remove(first._object_path(first.cached_manifest("new").files["file"][0]))
+    assert first.cached_manifest("new") is None
+    assert not os.path.exists(first._object_path(manifest.files["file"][0]))
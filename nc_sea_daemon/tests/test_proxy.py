@@ -0,0 +1,112 @@
+import asyncio
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from proxy import AppProxy
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    def _echo(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+        reply = json.dumps(
+            {"method": self.command, "path": self.path, "headers": dict(self.headers), "body": body.decode()}
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    do_GET = do_POST = _echo
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeSupervisor:
+    def __init__(self, ports):
+        self.ports = ports
+
+    def alive_ports(self, app_name):
+        return list(self.ports)
+
+    def health_targets(self):
+        return [("app", i, None) for i in self.ports]
+
+
+@pytest.fixture
+def echo_port():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EchoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def _client(proxy: AppProxy) -> TestClient:
+    app = FastAPI()
+
+    @app.api_route("/apps/{app_name}/{app_path:path}", methods=["GET", "POST"])
+    async def forward(request: Request, app_name: str, app_path: str):
+        return await proxy.forward(request, app_name, app_path)
+
+    return TestClient(app)
+
+
+def test_forward(echo_port):
+    with _client(AppProxy(FakeSupervisor([echo_port]))) as client:
+        response = client.post(
+            "/apps/app/api/items?a=1&b=two",
+            content=b"payload",
+            headers={"Authorization": "Basic eDp5", "X-Forwarded-For": "10.0.0.1", "X-Custom": "kept"},
+        )
+    echo = response.json()
+    assert echo["method"] == "POST" and echo["path"] == "/api/items?a=1&b=two" and echo["body"] == "payload"
+    headers = {k.lower(): v for k, v in echo["headers"].items()}
+    assert "authorization" not in headers
+    assert headers["x-custom"] == "kept"
+    assert headers["x-forwarded-for"] == "10.0.0.1, testclient"
+    assert headers["x-forwarded-proto"] == "http"
+    assert headers["x-forwarded-host"] == "testserver"
+
+
+def test_no_query_string(echo_port):
+    with _client(AppProxy(FakeSupervisor([echo_port]))) as client:
+        assert client.get("/apps/app/status").json()["path"] == "/status"
+
+
+def test_no_workers():
+    with _client(AppProxy(FakeSupervisor([]))) as client:
+        assert client.get("/apps/app/").status_code == 503
+
+
+def test_unreachable_worker():
+    with socket.socket() as free:
+        free.bind(("127.0.0.1", 0))
+        port = free.getsockname()[1]
+    proxy = AppProxy(FakeSupervisor([port]))
+    with _client(proxy) as client:
+        assert client.get("/apps/app/").status_code == 502
+    assert ("app", port) in proxy.unhealthy
+
+
+def test_pick_least_busy():
+    proxy = AppProxy(FakeSupervisor([9000, 9001, 9002]))
+    proxy.in_flight = {("app", 9000): 2, ("app", 9001): 1}
+    proxy.unhealthy = {("app", 9002)}
+    assert proxy.pick("app", [9000, 9001, 9002]) == 9001
+
+
+def test_alive_ports_are_cached():
+    supervisor = FakeSupervisor([9000])
+    proxy = AppProxy(supervisor, ports_ttl=60.0)
+    assert asyncio.run(proxy.alive_ports("app")) == [9000]
+    supervisor.ports = [9001]
+    assert asyncio.run(proxy.alive_ports("app")) == [9000]
+    proxy.ports_ttl = 0.0
+    assert asyncio.run(proxy.alive_ports("app")) == [9001]
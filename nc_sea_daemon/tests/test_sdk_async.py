@@ -0,0 +1,72 @@
+import asyncio
+
+import httpx
+import pytest
+from conftest import mock_async_nextcloud, ocs
+
+from nextcloud_sdk import exceptions
+
+
+def test_async_requests():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path.endswith("/users"):
+            return ocs({"users": ["admin", "alice"]})
+        return ocs({"id": request.url.path.rsplit("/", 1)[-1]})
+
+    async def run():
+        async with mock_async_nextcloud(handler) as nc:
+            users = await nc.users.list_users()
+            details = await asyncio.gather(*[nc.users.get_user(i) for i in users])
+            return users, details
+
+    users, details = asyncio.run(run())
+    assert users == ["admin", "alice"]
+    assert [i["id"] for i in details] == users
+    assert requests[0].url.params["format"] == "json"
+    assert requests[0].headers["authorization"].startswith("Basic ")
+
+
+def test_async_post_sends_form_data():
+    bodies = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        bodies.append(request.content.decode())
+        return ocs([])
+
+    async def run():
+        async with mock_async_nextcloud(handler) as nc:
+            await nc.users_groups.create_group("team")
+
+    asyncio.run(run())
+    assert "groupid=team" in bodies[0] and "format=json" in bodies[0]
+
+
+@pytest.mark.parametrize(
+    "response, error",
+    [
+        (httpx.Response(404), exceptions.NextcloudNotFound),
+        (httpx.Response(401), exceptions.NextcloudUnauthorized),
+        (httpx.Response(503, headers={"Retry-After": "3"}), exceptions.NextcloudServiceUnavailable),
+        (ocs(None, "failure", 997, "no"), exceptions.NextcloudException),
+    ],
+)
+def test_async_errors(response, error):
+    async def run():
+        async with mock_async_nextcloud(lambda request: response) as nc:
+            await nc.users.get_user("admin")
+
+    with pytest.raises(error):
+        asyncio.run(run())
+
+
+def test_async_close():
+    async def run():
+        nc = mock_async_nextcloud(lambda request: ocs({}))
+        assert nc.connected
+        await nc.close()
+        return nc.connected
+
+    assert not asyncio.run(run())
@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import httpx
+from conftest import NC_ARGS, mock_nextcloud, ocs
+
+from nextcloud_sdk import Nextcloud, RetryPolicy, connections, exceptions
+from nextcloud_sdk.bulk import DEFAULT_RETRIES, arun_bulk, bulk_retries, run_bulk
+
+
+def test_run_bulk_keeps_order_and_errors():
+    def func(item):
+        if item == 3:
+            raise ValueError("bad item")
+        return item * 2
+
+    results = run_bulk(func, range(5), concurrency=3)
+    assert [i.item for i in results] == list(range(5))
+    assert [i.result for i in results if i.ok] == [0, 2, 4, 8]
+    assert isinstance(results[3].error, ValueError) and results[3].attempts == 1
+
+
+def test_run_bulk_retries_throttled_calls():
+    calls = []
+
+    def func(item):
+        calls.append(item)
+        if len(calls) < 3:
+            raise exceptions.NextcloudTooManyRequests(retry_after=0.0)
+        return item
+
+    result = run_bulk(func, ["a"], retries=3)[0]
+    assert result.ok and result.attempts == 3
+
+
+def test_long_retry_after_is_not_waited_for():
+    calls = []
+
+    def func(item):
+        calls.append(item)
+        raise exceptions.NextcloudTooManyRequests(retry_after=3600.0)
+
+    result = run_bulk(func, ["a"], retries=3)[0]
+    assert isinstance(result.error, exceptions.NextcloudTooManyRequests) and result.attempts == 1
+
+
+async def _throttled(item):
+    raise exceptions.NextcloudServiceUnavailable(retry_after=0.2)
+
+
+def test_arun_bulk_caps_retry_after():
+    started = time.monotonic()
+    result = asyncio.run(arun_bulk(_throttled, ["a"], retries=3, max_retry_after=0.1))[0]
+    assert result.attempts == 1 and time.monotonic() - started < 0.2
+
+
+def test_arun_bulk_gives_up_after_retries():
+    async def func(item):
+        raise exceptions.NextcloudServiceUnavailable(retry_after=0.0)
+
+    result = asyncio.run(arun_bulk(func, ["a"], retries=2))[0]
+    assert isinstance(result.error, exceptions.NextcloudServiceUnavailable)
+    assert result.attempts == 3
+
+
+def test_bulk_retries_defer_to_connection_policy():
+    assert bulk_retries(mock_nextcloud(None).connection, None) == DEFAULT_RETRIES
+    assert bulk_retries(mock_nextcloud(None, retry=RetryPolicy(retries=2)).connection, None) == 0
+    assert bulk_retries(mock_nextcloud(None, retry=RetryPolicy(retries=2)).connection, 1) == 1
+
+
+def test_bulk_attempts_do_not_multiply():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(429, headers={"Retry-After": "0"})
+
+    nc = mock_nextcloud(handler, retry=RetryPolicy(retries=2))
+    results = nc.users.get_users(["alice", "bob"])
+    assert all(isinstance(i.error, exceptions.NextcloudTooManyRequests) for i in results)
+    assert len(requests) == 2 * 3
+
+
+def test_bulk_over_connection_without_retries():
+    responses = iter([httpx.Response(503, headers={"Retry-After": "0"}), ocs({"id": "alice"})])
+    nc = mock_nextcloud(lambda request: next(responses))
+    result = nc.users.get_users(["alice"])[0]
+    assert result.result == {"id": "alice"} and result.attempts == 2
+
+
+def test_bulk_threads_share_the_client_of_a_connection(monkeypatch):
+    created = []
+
+    def slow_client(**kwargs):
+        time.sleep(0.05)
+        created.append(httpx.Client(**kwargs, transport=httpx.MockTransport(lambda request: ocs({"id": "x"}))))
+        return created[-1]
+
+    monkeypatch.setattr(connections, "Client", slow_client)
+    nc = Nextcloud(**NC_ARGS)
+    assert all(i.ok for i in nc.users.get_users(["a", "b", "c", "d"], concurrency=4))
+    assert len(created) == 1
+    nc.connection.close()
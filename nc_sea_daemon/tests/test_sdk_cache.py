@@ -0,0 +1,65 @@
+import base64
+import time
+
+import httpx
+from conftest import mock_nextcloud, ocs
+
+from nextcloud_sdk import ResponseCache
+
+
+def _user(request: httpx.Request) -> str:
+    return base64.b64decode(request.headers["authorization"].split()[1]).decode().split(":")[0]
+
+
+def test_lru_eviction_and_ttl_by_path():
+    cache = ResponseCache(ttl=30.0, max_entries=2, ttl_by_path={"/users": 0.0, "/users/admin": 5.0})
+    assert cache.ttl_for("/users/admin/groups") == 5.0
+    assert cache.ttl_for("/users/alice") == 0.0
+    assert cache.ttl_for("/groups") == 30.0
+    for key in ("a", "b", "c"):
+        cache.store(key, f"/{key}", key)
+    cache.store("no-ttl", "/users/alice", "value")
+    assert cache.lookup("a") is None and cache.lookup("c").value == "c"
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+
+
+def test_invalidate_related_paths():
+    cache = ResponseCache()
+    for path in ("/files/a", "/files/a/b", "/files", "/files/ab"):
+        cache.store(path, path, path)
+    cache.invalidate(["/files/a/"])
+    assert [k for k in ("/files/a", "/files/a/b", "/files", "/files/ab") if cache.lookup(k)] == ["/files/ab"]
+
+
+def test_cached_requests_and_revalidation():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("If-None-Match", None) == '"v1"':
+            return httpx.Response(304)
+        return ocs({"id": "admin"}, headers={"ETag": '"v1"'})
+
+    cache = ResponseCache(ttl=0.05)
+    nc = mock_nextcloud(handler, cache=cache)
+    assert nc.users.get_user("admin") == {"id": "admin"}
+    assert nc.users.get_user("admin") == {"id": "admin"}
+    assert len(requests) == 1
+    time.sleep(0.06)
+    assert nc.users.get_user("admin") == {"id": "admin"}
+    assert len(requests) == 2 and cache.stats()["revalidated"] == 1
+    nc.users.edit_user("admin", key="email", value="a@b.c")
+    assert cache.stats()["entries"] == 0
+
+
+def test_cache_shared_by_users():
+    cache = ResponseCache()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return ocs({"users": [f"seen by {_user(request)}"]})
+
+    admin = mock_nextcloud(handler, cache=cache)
+    alice = mock_nextcloud(handler, cache=cache, nc_auth_user="alice")
+    assert admin.users.list_users() == ["seen by admin"]
+    assert alice.users.list_users() == ["seen by alice"]
+    assert admin.users.list_users() == ["seen by admin"]
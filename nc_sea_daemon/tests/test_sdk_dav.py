@@ -0,0 +1,55 @@
+import httpx
+import pytest
+from conftest import mock_nextcloud, multistatus
+
+from nextcloud_sdk import exceptions
+from nextcloud_sdk.dav import MultistatusParser, parse_multistatus, prefixed_name
+
+BASE = "/remote.php/dav/files/admin/Docs"
+BODY = multistatus(BASE, [("", True, "e0", 1), ("Report 1.pdf", False, "e1", 2), ("Photos", True, "e2", 3)])
+
+
+def test_prefixed_name():
+    assert prefixed_name("{DAV:}getetag") == "d:getetag"
+    assert prefixed_name("{http://owncloud.org/ns}fileid") == "oc:fileid"
+    assert prefixed_name("{urn:other}x") == "{urn:other}x"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, len(BODY)])
+def test_parse_in_chunks(chunk_size):
+    chunks = [BODY[i : i + chunk_size] for i in range(0, len(BODY), chunk_size)]
+    nodes = list(parse_multistatus(chunks, BASE))
+    assert [(i.path, i.is_dir, i.etag, i.fileid) for i in nodes] == [
+        ("", True, "e0", 1),
+        ("Report 1.pdf", False, "e1", 2),
+        ("Photos/", True, "e2", 3),
+    ]
+    assert "oc:size" not in nodes[1].props
+    assert nodes[2].name == "Photos"
+
+
+def test_nodes_are_yielded_before_the_body_ends():
+    parser = MultistatusParser(BASE)
+    end = BODY.index(b"</d:response>") + len(b"</d:response>")
+    assert [i.path for i in parser.feed(BODY[:end])] == [""]
+    assert len(list(parser.feed(BODY[end:])) + parser.close()) == 2
+
+
+def test_error_body():
+    body = (
+        b'<?xml version="1.0"?><d:error xmlns:d="DAV:" xmlns:s="http://sabredav.org/ns">'
+        b"<s:exception>Sabre\\DAV\\Exception\\NotFound</s:exception><s:message>missing</s:message></d:error>"
+    )
+    with pytest.raises(exceptions.NextcloudException):
+        list(parse_multistatus([body]))
+
+
+def test_iter_files():
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.method == "PROPFIND" and request.headers["Depth"] == "1"
+        return httpx.Response(207, content=BODY)
+
+    nc = mock_nextcloud(handler)
+    nodes = list(nc.files.iter_files("admin", "Docs"))
+    assert [i.path for i in nodes] == ["Report 1.pdf", "Photos/"]
+    assert nc.files.list_files("admin", "Docs") == {i.path: {"path": i.path} for i in nodes}
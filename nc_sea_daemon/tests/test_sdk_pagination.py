@@ -0,0 +1,75 @@
+import asyncio
+import threading
+
+import httpx
+from conftest import mock_async_nextcloud, mock_nextcloud, ocs
+
+from nextcloud_sdk.pagination import aiter_pages, iter_pages
+
+ITEMS = [f"user{i}" for i in range(7)]
+
+
+def _fetch(limit: int, offset: int) -> list:
+    return ITEMS[offset : offset + limit]
+
+
+def test_iter_pages():
+    requested = []
+
+    def fetch(limit, offset):
+        requested.append(offset)
+        return _fetch(limit, offset)
+
+    assert list(iter_pages(fetch, 3)) == ITEMS
+    assert requested == [0, 3, 6]
+
+
+def test_iter_pages_stops_after_full_last_page():
+    requested = []
+
+    def fetch(limit, offset):
+        requested.append(offset)
+        return _fetch(limit, offset)[:limit]
+
+    assert list(iter_pages(fetch, 7)) == ITEMS
+    assert requested == [0, 7]
+
+
+def test_iter_pages_prefetches_next_page():
+    second_page = threading.Event()
+
+    def fetch(limit, offset):
+        if offset:
+            second_page.set()
+        return _fetch(limit, offset)
+
+    pages = iter_pages(fetch, 3)
+    assert next(pages) == "user0"
+    assert second_page.wait(5.0)
+
+
+def test_aiter_pages():
+    async def fetch(limit, offset):
+        return _fetch(limit, offset)
+
+    async def collect():
+        return [i async for i in aiter_pages(fetch, 2)]
+
+    assert asyncio.run(collect()) == ITEMS
+
+
+def _users_handler(request: httpx.Request) -> httpx.Response:
+    limit, offset = int(request.url.params["limit"]), int(request.url.params["offset"])
+    return ocs({"users": _fetch(limit, offset)})
+
+
+def test_iter_users():
+    assert list(mock_nextcloud(_users_handler).users.iter_users(page_size=4)) == ITEMS
+
+
+def test_async_iter_users():
+    async def collect():
+        async with mock_async_nextcloud(_users_handler) as nc:
+            return [i async for i in nc.users.iter_users(page_size=4)]
+
+    assert asyncio.run(collect()) == ITEMS
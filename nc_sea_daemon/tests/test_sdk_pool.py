@@ -0,0 +1,73 @@
+import asyncio
+import base64
+
+import httpx
+from conftest import NC_ARGS, ocs
+
+from nextcloud_sdk import AsyncNextcloud, Nextcloud
+from nextcloud_sdk.pool import AsyncConnectionPool, ConnectionPool
+
+
+def _handler(request: httpx.Request) -> httpx.Response:
+    user = base64.b64decode(request.headers["authorization"].split()[1]).decode().split(":")[0]
+    details = {"id": user, "host": request.url.host, "cookie": request.headers.get("cookie", "")}
+    return ocs(details, headers={"Set-Cookie": f"nc_session_id={user}; Path=/"})
+
+
+class MockPool(ConnectionPool):
+    def _new_client(self) -> httpx.Client:
+        return httpx.Client(**self._client_args(), transport=httpx.MockTransport(_handler))
+
+
+class AsyncMockPool(AsyncConnectionPool):
+    def _new_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(**self._client_args(), transport=httpx.MockTransport(_handler))
+
+
+def test_users_share_the_client_of_a_host():
+    pool = MockPool()
+    alice = Nextcloud(**{**NC_ARGS, "nc_auth_user": "alice"}, pool=pool)
+    bob = Nextcloud(**{**NC_ARGS, "nc_auth_user": "bob"}, pool=pool)
+    assert alice.users.get_user("x")["id"] == "alice"
+    assert bob.users.get_user("x")["id"] == "bob"
+    stats = pool.stats()
+    assert stats["clients_created"] == 1
+    assert [(i["active"], i["requests"]) for i in stats["hosts"].values()] == [(0, 2)]
+    Nextcloud(**{**NC_ARGS, "nextcloud_url": "https://other.local"}, pool=pool).users.get_user("x")
+    assert pool.stats()["clients_created"] == 2
+    pool.close()
+    assert pool.stats()["hosts"] == {}
+
+
+def test_cookies_are_not_shared_by_users():
+    pool = MockPool()
+    alice = Nextcloud(**{**NC_ARGS, "nc_auth_user": "alice"}, pool=pool)
+    bob = Nextcloud(**{**NC_ARGS, "nc_auth_user": "bob"}, pool=pool)
+    assert alice.users.get_user("x")["cookie"] == ""
+    assert bob.users.get_user("x")["cookie"] == ""
+    assert alice.users.get_user("x")["cookie"] == ""
+
+
+def test_idle_clients_are_closed():
+    pool = MockPool(idle_timeout=0.0)
+    with pool.lease("https://a.local") as client:
+        with pool.lease("https://b.local"):
+            pass
+        assert not client.is_closed  # leased clients are kept
+    assert list(pool.stats()["hosts"]) == ["https://a.local"]  # the release of `a` evicted the idle `b`
+    assert pool.evict_idle() == 1 and client.is_closed
+    assert pool.stats()["clients_evicted"] == 2
+
+
+def test_async_pool():
+    async def run():
+        pool = AsyncMockPool()
+        users = [AsyncNextcloud(**{**NC_ARGS, "nc_auth_user": f"user{i}"}, pool=pool) for i in range(3)]
+        details = await asyncio.gather(*[i.users.get_user("x") for i in users])
+        stats = pool.stats()
+        assert await pool.evict_idle(max_idle=0.0) == 1
+        return details, stats
+
+    details, stats = asyncio.run(run())
+    assert [i["id"] for i in details] == ["user0", "user1", "user2"]
+    assert stats["clients_created"] == 1 and stats["max_connections"] == 100
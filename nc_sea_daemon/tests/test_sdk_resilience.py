@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import time
+from email.utils import formatdate
+
+import httpx
+import pytest
+from conftest import mock_async_nextcloud, mock_nextcloud, ocs
+
+from nextcloud_sdk import exceptions, resilience
+from nextcloud_sdk.resilience import CircuitBreaker, RetryPolicy
+
+FAST = {"backoff_base": 0.001, "backoff_max": 0.001}
+
+
+def _flaky(statuses):
+    """Handler answering with the statuses in turn, then with an OCS reply, and recording the requests."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.method)
+        if len(requests) <= len(statuses):
+            return httpx.Response(statuses[len(requests) - 1])
+        return ocs({"id": "admin"})
+
+    return handler, requests
+
+
+def test_retries_of_idempotent_requests():
+    handler, requests = _flaky([503, 502])
+    nc = mock_nextcloud(handler, retry=RetryPolicy(retries=2, **FAST))
+    assert nc.users.get_user("admin") == {"id": "admin"}
+    assert requests == ["GET"] * 3
+
+
+def test_only_too_many_requests_are_retried_for_other_methods():
+    handler, requests = _flaky([429, 503])
+    nc = mock_nextcloud(handler, retry=RetryPolicy(retries=2, **FAST))
+    with pytest.raises(exceptions.NextcloudServiceUnavailable):
+        nc.connection.request("POST", "cloud/users", {"userid": "u"})
+    assert requests == ["POST", "POST"]
+
+
+def test_long_retry_after_is_not_waited_for():
+    nc = mock_nextcloud(
+        lambda request: httpx.Response(429, headers={"Retry-After": "120"}), retry=RetryPolicy(retries=2, **FAST)
+    )
+    with pytest.raises(exceptions.NextcloudTooManyRequests) as e:
+        nc.users.get_user("admin")
+    assert e.value.retry_after == 120.0
+
+
+def test_deadline():
+    def handler(request: httpx.Request) -> httpx.Response:
+        time.sleep(0.03)
+        return httpx.Response(503)
+
+    nc = mock_nextcloud(handler, retry=RetryPolicy(retries=100, backoff_base=0.01, backoff_max=0.01))
+    started = time.monotonic()
+    with pytest.raises((exceptions.NextcloudDeadlineExceeded, exceptions.NextcloudServiceUnavailable)):
+        nc.connection.request("GET", "cloud/users/admin", deadline=0.2)
+    assert time.monotonic() - started < 0.5
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    handler, requests = _flaky([500, 500])
+    nc = mock_nextcloud(handler, breaker=breaker)
+    for _ in range(2):
+        with pytest.raises(exceptions.NextcloudException):
+            nc.users.get_user("admin")
+    with pytest.raises(exceptions.NextcloudCircuitOpen):
+        nc.users.get_user("admin")
+    assert len(requests) == 2 and breaker.state(nc.connection.config.endpoint) == "open"
+    time.sleep(0.06)
+    assert breaker.state(nc.connection.config.endpoint) == "half_open"
+    assert nc.users.get_user("admin") == {"id": "admin"}
+    assert breaker.stats()[nc.connection.config.endpoint] == {"state": "closed", "failures": 0, "opened": 1}
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("5", 5.0), ("-1", 0.0), ("soon", None), (None, None), ("Wed, 21 Oct 2015 07:28:00 GMT", 0.0)],
+)
+def test_retry_after(value, expected):
+    response = httpx.Response(503, headers={} if value is None else {"Retry-After": value})
+    assert resilience.retry_after(response) == expected
+
+
+def test_retry_after_date():
+    response = httpx.Response(503, headers={"Retry-After": formatdate(time.time() + 60, usegmt=True)})
+    assert resilience.retry_after(response) == pytest.approx(60.0, abs=2.0)
+
+
+class TrackedResponse:
+    status_code = 200
+
+    def __init__(self, index: int):
+        self.index = index
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    async def aclose(self):
+        self.closed = True
+
+
+def _hedged_sends(first_fails: bool):
+    responses, threads = [], []
+
+    def send(timeout):
+        response = TrackedResponse(len(responses))
+        responses.append(response)
+        threads.append(threading.current_thread())
+        if response.index == 0:
+            time.sleep(0.2)
+            if first_fails:
+                raise httpx.ReadTimeout("slow")
+        return response
+
+    return send, responses, threads
+
+
+def _wait_closed(response):
+    deadline = time.monotonic() + 2.0
+    while not response.closed:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_hedged_read_answered_by_the_copy():
+    send, responses, threads = _hedged_sends(first_fails=True)
+    response = resilience.call(RetryPolicy(retries=0, hedge_after=0.02), None, "host", "GET", send)
+    assert response.index == 1 and not response.closed
+    assert threads[0] is threading.current_thread() and threads[1].name.startswith("nextcloud-hedge")
+
+
+def test_hedged_read_closes_the_copy():
+    send, responses, _ = _hedged_sends(first_fails=False)
+    response = resilience.call(RetryPolicy(hedge_after=0.02), None, "host", "GET", send)
+    assert response.index == 0 and not response.closed
+    _wait_closed(responses[1])
+
+
+def test_fast_reads_are_not_hedged():
+    policy = RetryPolicy(hedge_after=0.05, hedge_workers=1)
+    send, responses, _ = _hedged_sends(first_fails=False)
+    responses.append(None)  # every attempt is fast
+    for _ in range(3):
+        resilience.call(policy, None, "host", "GET", send)
+    time.sleep(0.1)
+    assert len(responses) == 4 and policy.hedge_executor()._max_workers == 1
+
+
+def test_async_hedged_read_closes_the_slower_response():
+    responses = []
+
+    async def send(timeout):
+        response = TrackedResponse(len(responses))
+        responses.append(response)
+        if response.index == 0:
+            try:
+                await asyncio.sleep(0.2)
+            except asyncio.CancelledError:
+                pass  # the response arrives anyway
+        return response
+
+    async def run():
+        response = await resilience.acall(RetryPolicy(hedge_after=0.02), None, "host", "GET", send)
+        await asyncio.sleep(0.05)
+        return response
+
+    assert asyncio.run(run()).index == 1
+    assert responses[0].closed and not responses[1].closed
+
+
+def test_async_retries():
+    handler, requests = _flaky([503])
+
+    async def run():
+        nc = mock_async_nextcloud(handler, retry=RetryPolicy(retries=1, **FAST))
+        return await nc.users.get_user("admin")
+
+    assert asyncio.run(run()) == {"id": "admin"} and len(requests) == 2
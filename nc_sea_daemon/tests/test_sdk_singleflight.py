@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from conftest import mock_async_nextcloud, mock_nextcloud, ocs
+
+from nextcloud_sdk.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    flights = SingleFlight()
+    calls = []
+    started = threading.Event()
+
+    def func():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return len(calls)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("key", func))) for _ in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [1] * 5 and flights.shared == 4
+    assert flights.do("key", func) == 2  # a later call runs again
+
+
+def test_errors_are_shared():
+    flights = SingleFlight()
+    started = threading.Event()
+
+    def func():
+        started.set()
+        time.sleep(0.05)
+        raise ValueError("failed")
+
+    errors = []
+
+    def call():
+        try:
+            flights.do("key", func)
+        except ValueError as e:
+            errors.append(e)
+
+    first = threading.Thread(target=call)
+    first.start()
+    started.wait()
+    call()
+    first.join()
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+def test_async_cancelled_caller_does_not_cancel_the_call():
+    async def run():
+        flights = AsyncSingleFlight()
+
+        async def func():
+            await asyncio.sleep(0.05)
+            return "value"
+
+        first = asyncio.ensure_future(flights.do("key", func))
+        second = asyncio.ensure_future(flights.do("key", func))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, flights.shared
+
+    assert asyncio.run(run()) == ("value", 1)
+
+
+def test_coalesced_requests():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.method)
+        time.sleep(0.1)
+        return ocs({"id": "admin"})
+
+    nc = mock_nextcloud(handler, coalesce=True)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(nc.users.get_user("admin"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [{"id": "admin"}] * 4 and len(requests) < 4
+    nc.connection.request("PUT", "cloud/users/admin", {"key": "email", "value": "a@b.c"})
+    nc.connection.request("PUT", "cloud/users/admin", {"key": "email", "value": "a@b.c"})
+    assert requests.count("PUT") == 2
+
+
+@pytest.mark.parametrize("coalesce", [True, False])
+def test_async_coalesced_requests(coalesce):
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.method)
+        await asyncio.sleep(0.05)
+        return ocs({"id": "admin"})
+
+    async def run():
+        nc = mock_async_nextcloud(handler, coalesce=coalesce)
+        return await asyncio.gather(*[nc.users.get_user("admin") for _ in range(5)])
+
+    assert asyncio.run(run()) == [{"id": "admin"}] * 5
+    assert len(requests) == (1 if coalesce else 5)
@@ -0,0 +1,108 @@
+import asyncio
+import io
+import re
+
+import httpx
+from conftest import mock_async_nextcloud, mock_nextcloud
+
+from nextcloud_sdk.transfers import download_parts, peek_single_chunk, source_chunks, source_size
+
+CONTENT = bytes(range(256)) * 40
+
+
+def test_source_chunks():
+    assert list(source_chunks(b"abcdefg", 3)) == [b"abc", b"def", b"g"]
+    assert list(source_chunks(io.BytesIO(b"abcdef"), 3)) == [b"abc", b"def"]
+    assert list(source_chunks(iter([b"ab", b"cde", b"f"]), 4)) == [b"abcd", b"ef"]
+
+
+def test_source_size():
+    source = io.BytesIO(b"abcdef")
+    source.seek(2)
+    assert source_size(source) == 4
+    assert source_size(b"abc") == 3
+    assert source_size(iter([b"abc"])) is None
+
+
+def test_peek_single_chunk():
+    assert peek_single_chunk(iter([b"only"]))[0] == b"only"
+    single, chunks = peek_single_chunk(iter([b"a", b"b", b"c"]))
+    assert single is None and list(chunks) == [b"a", b"b", b"c"]
+
+
+def test_download_parts():
+    assert download_parts(0, 10, 4) == [(0, 3), (4, 7), (8, 9)]
+    assert download_parts(5, 10, 10) == [(5, 9)]
+
+
+class DavFiles:
+    """Handler storing files by path, with chunked upload v2 and Range requests."""
+
+    def __init__(self):
+        self.files = {"/remote.php/dav/files/admin/data.bin": CONTENT}
+        self.requests: list = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        self.requests.append((request.method, path))
+        if request.method == "MKCOL":
+            return httpx.Response(201)
+        if request.method == "PUT":
+            self.files[path] = request.read()
+            return httpx.Response(201)
+        if request.method == "MOVE":
+            folder = path.rsplit("/", 1)[0]
+            chunks = sorted(k for k in self.files if k.startswith(folder + "/"))
+            destination = httpx.URL(request.headers["Destination"]).path
+            self.files[destination] = b"".join(self.files.pop(i) for i in chunks)
+            return httpx.Response(201)
+        content = self.files[path]
+        if request.method == "HEAD":
+            return httpx.Response(200, headers={"Accept-Ranges": "bytes", "Content-Length": str(len(content))})
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        if match is None:
+            return httpx.Response(200, content=content)
+        start, end = int(match[1]), int(match[2] or len(content) - 1)
+        return httpx.Response(
+            206, content=content[start : end + 1], headers={"Content-Range": f"bytes {start}-{end}/{len(content)}"}
+        )
+
+
+def test_upload_in_chunks():
+    server = DavFiles()
+    mock_nextcloud(server).files.upload("big.bin", io.BytesIO(CONTENT), chunk_size=3000, max_concurrency=2)
+    assert server.files["/remote.php/dav/files/admin/big.bin"] == CONTENT
+    assert [i[0] for i in server.requests] == ["MKCOL", "PUT", "PUT", "PUT", "PUT", "MOVE"]
+
+
+def test_upload_single_request():
+    server = DavFiles()
+    mock_nextcloud(server).files.upload("small.txt", b"hello")
+    assert server.requests == [("PUT", "/remote.php/dav/files/admin/small.txt")]
+
+
+def test_download_in_parts():
+    server = DavFiles()
+    fp = io.BytesIO()
+    written = mock_nextcloud(server).files.download("data.bin", fp, max_concurrency=3, part_size=1000)
+    assert written == len(CONTENT) and fp.getvalue() == CONTENT
+    assert len([i for i in server.requests if i[0] == "GET"]) == 11
+
+
+def test_resume_download():
+    fp = io.BytesIO()
+    written = mock_nextcloud(DavFiles()).files.download("data.bin", fp, offset=1000)
+    assert fp.getvalue() == CONTENT[1000:] and written == len(CONTENT) - 1000
+
+
+def test_async_transfers():
+    server = DavFiles()
+
+    async def run():
+        async with mock_async_nextcloud(server) as nc:
+            await nc.files.upload("copy.bin", CONTENT, chunk_size=4096)
+            fp = io.BytesIO()
+            await nc.files.download("copy.bin", fp, max_concurrency=2, part_size=4096)
+            return fp.getvalue()
+
+    assert asyncio.run(run()) == CONTENT
@@ -0,0 +1,61 @@
+import asyncio
+from urllib.parse import unquote
+
+import httpx
+from conftest import mock_async_nextcloud, mock_nextcloud, multistatus
+
+ROOT = "/remote.php/dav/files/admin/"
+# path: (etag, file id), directories end with "/"
+TREE = {
+    "": ("e0", 1),
+    "a/": ("ea", 2),
+    "a/one.txt": ("e3", 3),
+    "a/deep/": ("e4", 4),
+    "a/deep/two.txt": ("e5", 5),
+    "b/": ("eb", 6),
+    "b/shared/": ("ea", 2),  # the same folder as a/, shared into b/
+    "top.txt": ("e7", 7),
+}
+
+
+def _handler(listed: list):
+    def handler(request: httpx.Request) -> httpx.Response:
+        directory = unquote(request.url.path)[len(ROOT) :].strip("/")
+        directory = f"{directory}/" if directory else ""
+        listed.append(directory)
+        entries = [("", True, *TREE[directory])]
+        for path, (etag, fileid) in TREE.items():
+            name = path[len(directory) :]
+            if path.startswith(directory) and name and "/" not in name.rstrip("/"):
+                entries.append((name.rstrip("/"), path.endswith("/"), etag, fileid))
+        return httpx.Response(207, content=multistatus(ROOT + directory, entries))
+
+    return handler
+
+
+def test_walk():
+    listed: list = []
+    nodes = list(mock_nextcloud(_handler(listed)).files.walk("admin", max_concurrency=3))
+    assert sorted(i.path for i in nodes) == ["a/", "a/deep/", "a/deep/two.txt", "a/one.txt", "b/", "top.txt"]
+    assert sorted(listed) == ["", "a/", "a/deep/", "b/"]
+
+
+def test_walk_below_path():
+    nodes = list(mock_nextcloud(_handler([])).files.walk("admin", "a"))
+    assert sorted(i.path for i in nodes) == ["deep/", "deep/two.txt", "one.txt"]
+
+
+def test_walk_skips_unchanged_directories():
+    listed: list = []
+    nodes = list(mock_nextcloud(_handler(listed)).files.walk("admin", known_etags={"a/": "ea"}))
+    assert "a/" in [i.path for i in nodes]
+    assert "a/one.txt" not in [i.path for i in nodes]
+    assert "a/" not in listed
+
+
+def test_async_walk():
+    async def collect():
+        async with mock_async_nextcloud(_handler([])) as nc:
+            return [i.path async for i in nc.files.walk("admin", max_concurrency=2)]
+
+    assert sorted(asyncio.run(collect())) == ["a/", "a/deep/", "a/deep/two.txt", "a/one.txt", "b/", "top.txt"]
@@ -0,0 +1,89 @@
+import stat
+import subprocess
+import sys
+
+import pytest
+from state import SharedState, process_start
+
+POOL = {"size": 2, "restart": "always", "limits": {}, "health_path": None, "fork_server": False}
+
+
+def _worker(pid: int, port: int, exit_code=None) -> dict:
+    return {"pid": pid, "port": port, "args": ["app"], "started": 1.0, "exit_code": exit_code, "restarts": 0}
+
+
+@pytest.fixture
+def state(tmp_path):
+    return SharedState(str(tmp_path / "state.db"), history_size=3)
+
+
+def test_claim_workers(state):
+    assert state.claim_workers("app", POOL, (9000, 9010)) == [(0, 9000), (1, 9001)]
+    assert state.claim_workers("other", POOL, (9000, 9010)) == [(0, 9002), (1, 9003)]
+    with pytest.raises(ValueError):
+        state.claim_workers("app", POOL, (9000, 9010))
+    with pytest.raises(ValueError):
+        state.claim_workers("third", POOL, (9000, 9004))
+
+
+def test_runs_by_pid(state):
+    state.claim_workers("app", POOL, (9000, 9010))
+    state.worker_started("app", 0, _worker(101, 9000))
+    state.worker_started("app", 1, _worker(102, 9001))
+    assert state.alive_ports("app") == [9000, 9001]
+    assert state.request_stop(102) == ("app", 1, state.owner, "running", process_start(102))
+    assert state.request_stop(999) is None
+    # a worker asked to stop is not restarted
+    assert not state.worker_exited("app", 1, _worker(102, 9001, 0), restart=True, stopped=False)
+    assert state.worker_exited("app", 0, _worker(101, 9000, 1), restart=True, stopped=False)
+    assert state.claim_restart("app", 0)
+    statuses = {i["index"]: i["state"] for i in state.pools_status("app")["app"]["workers"]}
+    assert statuses == {0: "starting", 1: "stopped"}
+
+
+def test_runs_history(state):
+    state.claim_workers("app", POOL, (9000, 9010))
+    for pid in range(100, 105):
+        state.worker_exited("app", 0, _worker(pid, 9000, 0), restart=False, stopped=False)
+    total, runs = state.runs("app", limit=2)
+    assert total == 3
+    assert [i["pid"] for i in runs] == [104, 103]
+    assert state.runs("app", offset=2)[1][0]["pid"] == 102
+
+
+def test_remove_pool(state):
+    state.claim_workers("app", POOL, (9000, 9010))
+    state.worker_started("app", 0, _worker(101, 9000))
+    assert state.remove_pool("app") == [(101, state.owner, process_start(101))]
+    assert state.pools_status() == {}
+
+
+def test_process_start():
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    start = process_start(process.pid)
+    assert start is not None and start == process_start(process.pid)
+    process.kill()
+    process.wait()
+    assert process_start(process.pid) is None
+
+
+@pytest.mark.parametrize("same_process", [True, False])
+def test_reap_lost_kills_only_the_recorded_process(state, same_process):
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        state.claim_workers("app", POOL, (9000, 9010))
+        state.worker_started("app", 0, _worker(process.pid, 9000))
+        if not same_process:  # the pid was reused after a restart of the daemon or a reboot
+            state.db.execute("UPDATE workers SET pid_start = 'other boot:1'")
+        state.reap_lost()  # rows of this process are left from a previous one with the same pid
+        assert state.pools_status("app")["app"]["workers"][0]["state"] == "exited"
+        assert (process.wait(5) if same_process else process.poll()) == (-9 if same_process else None)
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_database_is_private(tmp_path):
+    state = SharedState(str(tmp_path / "state.db"))
+    state.queue_counts()
+    assert [stat.S_IMODE(i.stat().st_mode) for i in sorted(tmp_path.iterdir())] == [0o600] * 3
@@ -0,0 +1,112 @@
+import resource
+import sys
+import time
+
+import pytest
+from state import SharedState
+from supervisor import Supervisor, resource_limits
+
+SLEEP = [sys.executable, "-c", "import time; time.sleep(60)"]
+FAIL = [sys.executable, "-c", "raise SystemExit(3)"]
+
+
+@pytest.fixture
+def supervisor(tmp_path):
+    supervisor = Supervisor((9500, 9599), SharedState(str(tmp_path / "state.db")))
+    yield supervisor
+    supervisor.shutdown()
+
+
+def _wait(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(0.05)
+    raise AssertionError("condition not reached")
+
+
+def test_pool(supervisor, tmp_path):
+    workers = supervisor.start("app", SLEEP, {}, str(tmp_path), size=2)
+    assert sorted(i.port for i in workers) == [9500, 9501]
+    status = supervisor.status("app")["app"]
+    assert [i["state"] for i in status["workers"]] == ["running", "running"]
+    assert sorted(supervisor.alive_ports("app")) == [9500, 9501]
+    with pytest.raises(ValueError):
+        supervisor.start("app", SLEEP, {}, str(tmp_path), size=2)
+    assert supervisor.stop_pid(workers[0].pid)
+    assert supervisor.alive_ports("app") == [workers[1].port]
+    assert not supervisor.stop_pid(workers[0].pid)
+    # the stopped slot is started again
+    assert [i.index for i in supervisor.start("app", SLEEP, {}, str(tmp_path), size=2)] == [workers[0].index]
+
+
+def test_exits_are_recorded(supervisor, tmp_path):
+    worker = supervisor.start("app", FAIL, {}, str(tmp_path))[0]
+    _wait(lambda: supervisor.runs("app")[0])
+    run = supervisor.runs("app")[1][0]
+    assert run["pid"] == worker.pid and run["exit_code"] == 3
+    assert supervisor.status("app")["app"]["workers"][0]["state"] == "exited"
+
+
+def test_restart_on_failure(supervisor, tmp_path):
+    supervisor.start("app", FAIL, {}, str(tmp_path), restart="on-failure")
+    _wait(lambda: supervisor.runs("app")[0] >= 2)
+    runs = supervisor.runs("app")[1]
+    assert [i["restarts"] for i in runs[::-1]][:2] == [0, 1]
+    supervisor.remove("app")
+    assert supervisor.status("app") == {}
+
+
+def test_stop_by_pid(supervisor, tmp_path):
+    workers = supervisor.start("app", SLEEP, {}, str(tmp_path), size=2)
+    assert not supervisor.stop_pid(1)
+    assert supervisor.stop_pid(workers[1].pid)
+    assert supervisor.alive_ports("app") == [workers[0].port]
+    assert supervisor.status("app", "running")["app"]["workers"][0]["pid"] == workers[0].pid
+
+
+def test_restart_policy_is_checked(supervisor, tmp_path):
+    with pytest.raises(ValueError):
+        supervisor.start("app", SLEEP, {}, str(tmp_path), restart="sometimes")
+
+
+@pytest.mark.parametrize("preload", [None, ["json"]])
+def test_limits_are_set_before_the_app_runs(supervisor, tmp_path, preload):
+    (tmp_path / "app.py").write_text(
+        "import resource\nopen('nofile', 'w').write(str(resource.getrlimit(resource.RLIMIT_NOFILE)))\n"
+    )
+    cmd = [sys.executable, "app.py"]
+    supervisor.start("app", cmd, {}, str(tmp_path), limits={"nofile": 64, "unknown": 1}, preload=preload)
+    assert _wait(lambda: (tmp_path / "nofile").exists() and (tmp_path / "nofile").read_text()) == "(64, 64)"
+
+
+def test_resource_limits():
+    hard = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+    nofile = 64 if hard == resource.RLIM_INFINITY else hard
+    limits = {"nofile": nofile + 1 if nofile == hard else nofile, "cpu_seconds": "x", "other": 1}
+    assert resource_limits(limits) == [(resource.RLIMIT_NOFILE, nofile)]  # lowered to the hard limit
+    assert resource_limits({"memory_mb": 2}) == [(resource.RLIMIT_AS, 2 * 1024 * 1024)]
+
+
+def test_fork_server_runs_without_credentials(supervisor, tmp_path):
+    (tmp_path / "probe.py").write_text("import os\nSEEN = os.environ.get('nc_auth_pass', '')\n")
+    (tmp_path / "app.py").write_text(
+        "import os, probe\nopen('seen', 'w').write(probe.SEEN + '|' + os.environ['nc_auth_pass'])\n"
+    )
+    env = {"nc_auth_user": "alice", "nc_auth_pass": "secret", "nextcloud_url": "http://nc"}
+    supervisor.start("app", [sys.executable, "app.py"], env, str(tmp_path), preload=["probe"])
+    assert _wait(lambda: (tmp_path / "seen").exists() and (tmp_path / "seen").read_text()) == "|secret"
+
+
+def test_restarts_use_the_environment_of_their_start(supervisor, tmp_path):
+    (tmp_path / "app.py").write_text(
+        "import os\nopen('run-' + os.environ['app_worker'], 'a').write(os.environ['who'])\nraise SystemExit(1)\n"
+    )
+    cmd = [sys.executable, "app.py"]
+    supervisor.start("app", cmd, {"who": "a"}, str(tmp_path), size=1, restart="on-failure")
+    supervisor.start("app", cmd, {"who": "b"}, str(tmp_path), size=2, restart="on-failure")
+    _wait(lambda: (tmp_path / "run-0").exists() and len((tmp_path / "run-0").read_text()) >= 2)
+    assert set((tmp_path / "run-0").read_text()) == {"a"}
+    assert set((tmp_path / "run-1").read_text()) == {"b"}